@@ -2,18 +2,26 @@ import bow_api
 import bow_data
 
 import math
+import os
+import sys
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 import cv2
 import imutils
-import numpy as np
+
+# Make the shared tutorial utilities importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "Utilities", "Python"))
+from bow_utils import AdaptiveDetectionRate, DetectionBatch, DetectionWorkerPool, ImageDecoder, ObjectTracker, \
+    VisionCapture
 
 from openai_brain import Brain
 from PIL import Image, ImageTk
-from ultralytics import YOLO
 from robot_controller import RobotController
 
+# Seconds to wait for the first image from the robot before giving up
+camera_timeout = 10
+
 class GUI:
     def __init__(self, master, brain, controller):
         self.master = master
@@ -109,15 +117,6 @@ class GUI:
             self.image_label.configure(image=image)
             self.image_label.image = image
 
-# Basic class to hold detected object details
-class DetectedObject:
-    def __init__(self):
-        self.classification = None
-        self.confidence = None
-        self.box = None
-        self.center = [None, None]
-        self.area = 0.0
-
 def on_closing(window, robot):
     if messagebox.askokcancel("Quit", "Do you want to quit?"):
         window.destroy()
@@ -137,13 +136,36 @@ def main():
     gui = GUI(root, brain, controller)
     root.protocol("WM_DELETE_WINDOW", lambda window=root, robot=controller.robot: on_closing(root, controller.robot))
 
-    #Initialise the object detection
-    model = YOLO('yolov8n.pt')  # load an official detection model
-    objects = []
+    # Initialise the object detection in a pool of processes, leaving a core free for the GUI and controller
+    detector = DetectionWorkerPool('yolov8n.pt', num_workers=max(1, (os.cpu_count() or 2) - 1))
+    detector.start()
+    detector.wait_ready()
+    objects = DetectionBatch.empty(detector.names)
+
+    # Only detect at full rate while searching or while objects are moving, reusing the last detections otherwise
+    detection_rate = AdaptiveDetectionRate(active_rate=10, idle_rate=1, cpu_budget=0.5)
+
+    # Track objects between detections so every frame has boxes with stable identities, keeping each track for
+    # longer than the gap between idle detections so still objects are not dropped just before they are seen again
+    tracker = ObjectTracker(max_age=2.5 / detection_rate.idle_rate)
+    decoder = ImageDecoder()
+
+    # Receive camera images on a background thread so the GUI and controller never wait on the network
+    capture = VisionCapture(controller.robot)
+    capture.start()
 
     # Main loop
     try:
-        while True:
+        # Always use the first camera the robot reports
+        sources = capture.wait_for_sources(timeout=camera_timeout)
+        if len(sources) == 0:
+            print(f"No images received from the robot within {camera_timeout}s, check that its camera is available")
+            stopFlag = True
+        else:
+            camera_source = sources[0]
+            stopFlag = False
+
+        while not stopFlag:
             # Test for completed functions and relay results to openai assistant as "assistant" messages
             if controller.searchComplete is not None:
                 if controller.searchComplete == "success":
@@ -152,99 +174,84 @@ def main():
                     brain.request("Search Failed", "assistant", gui)
                 controller.searchComplete = None
 
-            # Get camera images from BOW robot
-            image_list, err = controller.robot.vision.get(True)
-            if err.Success:
-                if len(image_list.Samples) > 0:
-                    imsample = image_list.Samples[0]
-
-                    if imsample is None or not imsample.NewDataFlag:
-                        continue
-
-                    if imsample.ImageType == bow_data.ImageSample.ImageTypeEnum.RGB:
-                        npimage = np.frombuffer(imsample.Data, np.uint8).reshape(
-                            [int(imsample.DataShape[1] * 3 / 2), imsample.DataShape[0]])
-                        cvImage = cv2.cvtColor(npimage, cv2.COLOR_YUV2RGB_I420)
-                    elif imsample.ImageType == bow_data.ImageSample.ImageTypeEnum.DEPTH:
-                        cvImage = np.frombuffer(imsample.Data, np.uint16).reshape(
-                            [imsample.DataShape[1], imsample.DataShape[0]])
+            # Get the newest camera image from BOW robot without waiting on the network
+            frame = capture.wait_next(camera_source, timeout=0.01)
+            if frame is not None:
+                imsample = frame.sample
+
+                cvImage = decoder.decode(imsample)
+                if cvImage is None:
+                    continue
+
+                cvImage = imutils.rotate_bound(cvImage, imsample.Transform.EulerAngles.X * 180 / math.pi)
+                # Set camera parameters on first instance
+                if controller.VFOV is None:
+                    if imsample.VFOV == 0:
+                        controller.VFOV = 40
+                    else:
+                        controller.VFOV = imsample.VFOV
+
+                    if imsample.HFOV == 0:
+                        controller.HFOV = 80
                     else:
-                        continue
-
-                    cvImage = imutils.rotate_bound(cvImage, imsample.Transform.EulerAngles.X * 180 / math.pi)
-                    # Set camera parameters on first instance
-                    if controller.VFOV is None:
-                        if imsample.VFOV == 0:
-                            controller.VFOV = 40
-                        else:
-                            controller.VFOV = imsample.VFOV
-
-                        if imsample.HFOV == 0:
-                            controller.HFOV = 80
-                        else:
-                            controller.HFOV = imsample.HFOV
-
-                    # Pass image into yolo model
-                    results = model.predict(source=cvImage, show=False, stream_buffer=False, verbose=False)
-
-                    # Iterate though detected objects and populate objects list and details
-                    if len(results) > 0:
-                        for box in results[0].boxes.cpu():
-                            obj = DetectedObject()
-                            obj.classification = model.names[int(box.data[0][-1])]
-                            obj.confidence = box.conf.numpy()[0]
-                            obj.box = box.xyxy.numpy()[0]
-                            width = obj.box[2] - obj.box[0]
-                            height = obj.box[3] - obj.box[1]
-                            area = width * height
-                            imgArea = imsample.DataShape[0] * imsample.DataShape[1]
-                            obj.area = area / imgArea
-                            center = (int(obj.box[0] + width / 2), int(obj.box[1] + height / 2))
-                            obj.center[0] = center[0] * (1/imsample.DataShape[0])
-                            obj.center[1] = 1-(center[1] * (1 / imsample.DataShape[1]))
-                            objects.append(obj)
-
-                    # Draw detections on image
-                    annotated_img = cvImage
-                    for obj in objects:
-                        colour = (61, 201, 151)
-                        if controller.targetClass is not None or controller.prevTargetClass is not None:
-                            if obj.classification == controller.targetClass:
-                                colour = (36, 108, 243)
-                            if obj.classification == controller.prevTargetClass:
-                                colour = (36, 108, 243)
-
-                        annotated_img = cv2.rectangle(annotated_img, (int(obj.box[0]), int(obj.box[1])),
-                                                      (int(obj.box[2]), int(obj.box[3])), colour, thickness=3)
-                        # Set the label position
-                        label_x = int(obj.box[0])
-                        label_y = int(obj.box[1]) - 10  # Position above the box by default
-
-                        # Check if the label is going off-screen
-                        if label_y < 10:
-                            label_y = int(obj.box[3]) + 20  # Position below the box
-
-                        # Draw the label
-                        cv2.putText(annotated_img, obj.classification, (label_x, label_y),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, colour, 1)
-
-                    # Pass objects list to robot controller
-                    controller.object_list = objects
-
-                    # Update gui image
-                    gui.update_image(annotated_img)
-
-                    # Update controller
-                    ret = controller.update()
-
-                # Update the Tkinter window
-                objects = []
-                root.update_idletasks()
-                root.update()
+                        controller.HFOV = imsample.HFOV
+
+                # Pass image to the detection workers when due, this is skipped if they are all busy
+                if detection_rate.due(active=controller.search):
+                    detector.submit(cvImage, tag=frame.timestamp)
+
+                # Feed finished detections, in the order the images were sent, into the tracker
+                for result in detector.results():
+                    detection_rate.update(result, imsample.DataShape[0], imsample.DataShape[1])
+                    tracker.update(result.boxes, result.class_ids, result.confidences, result.tag)
+
+                # Build the detections for this frame from the tracked objects, computing the centre and area of
+                # every object at once
+                objects = DetectionBatch.from_tracks(tracker.predict(frame.timestamp), detector.names,
+                                                     imsample.DataShape[0], imsample.DataShape[1])
+
+                # Draw detections on image
+                annotated_img = cvImage
+                for obj in objects:
+                    colour = (61, 201, 151)
+                    if controller.targetClass is not None or controller.prevTargetClass is not None:
+                        if obj.classification == controller.targetClass:
+                            colour = (36, 108, 243)
+                        if obj.classification == controller.prevTargetClass:
+                            colour = (36, 108, 243)
+
+                    annotated_img = cv2.rectangle(annotated_img, (int(obj.box[0]), int(obj.box[1])),
+                                                  (int(obj.box[2]), int(obj.box[3])), colour, thickness=3)
+                    # Set the label position
+                    label_x = int(obj.box[0])
+                    label_y = int(obj.box[1]) - 10  # Position above the box by default
+
+                    # Check if the label is going off-screen
+                    if label_y < 10:
+                        label_y = int(obj.box[3]) + 20  # Position below the box
+
+                    # Draw the label
+                    cv2.putText(annotated_img, obj.classification, (label_x, label_y),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, colour, 1)
+
+                # Pass objects list to robot controller
+                controller.set_object_list(objects)
+
+                # Update gui image
+                gui.update_image(annotated_img)
+
+                # Update controller
+                ret = controller.update()
+
+            # Update the Tkinter window
+            root.update_idletasks()
+            root.update()
     except KeyboardInterrupt or SystemExit:
         print("Closing down")
         stopFlag = True
 
+    capture.stop()
+    detector.stop()
     controller.robot.disconnect()
     bow_api.close_client_interface()
 
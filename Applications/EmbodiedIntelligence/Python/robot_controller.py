@@ -4,6 +4,8 @@ import bow_data
 import time
 import logging
 
+from bow_utils import DetectionBatch, DetectionIndex
+
 
 class RobotController:
     def __init__(self):
@@ -24,13 +26,15 @@ class RobotController:
         # Target Def
         self.prevTargetClass = None
         self.targetClass = None
-        self.object_list = []
+        self.object_list = DetectionBatch.empty()
+        self.object_index = DetectionIndex(self.object_list)
 
         # Search Configuration
         self.searchVelocity = 0.4  # The Angular velocity commanded during a search
         self.searchPeriod = 1  # The length of time in seconds the robot will rotate/pause for as it searches
         self.searchCounterLim = 10  # The number of search periods the robot will go through before aborting the search
         self.frameCountTarget = 3  # The number of consecutive frames containing the target object for search success
+        self.minTrackHits = 2  # The number of detections a tracked object needs before it counts towards search success
 
         # Search Init
         self.search = False
@@ -40,6 +44,7 @@ class RobotController:
         self.searchComplete = None
         self.periodCounter = 0
         self.frameCounter = 0
+        self.targetTrackId = None
 
         # Rotate Init
         self.rotateStopTime = 0.0
@@ -113,6 +118,7 @@ class RobotController:
         self.rotateStopTime = time.time() + self.searchPeriod
         self.periodCounter = 0
         self.frameCounter = 0
+        self.targetTrackId = None
         if searchDir == "right":
             self.dir = -1
         else:
@@ -136,15 +142,27 @@ class RobotController:
         if step >= 0.1:
             self.prevTime = current_time
 
-            # Look for target object in detections
-            for obj in self.object_list:
-                if obj.classification == self.targetClass:
-                    targetObj = obj
-
-            # Increment counter if object is in current detections and reset if not
+            # Look for target object in detections, preferring the tracked object already being counted.
+            # Objects seen by only a single detection are ignored so a false detection carried forward by the
+            # tracker cannot complete the search
+            if self.targetTrackId is not None:
+                targetObj = self.object_index.track(self.targetTrackId)
+            if targetObj is None or targetObj.classification != self.targetClass or \
+                    targetObj.hits < self.minTrackHits:
+                targetObj = None
+                candidates = self.object_index.indices(self.targetClass)
+                confirmed = candidates[self.object_list.hits[candidates] >= self.minTrackHits]
+                if len(confirmed) > 0:
+                    targetObj = self.object_list[int(confirmed[0])]
+
+            # Increment counter if the same object is in current detections and reset if not
             if targetObj is not None:
+                if targetObj.track_id != self.targetTrackId:
+                    self.targetTrackId = targetObj.track_id
+                    self.frameCounter = 0
                 self.frameCounter += 1
             else:
+                self.targetTrackId = None
                 self.frameCounter = 0
 
             # Test for search success condition
@@ -180,12 +198,14 @@ class RobotController:
                     self.rotateStopTime = time.time() + self.searchPeriod
                     self.periodCounter += 1
 
+    def set_object_list(self, objects):
+        # Store the current detections and index them by class and track for the search and assistant tools
+        self.object_list = objects
+        self.object_index = DetectionIndex(objects)
+
     def retrieve_items(self):
         # Format list of current detections as string
-        list_string = ""
-        for obj in self.object_list:
-            list_string += ", " + obj.classification
-        return list_string
+        return "".join(", " + classification for classification in self.object_list.classifications)
 
     def get_running(self):
         # Format list of currently running operations and targets as string
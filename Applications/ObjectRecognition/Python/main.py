@@ -9,96 +9,143 @@ import bow_api
 import bow_data
 
 import logging
-import numpy as np
+import os
 import sys
 import cv2
-from ultralytics import YOLO
 
-# Create a logger for our robot connection and print version info
-print(bow_api.version())
+# Make the shared tutorial utilities importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "Utilities", "Python"))
+from bow_utils import DetectionWorkerPool, Display, ImageDecoder, LoopProfiler, VisionCapture
 
-# Connect to the robot selected in BOW Hub
-myrobot, error = bow_api.quick_connect(app_name="Vision - Object Detection", channels=["vision"])
-if not error.Success:
-    print("Failed to connect to robot", error)
-    sys.exit()
+# Define a colour for our image annotations
+colour = (61, 201, 151)
 
-# Create a flag so we can exit our main loop
-stopFlag = False
+# Number of processes running the object detection model
+num_workers = max(1, (os.cpu_count() or 2) - 1)
 
-# Create our YOLO object detection model
-model = YOLO('yolov8n.pt')  # load an official detection model
+# Seconds to wait for the first image from the robot before giving up
+camera_timeout = 10
 
-# Define a colour for our image annotations
-colour = (61, 201, 151)
 
-try:
-    while not stopFlag:
-        # Sense
+def draw_detections(image, detections, names):
+    # Iterate though detected objects and draw them on the image
+    for corners, class_id in zip(detections.boxes, detections.class_ids):
+        classification = names[int(class_id)]  # models predicted object classification
+
+        # Draw the bounding box onto the image in our chosen colour
+        cv2.rectangle(image, (int(corners[0]), int(corners[1])), (int(corners[2]), int(corners[3])),
+                      colour, thickness=3)
+
+        # Set the label position
+        label_x = int(corners[0])
+        label_y = int(corners[1]) - 10  # Position above the box by default
+        # Check if the label is going off-screen
+        if label_y < 10:
+            label_y = int(corners[3]) + 20  # Position below the box
+
+        # Draw the label onto the image in our chosen colour
+        cv2.putText(image, classification, (label_x, label_y),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, colour, 1)
+
+
+def main():
+    # Create a logger for our robot connection and print version info
+    print(bow_api.version())
+
+    # Connect to the robot selected in BOW Hub
+    myrobot, error = bow_api.quick_connect(app_name="Vision - Object Detection", channels=["vision"])
+    if not error.Success:
+        print("Failed to connect to robot", error)
+        sys.exit()
+
+    # Create a flag so we can exit our main loop
+    stopFlag = False
+
+    # Start a pool of processes which each load the YOLO object detection model, so detection runs in
+    # parallel with this loop and across every CPU core
+    detector = DetectionWorkerPool('yolov8n.pt', num_workers=num_workers)  # load an official detection model
+    detector.start()
+    detector.wait_ready()
+
+    # Time each stage of the loop, set BOW_PROFILE=1 to print the timings every 10 seconds
+    profiler = LoopProfiler(report_period=10.0, enabled=os.getenv("BOW_PROFILE", "0") == "1")
+
+    # Create a decoder which reuses its output image between frames
+    decoder = ImageDecoder()
+
+    # Render at most 30 times a second, set BOW_DISPLAY=null, mjpeg or disk:DIRECTORY to run without a screen
+    display = Display(max_fps=30)
+
+    # Retrieve images from the robot using the vision modality on a background thread, so a slow model
+    # never holds up the connection and we only ever process the newest image
+    capture = VisionCapture(myrobot, profiler=profiler)
+    capture.start()
 
-        # Retrieve all images from the robot using the vision modality
-        image_list, err = myrobot.vision.get(True)
-        # Test for failures
-        if not err.Success or len(image_list.Samples) == 0:
-            continue
+    # The most recent detections returned by the workers
+    detections = None
 
+    try:
         # For this example we will always use the first camera in the list
-        img_data = image_list.Samples[0]
-
-        # Test for new and valid data
-        if img_data is not None and img_data.NewDataFlag:
-
-            # Extract OpenCV image
-            if img_data.ImageType == bow_data.ImageSample.ImageTypeEnum.RGB:
-                npimage = np.frombuffer(img_data.Data, np.uint8).reshape(
-                    [int(img_data.DataShape[1] * 3 / 2), img_data.DataShape[0]])
-                myIm = cv2.cvtColor(npimage, cv2.COLOR_YUV2RGB_I420)
-            elif img_data.ImageType == bow_data.ImageSample.ImageTypeEnum.DEPTH:
-                myIm = np.frombuffer(img_data.Data, np.uint16).reshape(
-                    [img_data.DataShape[1], img_data.DataShape[0]])
-            else:
-                continue
-
-            # Pass image into the yolo model for object detection
-            results = model.predict(source=myIm, show=False, stream_buffer=False, verbose=False)
-
-            # Iterate though detected objects and draw them on the image
-            if len(results) > 0:
-                for box in results[0].boxes.cpu():
-                    # Extract data from results in a useful form
-                    corners = box.xyxy.numpy()[0] # Corners of the detected objects bounding box
-                    classification = model.names[int(box.data[0][-1])] # models predicted object classification
-
-                    # Draw the bounding box onto the image in our chosen colour
-                    myIm = cv2.rectangle(myIm, (int(corners[0]), int(corners[1])), (int(corners[2]), int(corners[3])),
-                                         colour, thickness=3)
-
-                    # Set the label position
-                    label_x = int(corners[0])
-                    label_y = int(corners[1]) - 10  # Position above the box by default
-                    # Check if the label is going off-screen
-                    if label_y < 10:
-                        label_y = int(corners[3]) + 20  # Position below the box
-
-                    # Draw the label onto the image in our chosen colour
-                    cv2.putText(myIm, classification, (label_x, label_y),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, colour, 1)
-
-            # Display the image
-            cv2.imshow(img_data.Source, myIm)
-
-        # Check for keyboard escape
-        j = cv2.waitKeyEx(1)
-        if j == 27:
-            break
-
-# Kill on ctrl-c or closure
-except KeyboardInterrupt or SystemExit:
-    cv2.destroyAllWindows()
-    print("Closing down")
-    stopFlag = True
-
-# Handle disconnect of robot on exit
-cv2.destroyAllWindows()
-myrobot.disconnect()
-bow_api.close_client_interface()
+        sources = capture.wait_for_sources(timeout=camera_timeout)
+        if len(sources) == 0:
+            print(f"No images received from the robot within {camera_timeout}s, check that its camera is available")
+            stopFlag = True
+        else:
+            camera_source = sources[0]
+
+        while not stopFlag:
+            # Sense
+
+            # Wait briefly for an image we have not processed yet
+            frame = capture.wait_next(camera_source, timeout=0.1)
+
+            # Test for new and valid data
+            if frame is not None:
+                img_data = frame.sample
+
+                # Extract OpenCV image
+                with profiler.stage("decode"):
+                    myIm = decoder.decode(img_data)
+                if myIm is None:
+                    continue
+
+                # Pass image to the workers for object detection, this is skipped if they are all busy
+                with profiler.stage("submit"):
+                    detector.submit(myIm)
+
+                # Collect any finished detections, which arrive in the order the images were sent
+                for result in detector.results():
+                    detections = result
+                    profiler.record("predict", result.duration)
+
+                # Draw the latest detections on the image
+                if detections is not None:
+                    with profiler.stage("draw"):
+                        draw_detections(myIm, detections, detector.names)
+
+                # Display the image
+                with profiler.stage("display"):
+                    display.show(img_data.Source, myIm)
+
+            # Pump the window events once per frame and check for keyboard escape
+            j = display.poll()
+            profiler.tick()
+            if j == 27:
+                break
+
+    # Kill on ctrl-c or closure
+    except KeyboardInterrupt or SystemExit:
+        print("Closing down")
+        stopFlag = True
+
+    # Handle disconnect of robot on exit
+    display.close()
+    capture.stop()
+    detector.stop()
+    myrobot.disconnect()
+    bow_api.close_client_interface()
+
+
+# The detection workers re-import this file, so only run when started directly
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+# Imports
+import bow_api
+import bow_data
+
+import os
+import sys
+import time
+import cv2
+from ultralytics import YOLO
+
+# Make the shared tutorial utilities importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "Utilities", "Python"))
+from bow_utils import BatchDetector, Display, ImageDecoder, VisionCapture
+
+# Define a colour for our image annotations
+colour = (61, 201, 151)
+
+# How often to print the aggregate detection rate, in seconds
+report_period = 5.0
+
+
+def draw_detections(image, result):
+    # Iterate though detected objects and draw them on the image
+    for box in result.boxes.cpu():
+        # Extract data from results in a useful form
+        corners = box.xyxy.numpy()[0]  # Corners of the detected objects bounding box
+        classification = model.names[int(box.data[0][-1])]  # models predicted object classification
+
+        # Draw the bounding box onto the image in our chosen colour
+        cv2.rectangle(image, (int(corners[0]), int(corners[1])), (int(corners[2]), int(corners[3])),
+                      colour, thickness=3)
+
+        # Set the label position
+        label_x = int(corners[0])
+        label_y = int(corners[1]) - 10  # Position above the box by default
+        # Check if the label is going off-screen
+        if label_y < 10:
+            label_y = int(corners[3]) + 20  # Position below the box
+
+        # Draw the label onto the image in our chosen colour
+        cv2.putText(image, classification, (label_x, label_y), cv2.FONT_HERSHEY_SIMPLEX, 0.7, colour, 1)
+
+
+print(bow_api.version())
+
+# Setup the BOW Client
+setup_result = bow_api.setup(app_name="Vision - Fleet Object Detection", verbose=True)
+if not setup_result.Success:
+    sys.exit(-1)
+
+# Login to BOW using systray login
+login_result = bow_api.login_user("", "", True)
+if login_result.Success:
+    print("Logged in")
+else:
+    sys.exit(-1)
+
+# Get robots
+get_robots_result = bow_api.get_robots(get_local=True, get_remote=True, get_bow_hub=False)
+if not get_robots_result.localSearchError.Success:
+    print(get_robots_result.localSearchError.Description)
+
+if not get_robots_result.remoteSearchError.Success:
+    print(get_robots_result.remoteSearchError.Description)
+
+# Filter out only the available robots
+available_robots = [r for r in get_robots_result.robots if r.robot_state.available]
+if len(available_robots) == 0:
+    print("No available robots found")
+    bow_api.close_client_interface()
+    sys.exit(-1)
+
+# Connect to every available robot and open its vision channel
+robots = []
+for robot_details in available_robots:
+    robot = bow_api.Robot(robot_details)
+    result = robot.connect()
+    if not result.Success:
+        print("Could not connect with robot {}".format(robot.robot_details.robot_id))
+        continue
+
+    result = robot.open_channel("vision")
+    if not result.Success:
+        print("Failed to open vision channel: " + result.Description)
+        robot.disconnect()
+        continue
+
+    print(f"Connected to {robot.robot_details.name}")
+    robots.append(robot)
+
+if len(robots) == 0:
+    bow_api.close_client_interface()
+    sys.exit(-1)
+
+# Receive images from every robot in the background, with one decoder per robot since camera names repeat
+captures = [VisionCapture(robot) for robot in robots]
+decoders = [ImageDecoder() for _ in robots]
+for capture in captures:
+    capture.start()
+
+# Create our YOLO object detection model and wrap it so every camera is processed in a single call
+model = YOLO('yolov8n.pt')  # load an official detection model
+detector = BatchDetector(model, device="cpu")
+
+# Render at most 30 times a second, set BOW_DISPLAY=null, mjpeg or disk:DIRECTORY to run without a screen
+display = Display(max_fps=30)
+
+frame_count = 0
+report_time = time.time()
+
+try:
+    while True:
+        # Sense
+        # Gather the newest colour image from every camera on every robot
+        images = {}
+        for robot, capture, decoder in zip(robots, captures, decoders):
+            for frame in capture.wait_next_all(timeout=0):
+                img_data = frame.sample
+                if img_data.ImageType != bow_data.ImageSample.ImageTypeEnum.RGB:
+                    continue
+
+                image = decoder.decode(img_data)
+                if image is not None:
+                    images[(robot.robot_details.name, img_data.Source)] = image
+
+        if len(images) == 0:
+            time.sleep(0.005)
+            continue
+
+        # Pass every image into the yolo model as one batch and draw each result onto its own image
+        results = detector.predict(images)
+        for key, result in results.items():
+            draw_detections(images[key], result)
+            display.show(f"{key[0]} - {key[1]}", images[key])
+
+        # Report the combined throughput across the fleet
+        frame_count += len(images)
+        if time.time() - report_time >= report_period:
+            print(f"Detecting at {frame_count / (time.time() - report_time):.1f} frames/s "
+                  f"across {len(robots)} robots")
+            frame_count = 0
+            report_time = time.time()
+
+        # Pump the window events once per frame and check for keyboard escape
+        j = display.poll()
+        if j == 27:
+            break
+
+# Kill on ctrl-c or closure
+except KeyboardInterrupt or SystemExit:
+    print("Closing down")
+
+# Handle disconnect of robots on exit
+display.close()
+for robot, capture in zip(robots, captures):
+    capture.stop()
+    robot.disconnect()
+bow_api.close_client_interface()
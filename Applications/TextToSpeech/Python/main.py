@@ -13,11 +13,13 @@ from typing import List, Dict
 
 import bow_api
 import bow_data
-import cv2
-import numpy as np
 from pynput import keyboard
 from tts import TTS  # Import the TTS class
 
+# Make the shared tutorial utilities importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "Utilities", "Python"))
+from bow_utils import Display, ImageDecoder, KeyboardTeleop, LOCOMOTION_BINDINGS, MotorScheduler
+
 # Constants for audio settings and control logic
 SAMPLE_RATE = 24_000
 NUM_CHANNELS = 1
@@ -28,6 +30,9 @@ NUM_SAMPLES = SAMPLE_RATE // AUDIO_TRANSMIT_RATE
 CHUNK_SIZE = NUM_CHANNELS * NUM_SAMPLES
 
 
+MOTOR_RATE = 50  # Motor commands sent per second
+MOTOR_KEEPALIVE = 0.5  # An unchanged motor command is only sent again this often, in seconds
+
 SPEECH_RATE_LIMIT = 15  # 15 seconds
 DEBOUNCE_TIME = 1  # 1 second debounce time for 'v' key
 
@@ -52,7 +57,9 @@ class RobotController:
         self.stop_flag = False
         self.window_names: Dict[str, str] = {}
         self.windows_created = False
-        self.pressed_keys = set()
+        self.decoder = ImageDecoder()
+        # Render at most 30 times a second, set BOW_DISPLAY=null, mjpeg or disk:DIRECTORY to run without a screen
+        self.display = Display(max_fps=30)
 
         # Initialize speech timing and actions
         self.last_speech_time = 0
@@ -79,8 +86,17 @@ class RobotController:
         print(self.robot.robot_details.robot_config.input_modalities)
         print(self.robot.robot_details.robot_config.output_modalities)
 
-        # Start keyboard listener for capturing key presses and releases
-        self.listener = keyboard.Listener(on_press=self.on_press, on_release=self.on_release)
+        # Send motor commands at a fixed rate, skipping repeats of an unchanged command between keepalives
+        self.motor_scheduler = MotorScheduler(self.robot, rate=MOTOR_RATE, keepalive=MOTOR_KEEPALIVE)
+        self.motor_scheduler.start()
+
+        # Start keyboard listener for capturing key presses and releases. The motor command is rebuilt as soon as a
+        # driving key changes and handed straight to the scheduler, without waiting for the next image
+        self.teleop = KeyboardTeleop(LOCOMOTION_BINDINGS,
+                                     on_change=lambda sample: self.motor_scheduler.set(sample, send_now=True))
+        # Start with every velocity at zero, so the robot is explicitly held still until a key is pressed
+        self.motor_scheduler.set(self.teleop.sample)
+        self.listener = keyboard.Listener(on_press=self.teleop.on_press, on_release=self.teleop.on_release)
         self.listener.start()
 
         # Start the speech processing thread
@@ -88,45 +104,16 @@ class RobotController:
         self.speech_thread.daemon = True
         self.speech_thread.start()
 
-    def on_press(self, key: keyboard.Key):
-        """Handle key press events."""
-        try:
-            self.pressed_keys.add(key.char)
-        except AttributeError:
-            pass
-
-    def on_release(self, key: keyboard.Key):
-        """Handle key release events."""
-        try:
-            self.pressed_keys.discard(key.char)
-        except AttributeError:
-            pass
-        if key == keyboard.Key.esc:
-            return False
-
     def show_all_images(self, images_list: List[bow_data.ImageSample]):
         """Display all images in the provided list."""
         if not self.windows_created:
             for i in range(len(images_list)):
                 window_name = f"RobotView{i} - {images_list[i].Source}"
                 self.window_names[images_list[i].Source] = window_name
-                cv2.namedWindow(window_name)
             self.windows_created = True
 
-        for i, img_data in enumerate(images_list):
-            if len(img_data.Data) != 0:
-                if img_data.NewDataFlag:
-                    if img_data.ImageType == bow_data.ImageSample.ImageTypeEnum.RGB:
-                        npimage = np.frombuffer(img_data.Data, np.uint8).reshape(
-                            [int(img_data.DataShape[1] * 3 / 2), img_data.DataShape[0]])
-                        npimage = cv2.cvtColor(npimage, cv2.COLOR_YUV2RGB_I420)
-                        cv2.imshow(self.window_names[img_data.Source], npimage)
-                    elif img_data.ImageType == bow_data.ImageSample.ImageTypeEnum.DEPTH:
-                        npimage = np.frombuffer(img_data.Data, np.uint16).reshape(
-                            [img_data.DataShape[1], img_data.DataShape[0]])
-                        cv2.imshow(self.window_names[img_data.Source], npimage)
-                    else:
-                        print("Unhandled image type")
+        for img_data, npimage in self.decoder.decode_all(images_list):
+            self.display.show(self.window_names[img_data.Source], npimage)
 
     def send_speech_command(self, text: str):
         # TODO open thread once and queue in speech to be processed.
@@ -189,34 +176,13 @@ class RobotController:
 
                 self.show_all_images(image_list)
 
-                # Handle motor commands based on key presses
-                motor_sample = bow_data.MotorSample()
-                action = None
-                if 'w' in self.pressed_keys:
-                    action = "Moving forward"
-                    motor_sample.Locomotion.TranslationalVelocity.X = 0.2
-                elif 's' in self.pressed_keys:
-                    action = "Moving backward"
-                    motor_sample.Locomotion.TranslationalVelocity.X = -0.2
-                elif 'd' in self.pressed_keys:
-                    action = "Rotate right"
-                    motor_sample.Locomotion.RotationalVelocity.Z = -1
-                elif 'a' in self.pressed_keys:
-                    action = "Rotate left"
-                    motor_sample.Locomotion.RotationalVelocity.Z = 1
-                elif 'e' in self.pressed_keys:
-                    action = "Strafe right"
-                    motor_sample.Locomotion.TranslationalVelocity.Y = -1
-                elif 'q' in self.pressed_keys:
-                    action = "Strafe left"
-                    motor_sample.Locomotion.TranslationalVelocity.Y = 1
-
-                # Send motor commands to the robot
-                self.robot.motor.set(motor_sample)
+                # The motor command follows the keys by itself, only the action being taken is needed here
+                actions = self.teleop.actions()
+                action = actions[0] if actions else None
 
                 # Handle speech commands with rate limiting and debounce logic
                 current_time = time.time()
-                if 'v' in self.pressed_keys:
+                if 'v' in self.teleop.pressed:
                     if current_time - self.last_v_press_time > DEBOUNCE_TIME:
                         # Speak the action if 'v' key is pressed and debounce time has passed
                         if action:
@@ -233,15 +199,19 @@ class RobotController:
 
                 self.last_action = action
 
-                cv2.waitKey(1)
+                # Pump the window events once per frame
+                self.display.poll()
 
         except KeyboardInterrupt:
             pass
         finally:
             # Clean up and close resources on exit
-            cv2.destroyAllWindows()
+            self.display.close()
             print("Closing down")
             self.stop_flag = True
+            self.listener.stop()
+            self.motor_scheduler.stop()
+            print(self.motor_scheduler.stats())
             self.robot.disconnect()
             bow_api.close_client_interface()
 
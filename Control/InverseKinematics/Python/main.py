@@ -8,35 +8,14 @@ import bow_api
 import bow_data
 
 import math
-import time
+import os
 import sys
 
-def SendObjective(robot, effector, x, y, z):
+import numpy as np
 
-    print("Sending objective: "+str(x)+", "+str(y)+", "+str(z))
-    mSamp = bow_data.MotorSample()
-    mSamp.IKSettings.Preset = bow_data.IKOptimiser.HIGH_ACCURACY
-
-    objective_command = bow_data.ObjectiveCommand()
-    objective_command.TargetEffector = effector
-    objective_command.ControlMode = bow_data.ControllerEnum.POSITION_CONTROLLER
-    objective_command.PoseTarget.Action = bow_data.ActionEnum.GOTO
-    objective_command.PoseTarget.TargetType = bow_data.PoseTarget.TargetTypeEnum.TRANSFORM
-    objective_command.PoseTarget.TargetScheduleType = bow_data.PoseTarget.SchedulerEnum.INSTANTANEOUS
-
-    objective_command.PoseTarget.LocalObjectiveWeights.Position = 1
-    objective_command.PoseTarget.LocalObjectiveWeights.Orientation = 0
-
-    objective_command.PoseTarget.Transform.Position.X = x
-    objective_command.PoseTarget.Transform.Position.Y = y
-    objective_command.PoseTarget.Transform.Position.Z = z
-
-    objective_command.Enabled = True
-    mSamp.Objectives.append(objective_command)
-
-    set_result = myRobot.motor.set(mSamp)
-    if not set_result.Success:
-        print("Failed to set motor channel")
+# Make the shared tutorial utilities importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "Utilities", "Python"))
+from bow_utils import TrajectoryStreamer, Workspace, controllable_effectors, parametric
 
 # Use quick_connect to connect to robot
 myRobot, error = bow_api.quick_connect(app_name="Inverse Kinematics", channels=["proprioception", "motor"], verbose=False)
@@ -49,6 +28,7 @@ effectorsList = []
 reachList = []
 upDownList = []
 partsList = []
+rootList = []
 
 # Wait for proprioception message so we can understand form of robot and get effectors
 while True:
@@ -62,35 +42,32 @@ while True:
     if len(propMsg.Effectors) == 0:
         continue
 
-    for part in propMsg.Parts:
-        for effector in part.Effectors:
-            # only get controllable effectors. This removes all effectors that don't have moveable joints within their kinematic chain
-            if not effector.IsControllable:
-                continue
-                
-            partsList.append(effector.Type)
-            effectorsList.append(effector.EffectorLinkName)
-            reachList.append(effector.Reach)
-            
-            # Effector is by default higher than root hence height offset should be positive
-            if effector.EndTransform.Position.Z > effector.RootTransform.Position.Z:
-                upDownList.append(1)
-
-            # Effector is by default lower than effector root hence height offset should be negative
-            else:
-                upDownList.append(-1)
-                
+    # only get controllable effectors. This removes all effectors that don't have moveable joints within their kinematic chain
+    for effector in controllable_effectors(propMsg):
+        partsList.append(effector.Type)
+        effectorsList.append(effector.EffectorLinkName)
+        reachList.append(effector.Reach)
+        rootList.append((effector.RootTransform.Position.X, effector.RootTransform.Position.Y,
+                         effector.RootTransform.Position.Z))
+
+        # Effector is by default higher than root hence height offset should be positive
+        if effector.EndTransform.Position.Z > effector.RootTransform.Position.Z:
+            upDownList.append(1)
+
+        # Effector is by default lower than effector root hence height offset should be negative
+        else:
+            upDownList.append(-1)
+
     break
 
 ## DECIDE ##
 
-selectedEffector = ""
-selectedReach = 0
-selectedUpDown = 1
+selectedEffectors = []
 
 # Prompt user for the target end effector in the terminal
 while True:
     print("Please select an option:")
+    print("0. All effectors at once")
     for i, effector in enumerate(effectorsList):
         print(f"{i + 1}. {effector} of type {partsList[i]} "
               f"with reach of {reachList[i]}m and default direction {upDownList[i]}")
@@ -101,44 +78,83 @@ while True:
         print("Invalid input. Please enter a valid integer index.")
         continue
 
+    if userInput == 0:
+        selectedEffectors = list(range(len(effectorsList)))
+        print("You selected all effectors")
+        break
+
     if userInput > 0 and userInput <= len(effectorsList):
-        selectedEffector = effectorsList[userInput - 1]
-        selectedReach = reachList[userInput - 1]
-        selectedUpDown = upDownList[userInput - 1]
-        print(f"You selected: {selectedEffector}")
+        selectedEffectors = [userInput - 1]
+        print(f"You selected: {effectorsList[userInput - 1]}")
         break
 
     print("Invalid choice. Please run the program again and select a valid number.")
 
 ## ACT ##
-# Movement Pattern Parameters
-circleRadius = selectedReach * 0.25 # Radius of the circle
-circleHeight = selectedReach * 0.3 # Z-Axis height of circle
-wobbleAmplitude = selectedReach * 0.05
+# Movement Pattern Parameters, as fractions of each effector's reach
+circleRadiusScale = 0.25 # Radius of the circle
+circleHeightScale = 0.3 # Z-Axis height of circle
+wobbleAmplitudeScale = 0.05
 wobbleFreqMultiplier = 6
-stepSize = 0.05
+stepSize = 0.05 # Seconds between points, the circles go round at one radian per second
 repeatCountLim = 10 # Number of repetitions of the loop
+unreachableTargets = "clamp" # What to do with targets out of reach: "clamp", "reject" or "raise"
+
+def circle_with_wobble(reach, upDown, centre):
+    circleRadius = reach * circleRadiusScale
+    circleHeight = reach * circleHeightScale
+    wobbleAmplitude = reach * wobbleAmplitudeScale
+
+    def path(t):
+        # Every point of the circle at once, one radian of angle per second
+        angle = t
+        x = centre[0] + circleRadius * np.cos(angle)
+        y = centre[1] + circleRadius * np.sin(angle)
+        z = centre[2] + upDown*(circleHeight + (wobbleAmplitude * np.cos(angle*wobbleFreqMultiplier)))
+        return np.stack((x, y, z), axis=1)
+    return path
+
+# Create all the movement coordinates up front. A single effector circles the robot's origin, while several at once
+# each circle their own root, with the height measured from the root too, so they keep out of each other's way
+paths = {}
+for i in selectedEffectors:
+    centre = (0, 0, 0) if len(selectedEffectors) == 1 else rootList[i]
+    paths[effectorsList[i]] = parametric(circle_with_wobble(reachList[i], upDownList[i], centre),
+                                         duration=2*math.pi, rate=1/stepSize)
+
+# Check every target against where each effector can reach before sending any, rather than leaving the solver on
+# the robot to find out. The workspace comes from the same proprioception sample as the reach and roots above
+workspace = Workspace.from_proprioception(propMsg)
+paths, reports = workspace.check(paths, unreachableTargets)
+for report in reports.values():
+    if not report.reachable:
+        print(f"{report.unreachable} of {report.points} targets for {report.effector} are out of reach, by up to "
+              f"{report.max_excess:.3f}m ({unreachableTargets})")
+
+if len(paths) == 0:
+    print("No reachable targets to send")
+    myRobot.disconnect()
+    bow_api.stop_engine()
+    sys.exit()
 
-# Create and send movement coordinates
+# Send them on a fixed schedule from a background thread, with every effector's objective in one reused motor
+# message per step, while the effectors' positions reported on the proprioception channel are compared with their
+# targets
+streamer = TrajectoryStreamer(myRobot, paths, repeats=repeatCountLim)
+print(f"Sending {streamer.stats().points} points {repeatCountLim} times to {', '.join(paths)}")
 try:
-    repeatCount = 0
-    while repeatCount < repeatCountLim:
-        angle = 0
-        while angle <=2*math.pi:
-            x = circleRadius * math.cos(angle)
-            y = circleRadius * math.sin(angle)
-            z = selectedUpDown*(circleHeight + (wobbleAmplitude * math.cos(angle*wobbleFreqMultiplier)))
-
-            SendObjective(myRobot, selectedEffector, x, y, z)
-
-            angle += stepSize
-            time.sleep(stepSize)
-        repeatCount += 1
+    streamer.start()
+    # Wait in short steps so ctrl-c is noticed
+    while not streamer.wait(0.5):
+        pass
 
 except KeyboardInterrupt or SystemExit:
     print("Closing down")
     stopFlag = True
 
+streamer.stop()
+print(streamer.stats())
+
 # Close the bow client
 myRobot.disconnect()
 bow_api.stop_engine()
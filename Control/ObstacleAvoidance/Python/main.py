@@ -9,15 +9,21 @@ import time
 import bow_api
 import bow_data
 
+import os
 import sys
 import logging
-import cv2
-import numpy as np
+
+# Make the shared tutorial utilities importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "Utilities", "Python"))
+from bow_utils import Display, ImageDecoder
 
 stopFlag = False
 window_names = dict()
 windows_created = False
+decoder = ImageDecoder()
 rate = 10
+# Set BOW_DISPLAY=null, mjpeg or disk:DIRECTORY to run without a screen
+display = Display(max_fps=rate)
 
 
 def show_all_images(images_list):
@@ -27,23 +33,10 @@ def show_all_images(images_list):
         for i in range(len(images_list.Samples)):
             window_name = f"RobotView{i} - {images_list.Samples[i].Source}"
             window_names[images_list.Samples[i].Source] = window_name
-            cv2.namedWindow(window_name)
         windows_created = True
 
-    for i, img_data in enumerate(images_list.Samples):
-        if len(img_data.Data) != 0:
-            if img_data.NewDataFlag:
-                if img_data.ImageType == bow_data.ImageSample.ImageTypeEnum.RGB:
-                    npimage = np.frombuffer(img_data.Data, np.uint8).reshape(
-                        [int(img_data.DataShape[1] * 3 / 2), img_data.DataShape[0]])
-                    npimage = cv2.cvtColor(npimage, cv2.COLOR_YUV2RGB_I420)
-                    cv2.imshow(window_names[img_data.Source], npimage)
-                elif img_data.ImageType == bow_data.ImageSample.ImageTypeEnum.DEPTH:
-                    npimage = np.frombuffer(img_data.Data, np.uint16).reshape(
-                        [img_data.DataShape[1], img_data.DataShape[0]])
-                    cv2.imshow(window_names[img_data.Source], npimage)
-                else:
-                    print("Unhandled image type")
+    for img_data, npimage in decoder.decode_all(images_list.Samples):
+        display.show(window_names[img_data.Source], npimage)
 
 
 
@@ -84,7 +77,6 @@ front_sonar = identify_front_sonar(ext_sample.Range)
 
 # Calculate delay needed for rate of loop execution
 delay = 1/rate
-delay_ms = int(delay * 1000)
 
 # Main Loop
 try:
@@ -140,16 +132,17 @@ try:
         # Send the motor command
         myrobot.motor.set(motor_command)
 
-        # Delay to control the rate of loop execution
-        j = cv2.waitKeyEx(delay_ms)
+        # Pump the window events once per loop, then delay to control the rate of loop execution
+        j = display.poll()
         if j == 27:
             break
+        time.sleep(delay)
 
 except KeyboardInterrupt or SystemExit:
-    cv2.destroyAllWindows()
+    display.close()
     print("Closing down")
     stopFlag = True
 
-cv2.destroyAllWindows()
+display.close()
 myrobot.disconnect()
 bow_api.close_client_interface()
@@ -7,6 +7,7 @@
 import bow_api
 import bow_data
 
+import asyncio
 import math
 import time
 import sys
@@ -14,36 +15,30 @@ import sys
 import bow_api
 import bow_data
 
+import os
 import sys
-import cv2
-import numpy as np
 from pynput import keyboard
 
+# Make the shared tutorial utilities importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "Utilities", "Python"))
+from bow_utils import (CommandRamp, DiscoveryCache, Display, Fleet, ImageDecoder, KeyBinding, KeyboardTeleop,
+                       LOCOMOTION_BINDINGS, LoopProfiler)
+
 stopFlag = False
 window_names = dict()
+decoder = ImageDecoder()
+# Render at most 30 times a second, set BOW_DISPLAY=null, mjpeg or disk:DIRECTORY to run without a screen, or
+# BOW_DISPLAY=dashboard:8080 to watch every robot's cameras from any number of browsers instead of in windows
+display = Display(max_fps=30)
+# Set BOW_PROFILE=1 to print per-stage, per-robot loop timings every 10 seconds
+profiler = LoopProfiler(report_period=10.0, enabled=os.getenv("BOW_PROFILE", "0") == "1")
 
-# A set to keep track of the pressed keys
-pressed_keys = set()
 num_robots = 2
-
-def on_press(key):
-    try:
-        pressed_keys.add(key.char)
-    except AttributeError:
-        # Check for special keys (like spacebar)
-        if key == keyboard.Key.space:
-            pressed_keys.add("space")
-
-def on_release(key):
-    try:
-        pressed_keys.discard(key.char)
-    except AttributeError:
-        # Check for special keys (like spacebar)
-        if key == keyboard.Key.space:
-            pressed_keys.discard("space")
-    if key == keyboard.Key.esc:
-        # Stop listener
-        return False
+motor_rate = 50  # Motor commands sent per second
+motor_keepalive = 0.5  # An unchanged motor command is only sent again this often, in seconds
+ramp_profile = "smooth"  # How quickly the commands follow the keys: "gentle", "smooth" or "responsive"
+discovery_ttl = 300  # How long the list of robots from the last run is used for, in seconds
+frame_timeout = 0.1  # The longest to wait for a robot's images each frame, in seconds
 
 def reset_locomotion(motorSample) :
     motorSample.Locomotion.TranslationalVelocity.Y = 0
@@ -53,83 +48,37 @@ def reset_locomotion(motorSample) :
     motorSample.Locomotion.RotationalVelocity.Y = 0
     motorSample.Locomotion.RotationalVelocity.Z = 0
 
-listener = keyboard.Listener(on_press=on_press, on_release=on_release)
-listener.start()
+# This tutorial's robots look around with the gaze vector's Y and X, on top of the usual driving keys
+key_bindings = LOCOMOTION_BINDINGS + (
+    KeyBinding("i", "GazeTarget.GazeVector.Y", -0.2, "Look up"),
+    KeyBinding("k", "GazeTarget.GazeVector.Y", 0.2, "Look down"),
+    KeyBinding("j", "GazeTarget.GazeVector.X", -0.2, "Look left"),
+    KeyBinding("l", "GazeTarget.GazeVector.X", 0.2, "Look right"),
+    KeyBinding("o", "GazeTarget.GazeVector.Z", -0.2, "Tilt left"),
+    KeyBinding("u", "GazeTarget.GazeVector.Z", 0.2, "Tilt right"),
+)
 
 def show_all_images(images_list):
     global window_names
 
-    for i, img_data in enumerate(images_list):
-        if len(img_data.Data) != 0:
-            if img_data.NewDataFlag:
-                if img_data.ImageType == bow_data.ImageSample.ImageTypeEnum.RGB:
-                    npimage = np.frombuffer(img_data.Data, np.uint8).reshape(
-                        [int(img_data.DataShape[1] * 3 / 2), img_data.DataShape[0]])
-                    npimage = cv2.cvtColor(npimage, cv2.COLOR_YUV2RGB_I420)
-                elif img_data.ImageType == bow_data.ImageSample.ImageTypeEnum.DEPTH:
-                    npimage = np.frombuffer(img_data.Data, np.uint16).reshape(
-                        [img_data.DataShape[1], img_data.DataShape[0]])
-                else:
-                    print("Unhandled image type")
-                    continue
+    with profiler.stage("decode"):
+        decoded = decoder.decode_all(images_list)
+
+    for img_data, npimage in decoded:
+        if not window_names.__contains__(img_data.Source):
+            window_name = f"RobotView{len(window_names)} - {img_data.Source}"
+            window_names[img_data.Source] = window_name
+
+        with profiler.stage("display"):
+            display.show(window_names[img_data.Source], npimage)
 
-                if not window_names.__contains__(img_data.Source):
-                    window_name = f"RobotView{len(window_names)} - {img_data.Source}"
-                    window_names[img_data.Source] = window_name
-                    cv2.namedWindow(window_name)
-
-                cv2.imshow(window_names[img_data.Source], npimage)
-
-
-def keyboard_control():
-    motorSample = bow_data.MotorSample()
-    if 'w' in pressed_keys:
-        print("Moving forward")
-        motorSample.Locomotion.TranslationalVelocity.X = 0.2
-    if 's' in pressed_keys:
-        print("Moving backward")
-        motorSample.Locomotion.TranslationalVelocity.X = -0.2
-    if 'd' in pressed_keys:
-        print("Rotate right")
-        motorSample.Locomotion.RotationalVelocity.Z = -1
-    if 'a' in pressed_keys:
-        print("Rotate left")
-        motorSample.Locomotion.RotationalVelocity.Z = 1
-    if 'e' in pressed_keys:
-        print("Strafe right")
-        motorSample.Locomotion.TranslationalVelocity.Y = -1
-    if 'q' in pressed_keys:
-        print("Strafe left")
-        motorSample.Locomotion.TranslationalVelocity.Y = 1
-    if 'space' in pressed_keys:
-        print("Stop moving")
-        reset_locomotion(motorSample)
-    if 'i' in pressed_keys:
-        print("Look up")
-        motorSample.GazeTarget.GazeVector.Y = -0.2
-    if 'k' in pressed_keys:
-        print("Look down")
-        motorSample.GazeTarget.GazeVector.Y = 0.2
-    if 'j' in pressed_keys:
-        print("Look left")
-        motorSample.GazeTarget.GazeVector.X = -0.2
-    if 'l' in pressed_keys:
-        print("Look right")
-        motorSample.GazeTarget.GazeVector.X = 0.2
-    if 'o' in pressed_keys:
-        print("Tilt left")
-        motorSample.GazeTarget.GazeVector.Z = -0.2
-    if 'u' in pressed_keys:
-        print("Tilt right")
-        motorSample.GazeTarget.GazeVector.Z = 0.2
-    return motorSample
 
 # Prompt user to select two robots by their index from the displayed list of available robots
 def get_robot_selection(prompt, selected):
     while True:
         try:
             idx = int(input(prompt))
-            if 0 <= idx < len(get_robots_result.robots):
+            if 0 <= idx < len(available_robots):
                 if idx in selected:
                     print("Cannot choose the same robot again")
                     continue
@@ -154,12 +103,18 @@ else:
     sys.exit(-1)
 
 # Get robots
-get_robots_result = bow_api.get_robots(get_local=True, get_remote=True, get_bow_hub=False)
-if not get_robots_result.localSearchError.Success:
-   print(get_robots_result.localSearchError.Description)
+# The robots found by the last run are used straight away if they were found within the last discovery_ttl
+# seconds, while the local and remote searches run together in the background to refresh the list for next time
+discovery = DiscoveryCache(bow_api, ttl=discovery_ttl)
+get_robots_result = discovery.robots()
+if get_robots_result.from_cache:
+    print(f"Using the robots found {get_robots_result.age:.0f}s ago")
+
+if get_robots_result.local_error is not None:
+    print(get_robots_result.local_error)
 
-if not get_robots_result.remoteSearchError.Success:
-    print(get_robots_result.remoteSearchError.Description)
+if get_robots_result.remote_error is not None:
+    print(get_robots_result.remote_error)
 
 if len(get_robots_result.robots) == 0:
     print("No Robots found")
@@ -167,7 +122,7 @@ if len(get_robots_result.robots) == 0:
     sys.exit(-1)
 
 # Filter out only the available robots
-available_robots = [r for r in get_robots_result.robots if r.robot_state.available]
+available_robots = get_robots_result.available
 
 # Print out all found robots and whether they are available
 print("Robots discovered:")
@@ -186,53 +141,72 @@ for i in range(num_robots):
 # Create BOW Robot instances
 robots = [bow_api.Robot(available_robots[ridx]) for ridx in robot_indices]
 
-# Connect to each robot and open target modalities
-target_channels = ["vision", "motor"]
-for robot in robots:
-    result = robot.connect()
-    if not result.Success:
-        print("Could not connect with robot {}".format(robot.robot_details.robot_id))
-        bow_api.close_client_interface()
-        sys.exit(-1)
-
-    for channel in target_channels:
-        result = robot.open_channel(channel)
-        if not result.Success:
-            print("Failed to open " + channel + " channel: " + result.Description)
-            bow_api.close_client_interface()
-            sys.exit(-1)
 
-try:
+async def control_loop(fleet):
     while True:
         # Sense
+        # Get images from every robot at once, a robot which has not answered within frame_timeout is picked up
+        # on a later frame instead of holding up the others
         all_images = []
-        skip = False
-        for robot in robots:
-            robot_images, err = robot.vision.get(True)
-            if err.Success and robot_images is not None:
-                for image in robot_images.Samples:
-                    image.Source = f"{robot.robot_details.name}_{image.Source}"
-                    all_images.append(image)
+        for name, robot_images in (await fleet.get_all("vision", timeout=frame_timeout)).items():
+            for image in robot_images.Samples:
+                image.Source = f"{name}_{image.Source}"
+                all_images.append(image)
 
         if len(all_images) > 0:
             show_all_images(all_images)
 
-        # Decide
-        motorSample = keyboard_control()
+        # Pump the window events once per frame
+        display.poll()
+        profiler.tick()
 
-        # Act
-        for r in robots:
-            r.motor.set(motorSample)
 
-        # Allow for cv2 window operations and refresh rate
-        cv2.waitKey(1)
+loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+
+# Connect to every robot and open the target modalities on all of them at the same time. Motor commands are sent
+# to every robot at a fixed rate, independent of how quickly images arrive, skipping repeats of an unchanged
+# command between keepalives
+target_channels = ["vision", "motor"]
+fleet = Fleet(channels=target_channels, motor_rate=motor_rate, motor_keepalive=motor_keepalive, profiler=profiler)
+for session in loop.run_until_complete(fleet.connect(robots)):
+    if not session.connected:
+        print("Could not connect with robot {}: {}".format(session.name, session.last_error))
+        if get_robots_result.from_cache:
+            print("The list of robots may be out of date, it is refreshed for the next run")
+
+if len(fleet.connected) < len(robots):
+    loop.run_until_complete(fleet.disconnect())
+    bow_api.close_client_interface()
+    sys.exit(-1)
+
+# Ramp every robot's command towards what the keys ask for with limited acceleration and jerk, stepping the whole
+# fleet together and publishing to each robot's motor scheduler at its rate. The first step after a key is sent
+# straight away. The commands start from zero, so the robots are explicitly held still until a key is pressed
+ramp = CommandRamp({session.name: session.scheduler.set for session in fleet.connected}, profile=ramp_profile,
+                   rate=motor_rate)
+ramp.start()
+
+# Decide as soon as a key is pressed or released rather than waiting for the next frame of images
+teleop = KeyboardTeleop(key_bindings, on_change=ramp.set_target, verbose=True)
+listener = keyboard.Listener(on_press=teleop.on_press, on_release=teleop.on_release)
+listener.start()
+
+control = loop.create_task(control_loop(fleet))
+try:
+    loop.run_until_complete(control)
 
 except KeyboardInterrupt or SystemExit:
-    cv2.destroyAllWindows()
     print("Closing down")
     stopFlag = True
-
-cv2.destroyAllWindows()
-for r in robots:
-    r.disconnect()
+    control.cancel()
+
+display.close()
+listener.stop()
+ramp.stop()
+for session in fleet.connected:
+    print(f"{session.name}: {session.scheduler.stats()}")
+print(fleet.report())
+loop.run_until_complete(fleet.disconnect())
+loop.close()
 bow_api.stop_engine()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+# Imports
+import bow_api
+
+import os
+import sys
+import time
+from pynput import keyboard
+
+# Make the shared tutorial utilities importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "Utilities", "Python"))
+from bow_utils import DiscoveryCache, Display, FleetSupervisor, KeyBinding, KeyboardTeleop, LOCOMOTION_BINDINGS
+
+motor_rate = 50  # Motor commands sent per second by each worker
+motor_keepalive = 0.5  # An unchanged motor command is only sent again this often, in seconds
+report_period = 5.0  # How often to print the state of every worker, in seconds
+discovery_ttl = 300  # How long the list of robots from the last run is used for, in seconds
+
+
+# Driving keys, and looking around with the gaze vector's Y and X as in main.py
+key_bindings = LOCOMOTION_BINDINGS + (
+    KeyBinding("i", "GazeTarget.GazeVector.Y", -0.2, "Look up"),
+    KeyBinding("k", "GazeTarget.GazeVector.Y", 0.2, "Look down"),
+    KeyBinding("j", "GazeTarget.GazeVector.X", -0.2, "Look left"),
+    KeyBinding("l", "GazeTarget.GazeVector.X", 0.2, "Look right"),
+)
+
+
+def main():
+    print(bow_api.version())
+
+    # Setup the BOW Client, which this process only uses to find the robots, the workers connect to them
+    setup_result = bow_api.setup(app_name="Multiple Robots - Worker Fleet", verbose=True)
+    if not setup_result.Success:
+        sys.exit(-1)
+
+    # Login to BOW using systray login
+    login_result = bow_api.login_user("", "", True)
+    if login_result.Success:
+        print("Logged in")
+    else:
+        sys.exit(-1)
+
+    # Get robots, using the robots found by the last run if that was recent while a new search runs in the
+    # background to refresh the list for next time
+    discovery = DiscoveryCache(bow_api, ttl=discovery_ttl)
+    get_robots_result = discovery.robots()
+    if get_robots_result.local_error is not None:
+        print(get_robots_result.local_error)
+
+    if get_robots_result.remote_error is not None:
+        print(get_robots_result.remote_error)
+
+    # Filter out only the available robots
+    available_robots = get_robots_result.available
+    if len(available_robots) == 0:
+        print("No available robots found")
+        bow_api.close_client_interface()
+        sys.exit(-1)
+
+    # Run every robot in its own process, which connects to it, reads its cameras and sends its motor commands.
+    # Decoded images come back through shared memory, and workers which crash or hang are restarted
+    supervisor = FleetSupervisor(available_robots, channels=["vision", "motor"], motor_rate=motor_rate,
+                                 motor_keepalive=motor_keepalive)
+    supervisor.start()
+
+    # Render at most 30 times a second, set BOW_DISPLAY=null, mjpeg, dashboard or disk:DIRECTORY to run without a
+    # screen
+    display = Display(max_fps=30)
+
+    # The command is only rebuilt when a key is pressed or released. The pipes to the workers belong to this thread,
+    # so the new command is picked up by the loop below rather than sent from the keyboard listener
+    teleop = KeyboardTeleop(key_bindings)
+    listener = keyboard.Listener(on_press=teleop.on_press, on_release=teleop.on_release)
+    listener.start()
+
+    report_time = time.time()
+    try:
+        while True:
+            # Sense
+            # Wait briefly for the newest image from any robot's cameras
+            for frame in supervisor.poll(timeout=0.02):
+                display.show(f"{frame.robot} - {frame.source}", frame.image)
+
+            # Decide and act
+            # Every worker keeps sending the latest command at the motor rate, and only a changed command is passed on
+            supervisor.set_motor(teleop.sample)
+
+            if time.time() - report_time >= report_period:
+                print(supervisor.report())
+                report_time = time.time()
+
+            # Pump the window events once per frame and check for keyboard escape
+            j = display.poll()
+            if j == 27:
+                break
+
+    # Kill on ctrl-c or closure
+    except KeyboardInterrupt or SystemExit:
+        print("Closing down")
+
+    # Stop every worker, which disconnects its robot
+    display.close()
+    listener.stop()
+    supervisor.stop()
+    print(supervisor.report())
+    bow_api.close_client_interface()
+
+
+# The workers re-import this file, so only run when started directly
+if __name__ == "__main__":
+    main()
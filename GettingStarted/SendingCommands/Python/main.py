@@ -6,36 +6,25 @@
 
 import bow_api
 import bow_data
+import os
 import sys
-import cv2
-import numpy as np
 from pynput import keyboard
 
+# Make the shared tutorial utilities importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "Utilities", "Python"))
+from bow_utils import CommandRamp, DEFAULT_BINDINGS, Display, ImageDecoder, KeyboardTeleop, LoopProfiler, MotorScheduler
+
 stopFlag = False
 window_names = dict()
 windows_created = False
-
-# A set to keep track of the pressed keys
-pressed_keys = set()
-
-def on_press(key):
-    try:
-        pressed_keys.add(key.char)
-    except AttributeError:
-        # Check for special keys (like spacebar)
-        if key == keyboard.Key.space:
-            pressed_keys.add("space")
-
-def on_release(key):
-    try:
-        pressed_keys.discard(key.char)
-    except AttributeError:
-        # Check for special keys (like spacebar)
-        if key == keyboard.Key.space:
-            pressed_keys.discard("space")
-    if key == keyboard.Key.esc:
-        # Stop listener
-        return False
+decoder = ImageDecoder(colourise_depth=True)
+# Render at most 30 times a second, set BOW_DISPLAY=null, mjpeg or disk:DIRECTORY to run without a screen
+display = Display(max_fps=30)
+motor_rate = 50  # Motor commands sent per second
+motor_keepalive = 0.5  # An unchanged motor command is only sent again this often, in seconds
+ramp_profile = "smooth"  # How quickly the commands follow the keys: "gentle", "smooth" or "responsive"
+# Set BOW_PROFILE=1 to print per-stage loop timings every 10 seconds
+profiler = LoopProfiler(report_period=10.0, enabled=os.getenv("BOW_PROFILE", "0") == "1")
 
 def reset_locomotion(motorSample) :
     motorSample.Locomotion.TranslationalVelocity.Y = 0
@@ -45,101 +34,21 @@ def reset_locomotion(motorSample) :
     motorSample.Locomotion.RotationalVelocity.Y = 0
     motorSample.Locomotion.RotationalVelocity.Z = 0
 
-listener = keyboard.Listener(on_press=on_press, on_release=on_release)
-listener.start()
-
 def show_all_images(images_list):
     global windows_created, window_names
 
-    for i, img_data in enumerate(images_list.Samples):
-        show_image = None
-        if img_data.NewDataFlag:
-            image_width = int(img_data.DataShape[0])
-            image_height = int(img_data.DataShape[1])
-
-            if img_data.ImageType == bow_data.ImageSample.ImageTypeEnum.RGB:
-                expected_size = image_width * image_height * 3 // 2
-                if len(img_data.Data) < expected_size:
-                    continue
-
-                yuv_image = np.frombuffer(img_data.Data, np.uint8).reshape(
-                    [int(img_data.DataShape[1] * 3 // 2), img_data.DataShape[0]])
-                show_image = cv2.cvtColor(yuv_image, cv2.COLOR_YUV2RGB_IYUV)
+    with profiler.stage("decode"):
+        decoded = decoder.decode_all(images_list.Samples)
 
-            elif img_data.ImageType == bow_data.ImageSample.ImageTypeEnum.DEPTH:
-                expected_size = image_width * image_height
-                if len(img_data.Data) < expected_size:
-                    continue
+    for img_data, show_image in decoded:
+        if img_data.Source not in window_names.keys():
+            window_name = f"RobotView{len(window_names)} - {img_data.Source}"
+            print(window_name)
+            window_names[img_data.Source] = window_name
 
-                depth_image = np.frombuffer(img_data.Data, np.uint16).reshape(
-                    [img_data.DataShape[1], img_data.DataShape[0]])
-                normalized_depth = cv2.normalize(depth_image, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8UC1)
-                show_image = cv2.applyColorMap(normalized_depth, cv2.COLORMAP_JET)
+        with profiler.stage("display"):
+            display.show(window_names[img_data.Source], show_image)
 
-            else:
-                print("Unknown image type")
-
-        if show_image is not None:
-            if img_data.Source not in window_names.keys():
-                window_name = f"RobotView{len(window_names)} - {img_data.Source}"
-                print(window_name)
-                window_names[img_data.Source] = window_name
-                cv2.namedWindow(window_name)
-                cv2.waitKey(1)
-
-            cv2.imshow(window_names[img_data.Source], show_image)
-            cv2.waitKey(1)
-
-
-def keyboard_control():
-    motorSample = bow_data.MotorSample()
-    motorSample.Locomotion.TranslationalVelocity.X = 0
-    motorSample.Locomotion.TranslationalVelocity.Y = 0
-    motorSample.Locomotion.TranslationalVelocity.Z = 0
-    motorSample.Locomotion.RotationalVelocity.X = 0
-    motorSample.Locomotion.RotationalVelocity.Y = 0
-    motorSample.Locomotion.RotationalVelocity.Z = 0
-    motorSample.GazeTarget.GazeVector.X = 0
-    motorSample.GazeTarget.GazeVector.Y = 0
-    motorSample.GazeTarget.GazeVector.Z = 0
-
-    if 'w' in pressed_keys:
-        print("Moving forward")
-        motorSample.Locomotion.TranslationalVelocity.X = 0.2
-    if 's' in pressed_keys:
-        print("Moving backward")
-        motorSample.Locomotion.TranslationalVelocity.X = -0.2
-    if 'd' in pressed_keys:
-        print("Rotate right")
-        motorSample.Locomotion.RotationalVelocity.Z = -1
-    if 'a' in pressed_keys:
-        print("Rotate left")
-        motorSample.Locomotion.RotationalVelocity.Z = 1
-    if 'e' in pressed_keys:
-        print("Strafe right")
-        motorSample.Locomotion.TranslationalVelocity.Y = -1
-    if 'q' in pressed_keys:
-        print("Strafe left")
-        motorSample.Locomotion.TranslationalVelocity.Y = 1
-    if 'i' in pressed_keys:
-        print("Look up")
-        motorSample.GazeTarget.GazeVector.X = -0.2
-    if 'k' in pressed_keys:
-        print("Look down")
-        motorSample.GazeTarget.GazeVector.X = 0.2
-    if 'j' in pressed_keys:
-        print("Look left")
-        motorSample.GazeTarget.GazeVector.Y = 0.2
-    if 'l' in pressed_keys:
-        print("Look right")
-        motorSample.GazeTarget.GazeVector.Y = -0.2
-    if 'o' in pressed_keys:
-        print("Tilt left")
-        motorSample.GazeTarget.GazeVector.Z = -0.2
-    if 'u' in pressed_keys:
-        print("Tilt right")
-        motorSample.GazeTarget.GazeVector.Z = 0.2
-    return motorSample
 
 print(bow_api.version())
 
@@ -148,10 +57,27 @@ if not error.Success:
     print("Failed to connect to robot", error)
     sys.exit()
 
+# Send motor commands at a fixed rate, independent of how quickly images arrive. Repeats of an unchanged command
+# are skipped between keepalives
+motor_scheduler = MotorScheduler(myrobot, rate=motor_rate, profiler=profiler, keepalive=motor_keepalive)
+motor_scheduler.start()
+
+# Ramp the command towards what the keys ask for with limited acceleration and jerk, rather than jumping straight
+# to full speed, publishing to the scheduler at its rate. The first step after a key is sent straight away. It starts
+# from zero, so the robot is explicitly held still until a key is pressed
+ramp = CommandRamp({myrobot.robot_details.name: motor_scheduler.set}, profile=ramp_profile, rate=motor_rate)
+ramp.start()
+
+# Rebuild the target only when a key is pressed or released, without waiting for the next image
+teleop = KeyboardTeleop(DEFAULT_BINDINGS, on_change=ramp.set_target, verbose=True)
+listener = keyboard.Listener(on_press=teleop.on_press, on_release=teleop.on_release)
+listener.start()
+
 try:
     while True:
         # Sense
-        image_samples, err = myrobot.vision.get(True)
+        with profiler.stage("vision.get"):
+            image_samples, err = myrobot.vision.get(True)
         if not err.Success:
             continue
 
@@ -160,20 +86,18 @@ try:
 
         show_all_images(image_samples)
 
-        # Decide
-        motorSample = keyboard_control()
-
-        # Act
-        myrobot.motor.set(motorSample)
-
-        # Allow for cv2 window operations and refresh rate
-        cv2.waitKey(1)
+        # Pump the window events once per frame
+        display.poll()
+        profiler.tick()
 
 except KeyboardInterrupt or SystemExit:
-    cv2.destroyAllWindows()
     print("Closing down")
     stopFlag = True
 
-cv2.destroyAllWindows()
+display.close()
+listener.stop()
+ramp.stop()
+motor_scheduler.stop()
+print(motor_scheduler.stats())
 myrobot.disconnect()
 bow_api.stop_engine()
@@ -7,54 +7,35 @@
 import bow_api
 import bow_data
 
+import os
 import sys
-import cv2
-import numpy as np
+
+# Make the shared tutorial utilities importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "Utilities", "Python"))
+from bow_utils import Display, ImageDecoder, LoopProfiler
 
 stopFlag = False
 window_names = dict()
+decoder = ImageDecoder(colourise_depth=True)
+# Render at most 30 times a second, set BOW_DISPLAY=null, mjpeg or disk:DIRECTORY to run without a screen
+display = Display(max_fps=30)
+# Set BOW_PROFILE=1 to print per-stage loop timings every 10 seconds
+profiler = LoopProfiler(report_period=10.0, enabled=os.getenv("BOW_PROFILE", "0") == "1")
 
 def show_all_images(images_list):
     global window_names
 
-    for i, img_data in enumerate(images_list.Samples):
-        show_image = None
-        if img_data.NewDataFlag:
-            image_width = int(img_data.DataShape[0])
-            image_height = int(img_data.DataShape[1])
-
-            if img_data.ImageType == bow_data.ImageSample.ImageTypeEnum.RGB:
-                expected_size = image_width * image_height * 3 // 2
-                if len(img_data.Data) < expected_size:
-                    continue
-
-                yuv_image = np.frombuffer(img_data.Data, np.uint8).reshape(
-                    [int(img_data.DataShape[1] * 3 // 2), img_data.DataShape[0]])
-                show_image = cv2.cvtColor(yuv_image, cv2.COLOR_YUV2RGB_IYUV)
-
-            elif img_data.ImageType == bow_data.ImageSample.ImageTypeEnum.DEPTH:
-                expected_size = image_width * image_height
-                if len(img_data.Data) < expected_size:
-                    continue
-
-                depth_image = np.frombuffer(img_data.Data, np.uint16).reshape(
-                    [img_data.DataShape[1], img_data.DataShape[0]])
-                normalized_depth = cv2.normalize(depth_image, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8UC1)
-                show_image = cv2.applyColorMap(normalized_depth, cv2.COLORMAP_JET)
-
-            else:
-                print("Unknown image type")
+    with profiler.stage("decode"):
+        decoded = decoder.decode_all(images_list.Samples)
 
-        if show_image is not None:
-            if img_data.Source not in window_names.keys():
-                window_name = f"RobotView{len(window_names)} - {img_data.Source}"
-                print(window_name)
-                window_names[img_data.Source] = window_name
-                cv2.namedWindow(window_name)
-                cv2.waitKey(1)
+    for img_data, show_image in decoded:
+        if img_data.Source not in window_names.keys():
+            window_name = f"RobotView{len(window_names)} - {img_data.Source}"
+            print(window_name)
+            window_names[img_data.Source] = window_name
 
-            cv2.imshow(window_names[img_data.Source], show_image)
-            cv2.waitKey(1)
+        with profiler.stage("display"):
+            display.show(window_names[img_data.Source], show_image)
 
 
 print(bow_api.version())
@@ -67,7 +48,8 @@ if not error.Success:
 try:
     while True:
         # Sense
-        image_samples, err = myrobot.vision.get(True)
+        with profiler.stage("vision.get"):
+            image_samples, err = myrobot.vision.get(True)
         if not err.Success:
             print(err.Description)
             continue
@@ -76,15 +58,16 @@ try:
             continue
         show_all_images(image_samples)
 
-        j = cv2.waitKeyEx(1)
+        # Pump the window events once per frame
+        j = display.poll()
+        profiler.tick()
         if j == 27:
             break
 
 except KeyboardInterrupt or SystemExit:
-    cv2.destroyAllWindows()
     print("Closing down")
     stopFlag = True
 
-cv2.destroyAllWindows()
+display.close()
 myrobot.disconnect()
 bow_api.stop_engine()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+from .capture import CapturedFrame, CaptureStats, VisionCapture
+from .dashboard import Dashboard, DashboardStats
+from .detection import BatchDetector, DetectionBatch, DetectionIndex, DetectionView
+from .discovery import DiscoveryCache, DiscoveryResult
+from .display import Display, DisplayStats, DiskSink, MJPEGSink, NullSink, OpenCVSink, create_sink
+from .fleet import Fleet, RobotHealth, RobotSession
+from .inference import AdaptiveDetectionRate, DetectionResult, DetectionWorkerPool
+from .motor import MotorScheduler, MotorStats
+from .profiler import LatencyHistogram, LoopProfiler
+from .ramp import CommandRamp, RampLimits
+from .recorder import RecorderStats, SessionRecorder, iter_session
+from .session import Frame, JointPositions, SessionReader, SessionStream
+from .teleop import DEFAULT_BINDINGS, GAZE_BINDINGS, LOCOMOTION_BINDINGS, KeyBinding, KeyboardTeleop
+from .tracking import ObjectTracker, TrackedObject
+from .trajectory import (Trajectory, TrajectoryStats, TrajectoryStreamer, controllable_effectors, parametric,
+                         spline)
+from .vision import ImageDecoder
+from .workers import FleetSupervisor, WorkerFrame, WorkerStats
+from .workspace import EffectorModel, ReachabilityReport, Workspace, effector_models
+
+__all__ = [
+    "CapturedFrame",
+    "CaptureStats",
+    "VisionCapture",
+    "Dashboard",
+    "DashboardStats",
+    "BatchDetector",
+    "DetectionBatch",
+    "DetectionIndex",
+    "DetectionView",
+    "DiscoveryCache",
+    "DiscoveryResult",
+    "Display",
+    "DisplayStats",
+    "DiskSink",
+    "MJPEGSink",
+    "NullSink",
+    "OpenCVSink",
+    "create_sink",
+    "Fleet",
+    "RobotHealth",
+    "RobotSession",
+    "AdaptiveDetectionRate",
+    "DetectionResult",
+    "DetectionWorkerPool",
+    "MotorScheduler",
+    "MotorStats",
+    "LatencyHistogram",
+    "LoopProfiler",
+    "CommandRamp",
+    "RampLimits",
+    "RecorderStats",
+    "SessionRecorder",
+    "iter_session",
+    "Frame",
+    "JointPositions",
+    "SessionReader",
+    "SessionStream",
+    "DEFAULT_BINDINGS",
+    "GAZE_BINDINGS",
+    "LOCOMOTION_BINDINGS",
+    "KeyBinding",
+    "KeyboardTeleop",
+    "ObjectTracker",
+    "TrackedObject",
+    "Trajectory",
+    "TrajectoryStats",
+    "TrajectoryStreamer",
+    "controllable_effectors",
+    "parametric",
+    "spline",
+    "ImageDecoder",
+    "FleetSupervisor",
+    "WorkerFrame",
+    "WorkerStats",
+    "EffectorModel",
+    "ReachabilityReport",
+    "Workspace",
+    "effector_models",
+]
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+"""
+Measure the throughput and per-frame latency of the tutorial pipelines without a robot or a display.
+
+Run every benchmark against synthetic frames and write the results as JSON, from the repository root:
+
+    PYTHONPATH=Utilities/Python python -m bow_utils.benchmark --output results.json
+
+Pass --recording to use frames recorded with bow_utils.replay instead, and --only to pick benchmarks.
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import bow_data
+import cv2
+import numpy as np
+
+from .capture import VisionCapture
+from .profiler import LatencyHistogram, LoopProfiler
+from .replay import Recording, ReplayBackend, ReplayImageSamples, install
+from .trajectory import TrajectoryStreamer, parametric
+from .vision import ImageDecoder
+
+_REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..")
+
+
+def synthetic_image_sample(source: str, width: int, height: int, depth: bool = False,
+                           seed: int = 0) -> "bow_data.ImageSample":
+    """
+    Create an image sample holding a smooth gradient with some noise, in the encoding a robot would send.
+
+    :param source: The ImageSample.Source to give the sample.
+    :param width: The width of the image in pixels.
+    :param height: The height of the image in pixels.
+    :param depth: Create a uint16 depth image rather than a YUV I420 colour image.
+    :param seed: Varies the image content.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    if depth:
+        image = (500 + 4000 * (x + y) / 2 + rng.normal(0, 20, (height, width))).astype(np.uint16)
+        image_type = bow_data.ImageSample.ImageTypeEnum.DEPTH
+    else:
+        planes = np.empty((height * 3 // 2, width), np.uint8)
+        planes[:height] = np.clip(255 * (x + y) / 2 + rng.normal(0, 8, (height, width)), 0, 255)
+        planes[height:] = 128
+        image = planes
+        image_type = bow_data.ImageSample.ImageTypeEnum.RGB
+    return bow_data.ImageSample(Source=source, Data=image.tobytes(), DataShape=[width, height],
+                                ImageType=image_type, NewDataFlag=True)
+
+
+def synthetic_recording(robots: int = 1, frames: int = 150, rate: float = 30.0, width: int = 640,
+                        height: int = 480, sources: Sequence[str] = ("frontcamera",),
+                        distinct_frames: int = 8) -> Recording:
+    """
+    Create a recording of vision data from some number of robots.
+
+    :param robots: The number of robots to record.
+    :param frames: The number of frames per robot.
+    :param rate: The frame rate of the recording.
+    :param width: The width of each image in pixels.
+    :param height: The height of each image in pixels.
+    :param sources: The cameras each robot has.
+    :param distinct_frames: The number of different images each camera cycles through.
+    """
+    images = [[synthetic_image_sample(source, width, height, seed=i) for source in sources]
+              for i in range(distinct_frames)]
+    recording = Recording()
+    for robot in range(robots):
+        for frame in range(frames):
+            recording.append(f"robot{robot}", "vision", frame / rate,
+                             ReplayImageSamples(list(images[frame % distinct_frames])))
+    return recording
+
+
+def _with_robots(recording: Recording, robots: int) -> Recording:
+    # Reuse the recorded streams under extra robot names when asking for more robots than were recorded
+    names = recording.robots
+    copy = Recording()
+    for i in range(robots):
+        copy.streams[names[i] if i < len(names) else f"robot{i}"] = recording.streams[names[i % len(names)]]
+    return copy
+
+
+def _latency_summary(histogram: LatencyHistogram) -> Dict[str, float]:
+    return dict(mean=histogram.mean * 1000, p50=histogram.percentile(50) * 1000,
+                p95=histogram.percentile(95) * 1000, p99=histogram.percentile(99) * 1000, max=histogram.max * 1000)
+
+
+def _result(count: int, elapsed: float, latency: LatencyHistogram, unit: str = "frames", **extra) -> Dict:
+    result = {unit: count, "elapsed_s": elapsed, f"{unit}_per_s": count / max(elapsed, 1e-9),
+              "latency_ms": _latency_summary(latency)}
+    result.update(extra)
+    return result
+
+
+def _vision_samples(recording: Recording) -> List:
+    for channels in recording.streams.values():
+        stream = channels.get("vision", [])
+        if len(stream) > 0:
+            return [sample for _, sample in stream]
+    raise ValueError("The recording has no vision data")
+
+
+def bench_decode(recording: Recording, frames: int, width: int, height: int) -> Dict:
+    """Time ImageDecoder on recorded colour frames and on synthetic depth frames."""
+    results = {}
+
+    # Decode one camera's frames in the order they were recorded
+    images = [sample for samples in _vision_samples(recording) for sample in samples.Samples]
+    images = [images[i % len(images)] for i in range(frames)]
+    depth = [synthetic_image_sample("depth", width, height, depth=True, seed=i) for i in range(8)]
+    cases = (("colour", images, False), ("depth_raw", depth, False), ("depth_colourised", depth, True))
+
+    for name, samples, colourise in cases:
+        decoder = ImageDecoder(colourise_depth=colourise)
+        latency = LatencyHistogram()
+        decoder.decode(samples[0])  # Allocate the output buffer outside the timing
+        start = time.perf_counter()
+        for i in range(frames):
+            frame_start = time.perf_counter()
+            decoder.decode(samples[i % len(samples)])
+            latency.record(time.perf_counter() - frame_start)
+        elapsed = time.perf_counter() - start
+        shape = samples[0].DataShape
+        results[name] = _result(frames, elapsed, latency, width=int(shape[0]), height=int(shape[1]))
+    return results
+
+
+def _load_tutorial(name: str, *path: str):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(_REPO_ROOT, *path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_object_recognition(recording: Recording, frames: int, speed: Optional[float],
+                             workers: Optional[int] = None) -> Dict:
+    """
+    Run the ObjectRecognition loop, minus the window, over recorded frames.
+
+    Frames are captured, decoded, submitted to the detection workers and drawn on with the tutorial's own
+    draw_detections, exactly as in Applications/ObjectRecognition/Python/main.py.
+    """
+    try:
+        import ultralytics  # noqa: F401
+    except ImportError:
+        return {"skipped": "ultralytics is not installed"}
+
+    from .inference import DetectionWorkerPool
+
+    backend = ReplayBackend(_with_robots(recording, 1), speed=speed, loop=True, interrupt_at_end=False)
+    install(backend)
+    tutorial = _load_tutorial("object_recognition_main", "Applications", "ObjectRecognition", "Python", "main.py")
+
+    robot, _ = backend.quick_connect(channels=["vision"])
+    detector = DetectionWorkerPool("yolov8n.pt", num_workers=workers or tutorial.num_workers)
+    detector.start()
+    detector.wait_ready()
+    decoder = ImageDecoder()
+    capture = VisionCapture(robot)
+    capture.start()
+
+    frame_latency = LatencyHistogram()
+    detection_latency = LatencyHistogram()
+    model_latency = LatencyHistogram()
+    detections = None
+    processed = 0
+    try:
+        sources = capture.wait_for_sources(timeout=10.0)
+        if len(sources) == 0:
+            return {"skipped": "no images arrived from the replayed robot"}
+        source = sources[0]
+        start = time.perf_counter()
+        while processed < frames:
+            frame = capture.wait_next(source, timeout=0.1)
+            if frame is not None:
+                image = decoder.decode(frame.sample)
+                if image is None:
+                    continue
+                detector.submit(image, tag=time.perf_counter())
+                for result in detector.results():
+                    detections = result
+                    detection_latency.record(time.perf_counter() - result.tag)
+                    model_latency.record(result.duration)
+                if detections is not None:
+                    tutorial.draw_detections(image, detections, detector.names)
+                frame_latency.record(time.monotonic() - frame.timestamp)
+                processed += 1
+        elapsed = time.perf_counter() - start
+    finally:
+        capture.stop()
+        detector.stop()
+
+    stats = capture.stats()[source]
+    return _result(processed, elapsed, frame_latency, detections=detection_latency.count,
+                   detections_per_s=detection_latency.count / max(elapsed, 1e-9),
+                   detection_latency_ms=_latency_summary(detection_latency),
+                   model_latency_ms=_latency_summary(model_latency), dropped_frames=stats.dropped,
+                   detections_skipped=detector.dropped, workers=detector.num_workers)
+
+
+class _StalledChannel:
+    # Makes every get of a replayed channel take longer, as a robot on a slow link would
+    def __init__(self, channel, delay: float):
+        self._channel = channel
+        self._delay = delay
+
+    def get(self, blocking: bool = True):
+        time.sleep(self._delay)
+        return self._channel.get(blocking)
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+
+def bench_multi_robot(recording: Recording, frames: int, robots: int, speed: Optional[float],
+                      motor_rate: float = 50.0, frame_timeout: float = 0.1, stall: float = 0.0) -> Dict:
+    """
+    Run the MultipleRobots loop, minus the window and keyboard, over recorded frames from several robots.
+
+    As in GettingStarted/MultipleRobots/Python/main.py, a Fleet connects every robot with a MotorScheduler each,
+    and an asyncio task gets every robot's images at once with get_all and decodes them, while a CommandRamp steps
+    every robot's command towards a target which changes every 25 iterations, as key presses would.
+
+    :param stall: Extra seconds every get from the last robot takes, to measure how one slow robot affects the
+        others. Longer than frame_timeout, it leaves that robot busy on most iterations.
+    """
+    from .fleet import Fleet
+    from .ramp import CommandRamp
+
+    backend = ReplayBackend(_with_robots(recording, robots), speed=speed, loop=True, interrupt_at_end=False)
+    replayed = [backend.Robot(details) for details in backend.get_robots().robots]
+    if stall > 0:
+        replayed[-1].vision = _StalledChannel(replayed[-1].vision, stall)
+    decoder = ImageDecoder()
+    fleet = Fleet(channels=["vision", "motor"], motor_rate=motor_rate)
+
+    forward = bow_data.MotorSample()
+    forward.Locomotion.TranslationalVelocity.X = 0.2
+    targets = (forward, bow_data.MotorSample())
+
+    async def control_loop(ramp: CommandRamp):
+        latency = LatencyHistogram()
+        images = 0
+        for i in range(frames):
+            iteration_start = time.perf_counter()
+            if i % 25 == 0:
+                ramp.set_target(targets[i // 25 % 2])
+            all_images = []
+            for robot_images in (await fleet.get_all("vision", timeout=frame_timeout)).values():
+                all_images.extend(robot_images.Samples)
+            images += len(decoder.decode_all(all_images))
+            latency.record(time.perf_counter() - iteration_start)
+        return latency, images
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(fleet.connect(replayed))
+        ramp = CommandRamp({session.name: session.scheduler.set for session in fleet.connected}, rate=motor_rate)
+        ramp.start()
+        start = time.perf_counter()
+        latency, images = loop.run_until_complete(control_loop(ramp))
+        elapsed = time.perf_counter() - start
+        ramp.stop()
+        motor_stats = [session.scheduler.stats() for session in fleet.connected]
+        health = fleet.health()
+        loop.run_until_complete(fleet.disconnect())
+    finally:
+        loop.close()
+
+    return _result(frames, elapsed, latency, unit="iterations", robots=len(replayed), images=images,
+                   images_per_s=images / max(elapsed, 1e-9), frame_timeout=frame_timeout, stall=stall,
+                   gets=[h.gets for h in health.values()], busy=[h.busy for h in health.values()],
+                   ramp_steps=ramp.steps, ramp_published=ramp.published,
+                   motor_achieved_rate=[stats.achieved_rate for stats in motor_stats],
+                   motor_missed_deadlines=[stats.missed_deadlines for stats in motor_stats])
+
+
+def bench_ik(duration: float, rates: Sequence[float] = (20.0, 1000.0), effectors: int = 2,
+             reach: float = 0.5) -> Dict:
+    """
+    Stream the InverseKinematics circle trajectories to a replayed robot with TrajectoryStreamer.
+
+    Each effector follows the tutorial's wobbling circle, sampled with parametric(), for duration seconds at each
+    rate in turn: the tutorial's own rate, and one fast enough that sending may fall behind. Each run reports the
+    time spent in motor.set and how late the streamer sent its ticks and how many it skipped.
+    """
+    backend = ReplayBackend(Recording(), speed=None, interrupt_at_end=False)
+    robot, _ = backend.quick_connect(channels=["motor"])
+
+    def circle(t: np.ndarray) -> np.ndarray:
+        # circle_with_wobble from Control/InverseKinematics/Python/main.py, one radian per second
+        return np.stack((reach * 0.25 * np.cos(t), reach * 0.25 * np.sin(t),
+                         reach * 0.3 + reach * 0.05 * np.cos(t * 6)), axis=1)
+
+    results = {}
+    for rate in rates:
+        trajectories = {f"effector{i}": parametric(circle, duration, rate) for i in range(effectors)}
+        profiler = LoopProfiler(report_on_exit=False)
+        streamer = TrajectoryStreamer(robot, trajectories, track=False, profiler=profiler)
+        start = time.perf_counter()
+        streamer.start()
+        streamer.wait()
+        elapsed = time.perf_counter() - start
+        streamer.stop()
+
+        stats = streamer.stats()
+        set_stats = profiler.summary().get((robot.robot_details.name, "motor.set"), {})
+        results[f"{rate:g}hz"] = {
+            "ticks": stats.points, "effectors": stats.effectors, "elapsed_s": elapsed,
+            "ticks_per_s": stats.sent / max(elapsed, 1e-9), "target_rate": rate, "sent": stats.sent,
+            "failed": stats.failed, "skipped_ticks": stats.skipped,
+            "latency_ms": {key: set_stats.get(key, 0.0) * 1000 for key in ("mean", "p50", "p95", "p99", "max")},
+            "lateness_ms": {"mean": stats.mean_lateness * 1000, "max": stats.max_lateness * 1000}}
+    return results
+
+
+def _environment() -> Dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=_REPO_ROOT, capture_output=True, text=True,
+                                timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "processor": platform.processor(), "cpu_count": os.cpu_count(), "numpy": np.__version__,
+            "opencv": cv2.__version__, "time": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+
+
+def _print_summary(name: str, result: Dict, out):
+    if "skipped" in result:
+        print(f"{name}: skipped, {result['skipped']}", file=out)
+        return
+    rate = next((key for key in result if key.endswith("_per_s")), None)
+    if rate is None:
+        for case, case_result in result.items():
+            _print_summary(f"{name}.{case}", case_result, out)
+        return
+    latency = result["latency_ms"]
+    line = (f"{name}: {result[rate]:.1f} {rate.replace('_per_s', '/s')}, latency mean {latency['mean']:.2f}ms "
+            f"p95 {latency['p95']:.2f}ms p99 {latency['p99']:.2f}ms")
+    if "lateness_ms" in result:
+        line += (f", lateness mean {result['lateness_ms']['mean']:.2f}ms max {result['lateness_ms']['max']:.2f}ms, "
+                 f"{result['skipped_ticks']} skipped")
+    print(line, file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tutorial pipelines headless.")
+    parser.add_argument("--recording", help="Use the vision data in this recording instead of synthetic frames")
+    parser.add_argument("--only", help="Comma separated benchmarks to run: decode, object_recognition, "
+                                       "multi_robot, ik")
+    parser.add_argument("--frames", type=int, default=300, help="Frames or loop iterations per benchmark")
+    parser.add_argument("--width", type=int, default=640, help="Width of synthetic frames")
+    parser.add_argument("--height", type=int, default=480, help="Height of synthetic frames")
+    parser.add_argument("--robots", type=int, default=2, help="Robots in the multi robot benchmark")
+    parser.add_argument("--stall", type=float, default=0.0,
+                        help="Extra seconds each get from the last robot takes in the multi robot benchmark")
+    parser.add_argument("--workers", type=int, help="Detection worker processes, by default as in the tutorial")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="Replay speed as a multiple of real time, or 0 to serve frames as fast as they are read")
+    parser.add_argument("--ik-duration", type=float, default=2.0,
+                        help="Seconds to stream the IK trajectories for at each rate")
+    parser.add_argument("--output", default="-", help="File to write the JSON results to, or - for stdout")
+    args = parser.parse_args()
+
+    recording = Recording.load(args.recording) if args.recording else \
+        synthetic_recording(width=args.width, height=args.height)
+    speed = args.speed if args.speed > 0 else None
+
+    benchmarks: Dict[str, Callable[[], Dict]] = {
+        "decode": lambda: bench_decode(recording, args.frames, args.width, args.height),
+        "object_recognition": lambda: bench_object_recognition(recording, args.frames, speed, args.workers),
+        "multi_robot": lambda: bench_multi_robot(recording, args.frames, args.robots, speed,
+                                                       stall=args.stall),
+        "ik": lambda: bench_ik(args.ik_duration),
+    }
+    selected = args.only.split(",") if args.only else list(benchmarks.keys())
+    unknown = [name for name in selected if name not in benchmarks]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    results = {"environment": _environment(),
+               "source": os.path.abspath(args.recording) if args.recording else "synthetic",
+               "benchmarks": {}}
+    for name in selected:
+        results["benchmarks"][name] = benchmarks[name]()
+        _print_summary(name, results["benchmarks"][name], sys.stderr)
+
+    if args.output == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
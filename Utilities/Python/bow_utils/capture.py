@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Deque, Dict, List, NamedTuple, Optional
+
+
+class CapturedFrame(NamedTuple):
+    """An image sample together with the order and time it was received in."""
+    sample: object
+    sequence: int
+    timestamp: float
+
+
+class CaptureStats(NamedTuple):
+    """Counters for a single image source."""
+    received: int
+    delivered: int
+    dropped: int
+
+
+class _SourceRing:
+    def __init__(self, depth: int):
+        self.frames: Deque[CapturedFrame] = deque(maxlen=depth)
+        self.latest: Optional[CapturedFrame] = None
+        self.last_delivered = -1
+        self.received = 0
+        self.delivered = 0
+        self.dropped = 0
+
+
+class VisionCapture:
+    """
+    Pull images from a robot's vision channel on a background thread.
+
+    Every call to vision.get is made from the capture thread and each new sample is pushed into a small
+    per-source ring buffer. When the ring is full the oldest frame is discarded, and reading the next frame
+    always returns the newest one, so a slow consumer skips stale frames instead of falling behind. Frames
+    that are never handed to the consumer are counted as dropped.
+    """
+
+    def __init__(self, robot, depth: int = 2, retry_delay: float = 0.001, profiler=None, recorder=None):
+        """
+        :param robot: A connected bow_api robot with the vision channel open.
+        :param depth: The number of frames kept per image source.
+        :param retry_delay: Time in seconds to wait before polling again after a failed or empty get.
+        :param profiler: A LoopProfiler to record the time spent in vision.get with, if any.
+        :param recorder: A started SessionRecorder to record every image received with, if any.
+        """
+        self.robot = robot
+        self.depth = depth
+        self.retry_delay = retry_delay
+        self.profiler = profiler
+        self.recorder = recorder
+        self.last_error = None
+
+        self._rings: Dict[str, _SourceRing] = {}
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the capture thread."""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="VisionCapture")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 1.0):
+        """
+        Stop the capture thread and wake any consumer blocked in wait_next.
+
+        :param timeout: Maximum time in seconds to wait for the thread to exit.
+        """
+        self._running = False
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        get_timer = nullcontext()
+        if self.profiler is not None:
+            get_timer = self.profiler.stage("vision.get", self.robot.robot_details.name)
+
+        while self._running:
+            with get_timer:
+                image_list, err = self.robot.vision.get(True)
+            if not err.Success or image_list is None or len(image_list.Samples) == 0:
+                self.last_error = err
+                time.sleep(self.retry_delay)
+                continue
+
+            if self.recorder is not None:
+                self.recorder.add_images(self.robot.robot_details.name, image_list)
+
+            now = time.monotonic()
+            with self._condition:
+                for sample in image_list.Samples:
+                    if not sample.NewDataFlag or len(sample.Data) == 0:
+                        continue
+
+                    ring = self._rings.get(sample.Source)
+                    if ring is None:
+                        ring = _SourceRing(self.depth)
+                        self._rings[sample.Source] = ring
+
+                    # Frames pushed out of a full ring were never seen by the consumer
+                    if len(ring.frames) == ring.frames.maxlen and \
+                            ring.frames[0].sequence > ring.last_delivered:
+                        ring.dropped += 1
+
+                    self._sequence += 1
+                    frame = CapturedFrame(sample, self._sequence, now)
+                    ring.frames.append(frame)
+                    ring.latest = frame
+                    ring.received += 1
+                self._condition.notify_all()
+
+    def _take(self, ring: _SourceRing) -> Optional[CapturedFrame]:
+        frame = ring.latest
+        if frame is None or frame.sequence <= ring.last_delivered:
+            return None
+
+        # Anything older than the newest frame that has not been delivered is now stale
+        for old in ring.frames:
+            if ring.last_delivered < old.sequence < frame.sequence:
+                ring.dropped += 1
+        ring.last_delivered = frame.sequence
+        ring.delivered += 1
+        return frame
+
+    @property
+    def sources(self) -> List[str]:
+        """The image sources seen so far, in the order they first arrived."""
+        with self._condition:
+            return list(self._rings.keys())
+
+    def wait_for_sources(self, timeout: Optional[float] = None) -> List[str]:
+        """
+        Block until at least one image source has been seen.
+
+        :param timeout: Maximum time in seconds to wait, or None to wait indefinitely.
+        :return: The image sources seen so far, which is empty if the timeout expired.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._rings) > 0 or not self._running, timeout)
+            return list(self._rings.keys())
+
+    def latest(self, source: str) -> Optional[CapturedFrame]:
+        """
+        Return the most recent frame from a source without marking it as consumed.
+
+        :param source: The ImageSample.Source to read.
+        :return: The newest frame, or None if nothing has been received from the source.
+        """
+        with self._condition:
+            ring = self._rings.get(source)
+            return None if ring is None else ring.latest
+
+    def wait_next(self, source: str, timeout: Optional[float] = None) -> Optional[CapturedFrame]:
+        """
+        Return the newest frame from a source that has not been returned before, blocking until one arrives.
+
+        :param source: The ImageSample.Source to read.
+        :param timeout: Maximum time in seconds to wait, or None to wait indefinitely.
+        :return: The newest unseen frame, or None if the timeout expired or the capture was stopped.
+        """
+        with self._condition:
+            frame = None
+
+            def ready():
+                nonlocal frame
+                ring = self._rings.get(source)
+                if ring is not None:
+                    frame = self._take(ring)
+                return frame is not None or not self._running
+
+            self._condition.wait_for(ready, timeout)
+            return frame
+
+    def wait_next_all(self, timeout: Optional[float] = None) -> List[CapturedFrame]:
+        """
+        Return the newest unseen frame from every source that has one, blocking until at least one arrives.
+
+        :param timeout: Maximum time in seconds to wait, or None to wait indefinitely.
+        :return: The new frames in source order, which is empty if the timeout expired or the capture was stopped.
+        """
+        with self._condition:
+            frames = []
+
+            def ready():
+                for ring in self._rings.values():
+                    frame = self._take(ring)
+                    if frame is not None:
+                        frames.append(frame)
+                return len(frames) > 0 or not self._running
+
+            self._condition.wait_for(ready, timeout)
+            return frames
+
+    def stats(self) -> Dict[str, CaptureStats]:
+        """Return the received, delivered and dropped frame counts for each source."""
+        with self._condition:
+            return {source: CaptureStats(ring.received, ring.delivered, ring.dropped)
+                    for source, ring in self._rings.items()}
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+import asyncio
+import base64
+import hashlib
+import html
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, NamedTuple, Optional
+from urllib.parse import quote, unquote
+
+import cv2
+import numpy as np
+
+_WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_MAX_HEADER_LINES = 100
+
+
+class DashboardStats(NamedTuple):
+    """Counters reported by a Dashboard."""
+    published: int  # Images accepted for encoding
+    skipped: int  # Images ignored because nobody was watching their stream or it was not yet due
+    encoded: int  # JPEG encodings completed, each shared by every viewer of the stream
+    sent: int  # JPEGs written to viewers
+    dropped: int  # Encoded frames viewers missed because they were still receiving an earlier one
+    viewers: int  # Connected stream viewers
+
+
+class _Stream:
+    """The latest encoded JPEG of one camera, owned by the event loop thread."""
+
+    def __init__(self):
+        self.jpeg = b""
+        self.version = 0
+        self.updated = asyncio.Event()
+        self.encoding = False
+        self.pending: Optional[np.ndarray] = None
+
+    def publish(self, jpeg: bytes):
+        self.jpeg = jpeg
+        self.version += 1
+        # Wake everyone waiting on this version and start a new event for the next
+        updated = self.updated
+        self.updated = asyncio.Event()
+        updated.set()
+
+
+class Dashboard:
+    """
+    Serve camera images from many robots to any number of browsers, from an asyncio server on its own thread.
+
+    The page at http://host:port/ shows every stream as MJPEG, and each stream is also available as binary
+    WebSocket messages at /ws/NAME, one JPEG per message. publish() only copies the image and hands it to the
+    server thread, and does nothing at all for streams nobody is watching. Images are downscaled and JPEG encoded
+    once in a thread pool, and the same bytes are sent to every viewer. A viewer still receiving an earlier frame
+    is sent the newest one when it is ready, so a slow connection skips frames instead of queueing them.
+
+    A Dashboard is also a display sink, so Display(Dashboard(...)) or BOW_DISPLAY=dashboard:PORT shows the images
+    of an existing tutorial in the browser.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8080, max_width: int = 640, quality: int = 70,
+                 max_fps: Optional[float] = 15.0, encode_workers: int = 2):
+        """
+        :param host: The address to listen on. The default only accepts connections from this machine.
+        :param port: The port to listen on, or 0 to pick a free one.
+        :param max_width: Images wider than this are downscaled to it before encoding, keeping their aspect ratio.
+        :param quality: The JPEG quality, from 0 to 100.
+        :param max_fps: The most frames per second encoded for each stream, or None for every published image.
+        :param encode_workers: The number of threads encoding JPEGs.
+        """
+        self.host = host
+        self.port = port
+        self.max_width = max_width
+        self.quality = quality
+        self.period = 1.0 / max_fps if max_fps else 0.0
+        self.url = ""
+        self._encode_workers = encode_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._error: Optional[BaseException] = None
+
+        # Shared with the caller's thread
+        self._lock = threading.Lock()
+        self._due: Dict[str, float] = {}
+        self._watching: Dict[str, int] = {}
+
+        # Only touched on the event loop thread
+        self._streams: Dict[str, _Stream] = {}
+        self._tasks = set()
+
+        self._published = 0
+        self._skipped = 0
+        self._encoded = 0
+        self._sent = 0
+        self._dropped = 0
+
+    def start(self):
+        """Start the server, raising OSError if it cannot listen on the port."""
+        if self._thread is not None:
+            return
+        self._pool = ThreadPoolExecutor(self._encode_workers, thread_name_prefix="DashboardEncoder")
+        self._loop = asyncio.new_event_loop()
+        self._ready.clear()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="Dashboard", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            self._thread.join()
+            self._thread = None
+            self._pool.shutdown(wait=False)
+            raise self._error
+
+    def stop(self):
+        """Disconnect every viewer and stop the server."""
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+        self._pool.shutdown(wait=True)
+
+    def publish(self, name: str, image: np.ndarray) -> bool:
+        """
+        Offer a new image for a stream.
+
+        :param name: The stream name, usually the robot and camera names.
+        :param image: A BGR or greyscale image. It is copied, so the caller may reuse its buffer straight away.
+        :return: True if the image will be encoded, False if nobody is watching or the stream is not yet due.
+        """
+        if self._thread is None:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            due = self._due.get(name)
+            if due is None:
+                # Register new streams so they are listed on the page before anyone watches them
+                self._due[name] = 0.0
+                self._loop.call_soon_threadsafe(self._stream, name)
+                due = 0.0
+            if self._watching.get(name, 0) == 0 or now < due:
+                self._skipped += 1
+                return False
+            self._due[name] = now + self.period
+            self._published += 1
+        self._loop.call_soon_threadsafe(self._submit, name, image.copy())
+        return True
+
+    def stats(self) -> DashboardStats:
+        with self._lock:
+            viewers = sum(self._watching.values())
+            return DashboardStats(self._published, self._skipped, self._encoded, self._sent, self._dropped, viewers)
+
+    # Display sink interface
+
+    def show(self, name: str, image: np.ndarray):
+        self.publish(name, image)
+
+    def poll(self) -> int:
+        return -1
+
+    def close(self):
+        self.stop()
+
+    # Event loop thread
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port))
+        except OSError as e:
+            self._error = e
+            self._loop.close()
+            self._ready.set()
+            return
+
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.url = f"http://{self.host}:{self.port}/"
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            for task in self._tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*self._tasks, return_exceptions=True))
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+    def _stream(self, name: str) -> _Stream:
+        stream = self._streams.get(name)
+        if stream is None:
+            stream = _Stream()
+            self._streams[name] = stream
+        return stream
+
+    def _submit(self, name: str, image: np.ndarray):
+        stream = self._stream(name)
+        if stream.encoding:
+            # Only the newest waiting image is kept, anything older would never be sent
+            stream.pending = image
+            return
+        stream.encoding = True
+        task = self._loop.create_task(self._encode(stream, image))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _encode(self, stream: _Stream, image: Optional[np.ndarray]):
+        try:
+            while image is not None:
+                jpeg = await self._loop.run_in_executor(self._pool, self._encode_jpeg, image)
+                if jpeg is not None:
+                    self._encoded += 1
+                    stream.publish(jpeg)
+                image, stream.pending = stream.pending, None
+        finally:
+            stream.encoding = False
+
+    def _encode_jpeg(self, image: np.ndarray) -> Optional[bytes]:
+        height, width = image.shape[:2]
+        if width > self.max_width:
+            size = (self.max_width, max(1, round(height * self.max_width / width)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        ok, jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return jpeg.tobytes() if ok else None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            request = await reader.readline()
+            headers = {}
+            for _ in range(_MAX_HEADER_LINES):
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+
+            parts = request.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] != "GET":
+                await self._respond(writer, "405 Method Not Allowed", "text/plain", b"Method not allowed")
+            elif parts[1] == "/":
+                await self._respond(writer, "200 OK", "text/html", self._page())
+            elif parts[1].startswith("/stream/"):
+                await self._serve_mjpeg(unquote(parts[1][len("/stream/"):]), reader, writer)
+            elif parts[1].startswith("/ws/") and "sec-websocket-key" in headers:
+                await self._serve_websocket(unquote(parts[1][len("/ws/"):]), headers["sec-websocket-key"],
+                                            reader, writer)
+            else:
+                await self._respond(writer, "404 Not Found", "text/plain", b"Not found")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._tasks.discard(task)
+            writer.close()
+
+    def _page(self) -> bytes:
+        body = "".join(f'<figure><img src="/stream/{quote(name)}"><figcaption>{html.escape(name)}</figcaption></figure>'
+                       for name in sorted(self._streams))
+        if not body:
+            body = "<p>No streams yet, reload once the robots are connected.</p>"
+        return ("<html><head><title>BOW Dashboard</title>"
+                "<style>figure{display:inline-block;margin:4px}</style></head>"
+                f"<body>{body}</body></html>").encode()
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: str, content_type: str, body: bytes):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                     "Connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def _serve_mjpeg(self, name: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary=frame\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+
+        def frame(jpeg: bytes) -> bytes:
+            return (b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: " + str(len(jpeg)).encode() +
+                    b"\r\n\r\n" + jpeg + b"\r\n")
+
+        # Viewers of an MJPEG stream send nothing more, so reading only returns once they disconnect
+        await self._send_frames(name, reader.read(), writer, frame)
+
+    async def _serve_websocket(self, name: str, key: str, reader: asyncio.StreamReader,
+                               writer: asyncio.StreamWriter):
+        accept = base64.b64encode(hashlib.sha1(key.encode() + _WEBSOCKET_GUID).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+
+        def frame(jpeg: bytes) -> bytes:
+            # An unmasked, final, binary message
+            length = len(jpeg)
+            if length < 126:
+                header = struct.pack("!BB", 0x82, length)
+            elif length < 65536:
+                header = struct.pack("!BBH", 0x82, 126, length)
+            else:
+                header = struct.pack("!BBQ", 0x82, 127, length)
+            return header + jpeg
+
+        await self._send_frames(name, self._websocket_closed(reader), writer, frame)
+
+    @staticmethod
+    async def _websocket_closed(reader: asyncio.StreamReader):
+        # Messages from the viewer are ignored, only a close message or the connection ending matters
+        while True:
+            data = await reader.read(4096)
+            if not data or data[0] & 0x0F == 0x8:
+                return
+
+    async def _send_frames(self, name: str, closed, writer: asyncio.StreamWriter, frame):
+        stream = self._stream(name)
+        with self._lock:
+            self._watching[name] = self._watching.get(name, 0) + 1
+            # Encode the next published image straight away for the new viewer
+            self._due[name] = 0.0
+        closed = asyncio.ensure_future(closed)
+        sent = 0
+        try:
+            while not closed.done():
+                if stream.version == sent:
+                    updated = asyncio.ensure_future(stream.updated.wait())
+                    await asyncio.wait({updated, closed}, return_when=asyncio.FIRST_COMPLETED)
+                    updated.cancel()
+                    continue
+
+                version, jpeg = stream.version, stream.jpeg
+                if sent:
+                    self._dropped += version - sent - 1
+                writer.write(frame(jpeg))
+                await writer.drain()
+                sent = version
+                self._sent += 1
+        finally:
+            closed.cancel()
+            with self._lock:
+                self._watching[name] -= 1
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+from typing import Dict, Hashable, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+
+class BatchDetector:
+    """
+    Run a YOLO model over images from many cameras with one predict call per batch.
+
+    Images are passed in keyed by whatever identifies their source (for example a (robot name, camera)
+    tuple) and the results are handed back under the same keys, so each set of boxes can be drawn on or
+    acted upon for the camera it came from.
+    """
+
+    def __init__(self, model, max_batch: int = 16, device: str = "cpu", **predict_args):
+        """
+        :param model: A loaded ultralytics YOLO model.
+        :param max_batch: The largest number of images passed to a single predict call.
+        :param device: The device to run inference on.
+        :param predict_args: Any further arguments to pass to model.predict.
+        """
+        self.model = model
+        self.max_batch = max_batch
+        self.predict_args = dict(show=False, stream_buffer=False, verbose=False, device=device)
+        self.predict_args.update(predict_args)
+
+    def predict(self, images: Dict[Hashable, np.ndarray]) -> Dict[Hashable, object]:
+        """
+        Detect objects in every image.
+
+        :param images: The images to process, keyed by source.
+        :return: The ultralytics Results object for each image, keyed by the same source.
+        """
+        keys = list(images.keys())
+        results = {}
+        for start in range(0, len(keys), self.max_batch):
+            batch_keys = keys[start:start + self.max_batch]
+            batch_results = self.model.predict(source=[images[key] for key in batch_keys], **self.predict_args)
+            for key, result in zip(batch_keys, batch_results):
+                results[key] = result
+        return results
+
+
+class DetectionView:
+    """
+    A read-only view of one detection in a DetectionBatch.
+
+    The box and center are views into the batch's arrays rather than copies.
+    """
+
+    __slots__ = ("_batch", "_index")
+
+    def __init__(self, batch: "DetectionBatch", index: int):
+        self._batch = batch
+        self._index = index
+
+    @property
+    def classification(self) -> str:
+        return self._batch.names[int(self._batch.class_ids[self._index])]
+
+    @property
+    def class_id(self) -> int:
+        return int(self._batch.class_ids[self._index])
+
+    @property
+    def confidence(self) -> float:
+        return float(self._batch.confidences[self._index])
+
+    @property
+    def box(self) -> np.ndarray:
+        return self._batch.boxes[self._index]
+
+    @property
+    def center(self) -> np.ndarray:
+        return self._batch.centers[self._index]
+
+    @property
+    def area(self) -> float:
+        return float(self._batch.areas[self._index])
+
+    @property
+    def track_id(self) -> int:
+        return int(self._batch.track_ids[self._index])
+
+    @property
+    def hits(self) -> int:
+        return int(self._batch.hits[self._index])
+
+
+class DetectionBatch:
+    """
+    Every object detected in one image, stored as one NumPy array per field instead of one object per box.
+
+    Centers are normalised to the image size with the origin at the bottom left, and areas are the fraction of
+    the image each box covers, both computed for the whole batch at once. Slicing a batch or indexing a single
+    detection returns views onto the same arrays.
+    """
+
+    def __init__(self, boxes: np.ndarray, confidences: np.ndarray, class_ids: np.ndarray, names: Mapping[int, str],
+                 width: float, height: float, track_ids: Optional[np.ndarray] = None,
+                 hits: Optional[np.ndarray] = None, centers: Optional[np.ndarray] = None,
+                 areas: Optional[np.ndarray] = None):
+        """
+        :param boxes: (N, 4) box corners as x1, y1, x2, y2 in pixels.
+        :param confidences: (N,) confidence of each box.
+        :param class_ids: (N,) class of each box.
+        :param names: Mapping from class id to class name, as given by the model.
+        :param width: The width of the image the boxes are in.
+        :param height: The height of the image the boxes are in.
+        :param track_ids: (N,) tracker identity of each box, or -1 where untracked.
+        :param hits: (N,) number of detections each tracked box has been confirmed by.
+        :param centers: Precomputed normalised centers, only used when creating views.
+        :param areas: Precomputed normalised areas, only used when creating views.
+        """
+        self.boxes = np.asarray(boxes, np.float32).reshape(-1, 4)
+        self.confidences = np.asarray(confidences, np.float32).reshape(-1)
+        self.class_ids = np.asarray(class_ids, np.int32).reshape(-1)
+        self.names = names
+        self.width = width
+        self.height = height
+        count = len(self.boxes)
+        self.track_ids = np.full(count, -1, np.int64) if track_ids is None else np.asarray(track_ids, np.int64)
+        self.hits = np.ones(count, np.int32) if hits is None else np.asarray(hits, np.int32)
+
+        if centers is None or areas is None:
+            size = np.array([width, height], np.float32)
+            extent = self.boxes[:, 2:] - self.boxes[:, :2]
+            centers = np.trunc(self.boxes[:, :2] + extent / 2) / size
+            centers[:, 1] = 1 - centers[:, 1]
+            areas = np.prod(extent, axis=1) / (width * height)
+        self.centers = centers
+        self.areas = areas
+
+    @classmethod
+    def empty(cls, names: Optional[Mapping[int, str]] = None) -> "DetectionBatch":
+        """Create a batch with no detections."""
+        return cls(np.empty((0, 4)), np.empty(0), np.empty(0), names if names is not None else {}, 1, 1)
+
+    @classmethod
+    def from_boxes(cls, boxes, names: Mapping[int, str], width: float, height: float) -> "DetectionBatch":
+        """
+        Create a batch from the boxes of an ultralytics result, e.g. results[0].boxes.
+
+        :param boxes: The ultralytics Boxes object.
+        :param names: Mapping from class id to class name, as given by model.names.
+        :param width: The width of the image the boxes are in.
+        :param height: The height of the image the boxes are in.
+        """
+        boxes = boxes.cpu()
+        return cls(boxes.xyxy.numpy(), boxes.conf.numpy(), boxes.cls.numpy(), names, width, height)
+
+    @classmethod
+    def from_tracks(cls, tracked: Sequence, names: Mapping[int, str], width: float,
+                    height: float) -> "DetectionBatch":
+        """
+        Create a batch from the output of an ObjectTracker.
+
+        :param tracked: The TrackedObjects returned by ObjectTracker.update or predict.
+        :param names: Mapping from class id to class name.
+        :param width: The width of the image the boxes are in.
+        :param height: The height of the image the boxes are in.
+        """
+        if len(tracked) == 0:
+            return cls.empty(names)
+        return cls(np.array([t.box for t in tracked]), np.array([t.confidence for t in tracked]),
+                   np.array([t.class_id for t in tracked]), names, width, height,
+                   track_ids=np.array([t.track_id for t in tracked]), hits=np.array([t.hits for t in tracked]))
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return DetectionBatch(self.boxes[index], self.confidences[index], self.class_ids[index], self.names,
+                                  self.width, self.height, self.track_ids[index], self.hits[index],
+                                  self.centers[index], self.areas[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("detection index out of range")
+        return DetectionView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield DetectionView(self, index)
+
+    def select(self, mask: np.ndarray) -> "DetectionBatch":
+        """
+        Create a batch holding only some of the detections.
+
+        :param mask: A boolean mask or array of indices into this batch.
+        """
+        return DetectionBatch(self.boxes[mask], self.confidences[mask], self.class_ids[mask], self.names,
+                              self.width, self.height, self.track_ids[mask], self.hits[mask], self.centers[mask],
+                              self.areas[mask])
+
+    def class_mask(self, classification: str) -> np.ndarray:
+        """
+        Find the detections of one class.
+
+        :param classification: The class name to look for.
+        :return: A boolean mask over the batch.
+        """
+        for class_id, name in self.names.items():
+            if name == classification:
+                return self.class_ids == class_id
+        return np.zeros(len(self), bool)
+
+    @property
+    def classifications(self) -> List[str]:
+        """The class name of every detection."""
+        return [self.names[int(class_id)] for class_id in self.class_ids]
+
+
+class DetectionIndex:
+    """
+    Look up the detections in a DetectionBatch by class or track without scanning the batch.
+
+    The index is built once, with a single sort of the class ids, when a new batch arrives. After that the
+    detections, count and highest confidence detection of any class can be found in constant time.
+    """
+
+    def __init__(self, batch: DetectionBatch):
+        """
+        :param batch: The detections to index.
+        """
+        self.batch = batch
+        self._class_ids_by_name = {name: class_id for class_id, name in batch.names.items()}
+        self._groups: Dict[int, np.ndarray] = {}
+        self._best: Dict[int, int] = {}
+
+        if len(batch) > 0:
+            order = np.argsort(batch.class_ids, kind="stable")
+            class_ids, starts = np.unique(batch.class_ids[order], return_index=True)
+            ends = np.append(starts[1:], len(order))
+            for class_id, start, end in zip(class_ids.tolist(), starts.tolist(), ends.tolist()):
+                group = order[start:end]
+                self._groups[class_id] = group
+                self._best[class_id] = int(group[np.argmax(batch.confidences[group])])
+
+        self._by_track = {track_id: i for i, track_id in enumerate(batch.track_ids.tolist()) if track_id >= 0}
+
+    def _class_id(self, classification) -> Optional[int]:
+        if isinstance(classification, str):
+            return self._class_ids_by_name.get(classification)
+        if isinstance(classification, (int, np.integer)):
+            return int(classification)
+        # Anything else, such as None, matches no class
+        return None
+
+    def indices(self, classification) -> np.ndarray:
+        """
+        :param classification: A class name or id.
+        :return: The positions in the batch of every detection of the class.
+        """
+        group = self._groups.get(self._class_id(classification))
+        return group if group is not None else np.empty(0, np.int64)
+
+    def count(self, classification) -> int:
+        """
+        :param classification: A class name or id.
+        :return: The number of detections of the class.
+        """
+        return len(self.indices(classification))
+
+    def counts(self) -> Dict[str, int]:
+        """The number of detections of each class present, keyed by class name."""
+        return {self.batch.names[class_id]: len(group) for class_id, group in self._groups.items()}
+
+    def best(self, classification) -> Optional[DetectionView]:
+        """
+        :param classification: A class name or id.
+        :return: The most confident detection of the class, or None if there is none.
+        """
+        index = self._best.get(self._class_id(classification))
+        return None if index is None else self.batch[index]
+
+    def track(self, track_id: int) -> Optional[DetectionView]:
+        """
+        :param track_id: A tracker identity.
+        :return: The detection with that identity, or None if it is not present.
+        """
+        index = self._by_track.get(track_id)
+        return None if index is None else self.batch[index]
+
+    def __contains__(self, classification) -> bool:
+        return self._class_id(classification) in self._groups
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+import os
+import pickle
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+from .recorder import parse_message, serialise_message
+
+CACHE_VERSION = 1
+
+
+def default_cache_path() -> str:
+    """The cache file used when none is given, which BOW_DISCOVERY_CACHE overrides."""
+    return os.environ.get("BOW_DISCOVERY_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "bow",
+                                                                 "robots.cache")
+
+
+class DiscoveryResult(NamedTuple):
+    """The robots found by one search, or loaded from the cache."""
+    robots: List  # Robot details as returned in get_robots().robots, local robots first
+    timestamp: float  # time.time() when the search finished
+    duration: float  # Seconds the search took
+    local_error: Optional[str]  # Why the local search failed, if it did
+    remote_error: Optional[str]  # Why the remote search failed, if it did
+    from_cache: bool
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.timestamp
+
+    @property
+    def available(self) -> List:
+        """The robots which were available when the search was made."""
+        return [robot for robot in self.robots if robot.robot_state.available]
+
+
+def _robot_id(robot) -> str:
+    return getattr(robot, "robot_id", "") or robot.name
+
+
+class DiscoveryCache:
+    """
+    Find robots without waiting for a full search every time a script starts.
+
+    The result of the last search is kept in a file, and while it is younger than ttl seconds it is used straight
+    away, so a script can connect to a robot it already knows about while a fresh search runs in the background.
+    The local and remote searches run at the same time in their own threads, so a search takes as long as the
+    slower of the two rather than both.
+    """
+
+    def __init__(self, api, path: Optional[str] = None, ttl: float = 300.0, get_local: bool = True,
+                 get_remote: bool = True):
+        """
+        :param api: The bow_api module, already set up and logged in.
+        :param path: The cache file, by default ~/.cache/bow/robots.cache or BOW_DISCOVERY_CACHE if set.
+        :param ttl: Seconds for which a cached search is used instead of waiting for a new one.
+        :param get_local: Search the local network.
+        :param get_remote: Search for remote robots.
+        """
+        self.api = api
+        self.path = path or default_cache_path()
+        self.ttl = ttl
+        self.get_local = get_local
+        self.get_remote = get_remote
+
+        self._result: Optional[DiscoveryResult] = self.load()
+        self._lock = threading.Lock()
+        self._searched = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def result(self) -> Optional[DiscoveryResult]:
+        """The newest search result, which may have come from the cache, or None if there is none yet."""
+        return self._result
+
+    @property
+    def fresh(self) -> bool:
+        return self._result is not None and self._result.age < self.ttl
+
+    def load(self) -> Optional[DiscoveryResult]:
+        """
+        Read the cache file.
+
+        :return: The cached result, or None if there is no usable cache.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                cached = pickle.load(f)
+            if cached.get("version") != CACHE_VERSION:
+                return None
+            robots = [parse_message(message, data) for message, data in cached["robots"]]
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, KeyError, ValueError):
+            return None
+        return DiscoveryResult(robots, cached["timestamp"], cached["duration"], None, None, True)
+
+    def save(self, result: DiscoveryResult):
+        """Write a result to the cache file, replacing it in one step so a concurrent reader never sees half."""
+        cached = {"version": CACHE_VERSION, "timestamp": result.timestamp, "duration": result.duration,
+                  "robots": [serialise_message(robot) for robot in result.robots]}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            pickle.dump(cached, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.path)
+
+    def _search(self, local: bool, results: dict):
+        results[local] = self.api.get_robots(get_local=local, get_remote=not local, get_bow_hub=False)
+
+    def refresh(self) -> DiscoveryResult:
+        """
+        Search for robots now, running the local and remote searches at the same time, and update the cache.
+
+        :return: The robots found. If both searches fail the previous result is kept in the cache.
+        """
+        start = time.perf_counter()
+        results = {}
+        searches = [threading.Thread(target=self._search, args=(local, results), daemon=True)
+                    for local, wanted in ((True, self.get_local), (False, self.get_remote)) if wanted]
+        for search in searches:
+            search.start()
+        for search in searches:
+            search.join()
+
+        robots = {}
+        errors = {True: None, False: None}
+        for local in (True, False):
+            if local not in results:
+                continue
+            error = results[local].localSearchError if local else results[local].remoteSearchError
+            if not error.Success:
+                errors[local] = error.Description
+            for robot in results[local].robots:
+                # Both searches can report the same robot, keep the first sighting so local robots come first
+                robots.setdefault(_robot_id(robot), robot)
+
+        result = DiscoveryResult(list(robots.values()), time.time(), time.perf_counter() - start,
+                                 errors[True], errors[False], False)
+        with self._lock:
+            self._result = result
+        if len(results) > 0 and not all(errors[local] for local in results):
+            try:
+                self.save(result)
+            except OSError as e:
+                print(f"Could not save the robot discovery cache: {e}")
+        self._searched.set()
+        return result
+
+    def start(self):
+        """Start a search in the background, unless one is already running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._searched.clear()
+        self._thread = threading.Thread(target=self.refresh, name="RobotDiscovery", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[DiscoveryResult]:
+        """
+        Wait for the search started by start() to finish.
+
+        :param timeout: Maximum time in seconds to wait, or None to wait until it finishes.
+        :return: The result of the search, or None if it has not finished.
+        """
+        if not self._searched.wait(timeout):
+            return None
+        return self._result
+
+    def robots(self, timeout: Optional[float] = None) -> DiscoveryResult:
+        """
+        Return the cached robots if they are fresh, otherwise wait for a new search.
+
+        A search is started in the background if none has been, so the cache is refreshed for next time either way.
+
+        :param timeout: Maximum time in seconds to wait for a search when the cache is stale. If it runs out, the
+            stale result is returned, or an empty one if there is no cache at all.
+        """
+        if self._thread is None:
+            self.start()
+        if self.fresh:
+            return self._result
+        result = self.wait(timeout)
+        if result is not None:
+            return result
+        return self._result or DiscoveryResult([], 0.0, 0.0, None, None, True)
+
+    def find(self, name: str, timeout: Optional[float] = None):
+        """
+        Find a robot by name or ID, from the cache if it is there, otherwise from a new search.
+
+        :param name: The robot's name or ID.
+        :param timeout: Maximum time in seconds to wait for a search if the robot is not in the cache.
+        :return: The robot's details, or None if it was not found.
+        """
+        for result in (self._result, None):
+            if result is None:
+                if self._thread is None:
+                    self.start()
+                result = self.wait(timeout)
+                if result is None:
+                    return None
+            for robot in result.robots:
+                if name in (robot.name, _robot_id(robot)):
+                    return robot
+        return None
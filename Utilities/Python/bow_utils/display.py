@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+import html
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, NamedTuple, Optional
+from urllib.parse import quote, unquote
+
+import cv2
+import numpy as np
+
+
+class DisplayStats(NamedTuple):
+    """Counters reported by a Display."""
+    shown: int  # Images passed to the sink
+    skipped: int  # Images not shown because the render rate cap had been reached
+    renders: int  # Times the sink's events were pumped
+
+
+class NullSink:
+    """A sink which discards every image, for running without a display."""
+
+    def show(self, name: str, image: np.ndarray):
+        pass
+
+    def poll(self) -> int:
+        return -1
+
+    def close(self):
+        pass
+
+
+class OpenCVSink:
+    """Show each named image in its own OpenCV window."""
+
+    def __init__(self):
+        self._windows = set()
+
+    def show(self, name: str, image: np.ndarray):
+        if name not in self._windows:
+            cv2.namedWindow(name)
+            self._windows.add(name)
+        cv2.imshow(name, image)
+
+    def poll(self) -> int:
+        # The only place the window events are pumped, once per rendered frame
+        return cv2.waitKeyEx(1)
+
+    def close(self):
+        cv2.destroyAllWindows()
+        self._windows.clear()
+
+
+def _file_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_") or "image"
+
+
+class DiskSink:
+    """
+    Write each named image to a numbered file in its own directory.
+
+    Images are copied and encoded on a background thread. If it falls more than max_queue images behind, further
+    images are dropped rather than holding up the caller.
+    """
+
+    def __init__(self, directory: str, extension: str = ".jpg", max_queue: int = 32):
+        """
+        :param directory: The directory to write into, with one subdirectory per image name.
+        :param extension: The image format, as a file extension understood by cv2.imwrite.
+        :param max_queue: The most images waiting to be written.
+        """
+        self.directory = directory
+        self.extension = extension
+        self.dropped = 0
+        self._counts: Dict[str, int] = {}
+        self._queue: "queue.Queue" = queue.Queue(max_queue)
+        self._thread = threading.Thread(target=self._run, name="DiskSink", daemon=True)
+        self._thread.start()
+
+    def show(self, name: str, image: np.ndarray):
+        count = self._counts.get(name, 0)
+        self._counts[name] = count + 1
+        try:
+            self._queue.put_nowait((name, count, image.copy()))
+        except queue.Full:
+            self.dropped += 1
+
+    def poll(self) -> int:
+        return -1
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            name, count, image = item
+            directory = os.path.join(self.directory, _file_name(name))
+            os.makedirs(directory, exist_ok=True)
+            cv2.imwrite(os.path.join(directory, f"{count:06d}{self.extension}"), image)
+
+
+class MJPEGSink:
+    """
+    Serve each named image as an MJPEG stream over HTTP, for viewing in a browser.
+
+    The page at http://host:port/ shows every stream. Each new image is JPEG encoded once on a background thread
+    and the same encoding is sent to every viewer, and a viewer that is still sending the last image simply misses
+    the ones in between.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8080, quality: int = 80):
+        """
+        :param host: The address to listen on. The default only accepts connections from this machine.
+        :param port: The port to listen on.
+        :param quality: The JPEG quality, from 0 to 100.
+        """
+        self.quality = quality
+        self._latest: Dict[str, np.ndarray] = {}
+        self._encoded: Dict[str, bytes] = {}
+        self._versions: Dict[str, int] = {}
+        self._condition = threading.Condition()
+        self._running = True
+
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                sink._handle(self)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_address[1]}/"
+        threading.Thread(target=self._server.serve_forever, name="MJPEGSink", daemon=True).start()
+        self._encoder = threading.Thread(target=self._encode, name="MJPEGEncoder", daemon=True)
+        self._encoder.start()
+
+    def show(self, name: str, image: np.ndarray):
+        # Copy, since the caller may reuse its buffer before the encoder gets to it
+        image = image.copy()
+        with self._condition:
+            self._latest[name] = image
+            self._condition.notify_all()
+
+    def poll(self) -> int:
+        return -1
+
+    def close(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _encode(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._latest) > 0 or not self._running)
+                if not self._running:
+                    return
+                # Take the newest image of every stream, anything older has already been replaced
+                pending = self._latest
+                self._latest = {}
+
+            encoded = {}
+            for name, image in pending.items():
+                ok, jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                if ok:
+                    encoded[name] = jpeg.tobytes()
+
+            with self._condition:
+                for name, jpeg in encoded.items():
+                    self._encoded[name] = jpeg
+                    self._versions[name] = self._versions.get(name, 0) + 1
+                self._condition.notify_all()
+
+    def _handle(self, request: BaseHTTPRequestHandler):
+        if request.path == "/":
+            with self._condition:
+                names = sorted(self._encoded.keys())
+            body = "".join(f'<h3>{html.escape(name)}</h3><img src="/stream/{quote(name)}">' for name in names)
+            page = f"<html><head><title>BOW</title></head><body>{body}</body></html>".encode()
+            request.send_response(200)
+            request.send_header("Content-Type", "text/html")
+            request.send_header("Content-Length", str(len(page)))
+            request.end_headers()
+            request.wfile.write(page)
+            return
+
+        if not request.path.startswith("/stream/"):
+            request.send_error(404)
+            return
+
+        name = unquote(request.path[len("/stream/"):])
+        request.send_response(200)
+        request.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+        request.end_headers()
+        version = 0
+        try:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._versions.get(name, 0) > version or not self._running)
+                    if not self._running:
+                        return
+                    version = self._versions[name]
+                    jpeg = self._encoded[name]
+                request.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: " +
+                                    str(len(jpeg)).encode() + b"\r\n\r\n" + jpeg + b"\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def _has_screen() -> bool:
+    if sys.platform.startswith("linux"):
+        return bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+    return True
+
+
+def create_sink(kind: Optional[str] = None):
+    """
+    Create a display sink by name.
+
+    :param kind: "opencv", "null", "mjpeg", "mjpeg:PORT", "dashboard", "dashboard:PORT" or "disk:DIRECTORY". If
+        None, the BOW_DISPLAY environment variable is used, falling back to "opencv" when there is a screen and
+        "null" when there is not.
+    """
+    if kind is None:
+        kind = os.environ.get("BOW_DISPLAY") or ("opencv" if _has_screen() else "null")
+    name, _, argument = kind.partition(":")
+    if name == "opencv":
+        return OpenCVSink()
+    if name == "null":
+        return NullSink()
+    if name == "mjpeg":
+        sink = MJPEGSink(port=int(argument) if argument else 8080)
+        print(f"Streaming images to {sink.url}")
+        return sink
+    if name == "disk":
+        return DiskSink(argument or "frames")
+    if name == "dashboard":
+        # Imported here so the asyncio server is only loaded when it is used
+        from .dashboard import Dashboard
+        dashboard = Dashboard(port=int(argument) if argument else 8080)
+        dashboard.start()
+        print(f"Serving the dashboard at {dashboard.url}")
+        return dashboard
+    raise ValueError(f"Unknown display sink {kind}")
+
+
+class Display:
+    """
+    Show images through a sink at no more than a fixed rate, with one event pump per rendered frame.
+
+    Call show() for each image and poll() once at the end of every loop iteration. Until the next render is due,
+    show() returns immediately without touching the sink and poll() returns -1 without pumping window events, so
+    a loop running faster than max_fps spends no time on display. Once a render is due, every image shown before
+    the next poll() is rendered, so all windows update together.
+    """
+
+    def __init__(self, sink=None, max_fps: Optional[float] = 30.0):
+        """
+        :param sink: The sink to render to, or None to choose one with create_sink().
+        :param max_fps: The most renders per second, or None to render every frame.
+        """
+        self.sink = sink if sink is not None else create_sink()
+        self.period = 1.0 / max_fps if max_fps else 0.0
+        self._next_render = 0.0
+        self._rendering = False
+        self._shown = 0
+        self._skipped = 0
+        self._renders = 0
+
+    def show(self, name: str, image: np.ndarray) -> bool:
+        """
+        Show an image if a render is due.
+
+        :param name: The window or stream to show the image in.
+        :param image: The image.
+        :return: True if the image was passed to the sink.
+        """
+        if not self._rendering:
+            if time.monotonic() < self._next_render:
+                self._skipped += 1
+                return False
+            self._rendering = True
+        self.sink.show(name, image)
+        self._shown += 1
+        return True
+
+    def poll(self) -> int:
+        """
+        Finish the frame, pumping the sink's events if anything was rendered or a render is due.
+
+        :return: The key pressed in a window, or -1 if there was none.
+        """
+        now = time.monotonic()
+        if not self._rendering and now < self._next_render:
+            return -1
+        self._rendering = False
+        self._next_render = now + self.period
+        self._renders += 1
+        return self.sink.poll()
+
+    def close(self):
+        self.sink.close()
+
+    def stats(self) -> DisplayStats:
+        return DisplayStats(self._shown, self._skipped, self._renders)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from .motor import MotorScheduler
+from .profiler import LatencyHistogram
+
+
+class RobotHealth(NamedTuple):
+    """The state and call timings of one robot in a Fleet. Latencies are in seconds."""
+    name: str
+    connected: bool
+    healthy: bool  # Connected, and a call succeeded within the fleet's stale_after period
+    gets: int
+    get_errors: int
+    sets: int
+    set_errors: int
+    busy: int  # Calls not made because the previous one to the same channel had not returned
+    consecutive_errors: int
+    last_success_age: float  # Seconds since the last successful call, inf if there has been none
+    connect_time: float
+    get_p50: float
+    get_p95: float
+    set_p50: float
+    set_p95: float
+
+
+class RobotSession:
+    """One robot in a Fleet, with its latest samples, errors and call timings."""
+
+    def __init__(self, robot):
+        """
+        :param robot: A bow_api robot, which the Fleet connects.
+        """
+        self.robot = robot
+        self.name = robot.robot_details.name
+        self.connected = False
+        self.connect_time = 0.0
+        self.last_error = None
+        self.latest: Dict[str, Any] = {}
+        self.scheduler: Optional[MotorScheduler] = None
+
+        self.gets = 0
+        self.get_errors = 0
+        self.sets = 0
+        self.set_errors = 0
+        self.busy = 0
+        self.consecutive_errors = 0
+        self.last_success = -math.inf
+        self.get_latency = LatencyHistogram()
+        self.set_latency = LatencyHistogram()
+
+        # The get or set still running on each channel, so a robot that stops responding never has calls piling up
+        self._pending: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    def _success(self):
+        self.consecutive_errors = 0
+        self.last_success = time.monotonic()
+
+    def _failure(self, error):
+        self.consecutive_errors += 1
+        self.last_error = error
+
+
+class Fleet:
+    """
+    Connect to and drive many robots from one asyncio program.
+
+    Every blocking bow_api call runs in a thread pool, so robots are connected, their channels opened, polled and
+    sent commands concurrently, and a fleet takes about as long per step as its slowest robot rather than the sum
+    of all of them. A robot still busy with a call when the next one on the same channel is due is left to finish
+    and counted as busy, so one stalled robot never holds up the rest.
+    """
+
+    def __init__(self, channels: Sequence[str] = ("vision", "motor"), motor_rate: Optional[float] = None,
+                 motor_keepalive: Optional[float] = None, max_workers: int = 32, stale_after: float = 1.0,
+                 profiler=None, recorder=None):
+        """
+        :param channels: The channels to open on every robot.
+        :param motor_rate: If given, motor commands are sent by a MotorScheduler per robot at this rate, and
+            set_all() on the motor channel only publishes the command to them.
+        :param motor_keepalive: The keepalive given to each MotorScheduler, so unchanged commands are only sent
+            this often.
+        :param max_workers: The most blocking calls in progress at once, across the whole fleet.
+        :param stale_after: Seconds without a successful call after which a robot is reported unhealthy.
+        :param profiler: A LoopProfiler to record the time spent in each get and set with, if any.
+        :param recorder: A started SessionRecorder to record every sample received and command sent with, if any.
+        """
+        self.channels = list(channels)
+        self.motor_rate = motor_rate
+        self.motor_keepalive = motor_keepalive
+        self.stale_after = stale_after
+        self.profiler = profiler
+        self.recorder = recorder
+        self.sessions: List[RobotSession] = []
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="Fleet")
+
+    @property
+    def connected(self) -> List[RobotSession]:
+        return [session for session in self.sessions if session.connected]
+
+    async def _call(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def connect(self, robots: Iterable) -> List[RobotSession]:
+        """
+        Connect to every robot and open the fleet's channels on each, all at the same time.
+
+        :param robots: bow_api robots, e.g. bow_api.Robot(details) for each of the robots found by get_robots.
+        :return: A session for every robot. Those that failed to connect have connected set to False and the
+            failure in last_error.
+        """
+        sessions = [RobotSession(robot) for robot in robots]
+        await asyncio.gather(*(self._connect(session) for session in sessions))
+        self.sessions.extend(sessions)
+        return sessions
+
+    async def _connect(self, session: RobotSession):
+        start = time.perf_counter()
+        result = await self._call(session.robot.connect)
+        if not result.Success:
+            session._failure(result)
+            return
+
+        results = await asyncio.gather(*(self._call(session.robot.open_channel, channel)
+                                         for channel in self.channels))
+        for channel, result in zip(self.channels, results):
+            if not result.Success:
+                print(f"Failed to open {channel} channel on {session.name}: {result.Description}")
+                session._failure(result)
+                await self._call(session.robot.disconnect)
+                return
+
+        session.connect_time = time.perf_counter() - start
+        session.connected = True
+        session._success()
+        if self.motor_rate is not None and "motor" in self.channels:
+            session.scheduler = MotorScheduler(session.robot, rate=self.motor_rate, profiler=self.profiler,
+                                               recorder=self.recorder, keepalive=self.motor_keepalive)
+            session.scheduler.start()
+
+    def _timed(self, function, *args):
+        # Runs on a pool thread
+        start = time.perf_counter()
+        result = function(*args)
+        return result, time.perf_counter() - start
+
+    def _start(self, session: RobotSession, key: Tuple[str, str], function, *args) -> bool:
+        if key in session._pending:
+            session.busy += 1
+            return False
+        session._pending[key] = asyncio.ensure_future(self._call(self._timed, function, *args))
+        return True
+
+    async def _gather(self, sessions: List[RobotSession], started: List[RobotSession], key: Tuple[str, str],
+                      timeout: Optional[float]) -> List:
+        """Wait for the calls just started, returning every finished (session, result, duration)."""
+        # Calls left over from earlier are collected if they have finished but not waited for, so a robot which
+        # has stopped responding costs the timeout once rather than on every call. When every robot is still busy
+        # nothing was started, so wait on the calls left over instead: their results are handed back through the
+        # event loop, so returning without waiting would leave a caller with no other await spinning forever
+        waiting = started if len(started) > 0 else [session for session in sessions if key in session._pending]
+        if len(waiting) > 0:
+            await asyncio.wait([session._pending[key] for session in waiting], timeout=timeout)
+        else:
+            # Always give up control at least once, so other tasks and finished calls can run
+            await asyncio.sleep(0)
+
+        finished = []
+        for session in sessions:
+            future = session._pending.get(key)
+            if future is None or not future.done():
+                continue
+            del session._pending[key]
+            try:
+                result, duration = future.result()
+            except Exception as e:
+                session._failure(e)
+                continue
+            finished.append((session, result, duration))
+        return finished
+
+    async def get_all(self, channel: str, blocking: bool = True, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Get the latest sample on a channel from every connected robot at once.
+
+        :param channel: The channel to get from, e.g. "vision" or "proprioception".
+        :param blocking: Passed to each robot's get.
+        :param timeout: The most seconds to wait. Robots that have not answered by then are left out of this
+            result, and are not asked again until a later get_all finds their call has returned. None waits for
+            every robot.
+        :return: The samples received, by robot name.
+        """
+        key = ("get", channel)
+        sessions = self.connected
+        started = [session for session in sessions
+                   if self._start(session, key, getattr(session.robot, channel).get, blocking)]
+
+        samples = {}
+        for session, (sample, error), duration in await self._gather(sessions, started, key, timeout):
+            session.gets += 1
+            session.get_latency.record(duration)
+            if self.profiler is not None:
+                self.profiler.record(f"{channel}.get", duration, session.name)
+            if not error.Success or sample is None:
+                session.get_errors += 1
+                session._failure(error)
+                continue
+
+            session._success()
+            session.latest[channel] = sample
+            samples[session.name] = sample
+            if self.recorder is not None:
+                if channel == "vision":
+                    self.recorder.add_images(session.name, sample)
+                else:
+                    self.recorder.add_sample(session.name, channel, sample)
+        return samples
+
+    async def set_all(self, channel: str, sample, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Send a command to every connected robot at once.
+
+        :param channel: The channel to set, e.g. "motor" or "speech".
+        :param sample: The message to send to every robot, or a dictionary of messages by robot name, in which
+            case robots without one are left alone.
+        :param timeout: The most seconds to wait for the robots to accept the command, or None to wait for all.
+        :return: The result of each set that finished, by robot name. Commands handed to a motor scheduler are
+            not included.
+        """
+        key = ("set", channel)
+        sessions = self.connected
+        started = []
+        for session in sessions:
+            robot_sample = sample.get(session.name) if isinstance(sample, dict) else sample
+            if robot_sample is None:
+                continue
+            if channel == "motor" and session.scheduler is not None:
+                session.scheduler.set(robot_sample)
+                continue
+            if self._start(session, key, getattr(session.robot, channel).set, robot_sample):
+                started.append(session)
+                if self.recorder is not None:
+                    self.recorder.add_sample(session.name, channel, robot_sample)
+
+        results = {}
+        for session, result, duration in await self._gather(sessions, started, key, timeout):
+            session.sets += 1
+            session.set_latency.record(duration)
+            if self.profiler is not None:
+                self.profiler.record(f"{channel}.set", duration, session.name)
+            if result.Success:
+                session._success()
+            else:
+                session.set_errors += 1
+                session._failure(result)
+            results[session.name] = result
+        return results
+
+    def set_motor(self, sample, send_now: bool = False):
+        """
+        Publish a motor command to every connected robot's motor scheduler, from any thread.
+
+        :param sample: The MotorSample to send to every robot.
+        :param send_now: Send a changed command straight away instead of at each scheduler's next tick.
+        """
+        for session in self.connected:
+            if session.scheduler is not None:
+                session.scheduler.set(sample, send_now=send_now)
+
+    async def disconnect(self):
+        """Stop the motor schedulers and disconnect every robot at once."""
+        for session in self.connected:
+            if session.scheduler is not None:
+                session.scheduler.stop()
+        # Stop waiting for calls a robot never answered, so none is left pending when the event loop closes
+        for session in self.sessions:
+            for future in session._pending.values():
+                future.cancel()
+            session._pending.clear()
+        await asyncio.gather(*(self._call(session.robot.disconnect) for session in self.connected),
+                             return_exceptions=True)
+        for session in self.sessions:
+            session.connected = False
+        self._executor.shutdown(wait=False)
+
+    def health(self) -> Dict[str, RobotHealth]:
+        """Return the state and timings of every robot, by name."""
+        now = time.monotonic()
+        health = {}
+        for session in self.sessions:
+            age = now - session.last_success
+            health[session.name] = RobotHealth(
+                session.name, session.connected, session.connected and age <= self.stale_after,
+                session.gets, session.get_errors, session.sets, session.set_errors, session.busy,
+                session.consecutive_errors, age, session.connect_time,
+                session.get_latency.percentile(50), session.get_latency.percentile(95),
+                session.set_latency.percentile(50), session.set_latency.percentile(95))
+        return health
+
+    def report(self) -> str:
+        """Format the health of every robot as a table."""
+        lines = [f"{'robot':<24} {'healthy':>7} {'gets':>7} {'errors':>6} {'busy':>5} "
+                 f"{'get p50':>8} {'get p95':>8} {'set p95':>8} {'connect':>8}"]
+        for h in self.health().values():
+            lines.append(f"{h.name:<24} {str(h.healthy):>7} {h.gets:>7} {h.get_errors + h.set_errors:>6} "
+                         f"{h.busy:>5} {h.get_p50 * 1000:>6.1f}ms {h.get_p95 * 1000:>6.1f}ms "
+                         f"{h.set_p95 * 1000:>6.1f}ms {h.connect_time:>7.2f}s")
+        return "\n".join(lines)
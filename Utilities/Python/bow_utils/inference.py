@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+import math
+import multiprocessing
+import os
+import time
+from multiprocessing import connection, shared_memory
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+
+class DetectionResult(NamedTuple):
+    """The objects detected in one submitted image."""
+    sequence: int
+    tag: object
+    boxes: np.ndarray  # (N, 4) corners as x1, y1, x2, y2 in pixels
+    confidences: np.ndarray  # (N,)
+    class_ids: np.ndarray  # (N,)
+    duration: float  # Seconds the worker spent running the model
+    error: Optional[str]
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # Only the pool that created the block may unlink it. Older Pythons cannot opt out of tracking, but spawned
+    # workers share the parent's resource tracker so the duplicate registration is harmless there.
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _worker_main(model_path: str, predict_args: dict, threads: Optional[int], tasks, results):
+    from ultralytics import YOLO
+
+    # Stop every worker's inference library from trying to use every core at once
+    if threads is not None:
+        import torch
+        torch.set_num_threads(threads)
+
+    # Each worker loads its own copy of the model once and keeps it for its lifetime
+    model = YOLO(model_path)
+    results.send(("ready", os.getpid(), dict(model.names)))
+
+    attached: Dict[int, shared_memory.SharedMemory] = {}
+    image = None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        sequence, slot, name, shape, dtype = task
+        # Say which worker has the image, so the pool can fail it if this process dies before answering. Each
+        # worker answers on its own pipe, whose writes complete before returning, so a worker dying cannot lose
+        # this or block the other workers' answers as it could with a shared queue
+        results.send(("started", sequence, os.getpid()))
+        try:
+            shm = attached.get(slot)
+            if shm is None or shm.name != name:
+                if shm is not None:
+                    shm.close()
+                shm = _attach(name)
+                attached[slot] = shm
+
+            # Copy out of shared memory so the slot can be reused while the model still holds the image
+            if image is None or image.shape != shape or image.dtype != np.dtype(dtype):
+                image = np.empty(shape, dtype)
+            np.copyto(image, np.ndarray(shape, dtype, buffer=shm.buf))
+
+            start = time.perf_counter()
+            prediction = model.predict(source=image, **predict_args)
+            boxes = prediction[0].boxes.cpu()
+            results.send(("result", sequence, slot, boxes.xyxy.numpy(), boxes.conf.numpy(),
+                         boxes.cls.numpy().astype(np.int32), time.perf_counter() - start, None))
+        except Exception as e:
+            results.send(("result", sequence, slot, np.empty((0, 4), np.float32), np.empty(0, np.float32),
+                         np.empty(0, np.int32), 0.0, repr(e)))
+
+    for shm in attached.values():
+        shm.close()
+
+
+class DetectionWorkerPool:
+    """
+    Run YOLO object detection in a pool of worker processes.
+
+    Images are copied into a fixed set of shared memory slots rather than being pickled, and each worker
+    loads the model once when it starts. Every accepted image is given a sequence number and results are
+    handed back in submission order, even when workers finish out of order. When every slot is busy the
+    image is rejected rather than queued, so the caller never builds up a backlog of stale frames.
+
+    A worker that dies, for instance from a crash in the model or running out of memory, is replaced and the
+    images it was working on are returned with an error, so later results are not held back waiting for them
+    forever. So is any image that has not been answered within the task timeout.
+
+    The pool uses the "spawn" start method, so scripts using it must guard their entry point with
+    if __name__ == "__main__".
+    """
+
+    def __init__(self, model_path: str = "yolov8n.pt", num_workers: Optional[int] = None,
+                 slots_per_worker: int = 2, threads_per_worker: Optional[int] = 1, device: str = "cpu",
+                 task_timeout: Optional[float] = 30.0, **predict_args):
+        """
+        :param model_path: The YOLO model to load in each worker.
+        :param num_workers: The number of worker processes, defaulting to the number of CPUs.
+        :param slots_per_worker: The number of images that may be in flight per worker.
+        :param threads_per_worker: The number of threads each worker's model may use, or None to leave the default.
+        :param device: The device to run inference on.
+        :param task_timeout: Seconds after which an image that has not been answered is returned with an error,
+            or None to wait as long as its worker is alive.
+        :param predict_args: Any further arguments to pass to model.predict.
+        """
+        self.model_path = model_path
+        self.num_workers = num_workers if num_workers is not None else max(1, os.cpu_count() or 1)
+        self.predict_args = dict(show=False, stream_buffer=False, verbose=False, device=device)
+        self.predict_args.update(predict_args)
+        self.threads_per_worker = threads_per_worker
+        self.task_timeout = task_timeout
+        self.names: Dict[int, str] = {}
+        self.dropped = 0
+
+        self._context = multiprocessing.get_context("spawn")
+        self._tasks = None
+        self._workers = []
+        self._connections: List[Optional[connection.Connection]] = []
+        self._slots: List[Optional[shared_memory.SharedMemory]] = [None] * (self.num_workers * slots_per_worker)
+        self._free_slots = list(range(len(self._slots)))
+        self._reset()
+
+    def _reset(self):
+        self._tags: Dict[int, object] = {}
+        self._completed: Dict[int, DetectionResult] = {}
+        # The slot and submission time of every image not answered yet, and the worker of those it has started
+        self._in_flight: Dict[int, Tuple[int, float]] = {}
+        self._running: Dict[int, int] = {}
+        self._next_sequence = 0
+        self._next_release = 0
+        self._ready: Set[int] = set()
+
+    def _spawn(self, i: int):
+        receiver, sender = self._context.Pipe(duplex=False)
+        worker = self._context.Process(target=_worker_main, name=f"DetectionWorker{i}",
+                                       args=(self.model_path, self.predict_args, self.threads_per_worker,
+                                             self._tasks, sender))
+        worker.daemon = True
+        worker.start()
+        # Only the worker writes to the pipe, so it reads as closed once the worker has gone
+        sender.close()
+        return worker, receiver
+
+    def start(self):
+        """Start the worker processes."""
+        if len(self._workers) > 0:
+            return
+        self._tasks = self._context.Queue()
+        spawned = [self._spawn(i) for i in range(self.num_workers)]
+        self._workers = [worker for worker, _ in spawned]
+        self._connections = [receiver for _, receiver in spawned]
+
+    def stop(self, timeout: Optional[float] = 2.0):
+        """
+        Stop the workers and release the shared memory slots.
+
+        :param timeout: Maximum time in seconds to wait for each worker to exit.
+        """
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        for receiver in self._connections:
+            if receiver is not None:
+                receiver.close()
+        self._workers = []
+        self._connections = []
+
+        for i, shm in enumerate(self._slots):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+                self._slots[i] = None
+        self._free_slots = list(range(len(self._slots)))
+        # Anything still in flight is lost with the workers, so start again from the first sequence number
+        self._reset()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every worker has loaded its model.
+
+        :param timeout: Maximum time in seconds to wait, or None to wait indefinitely.
+        :return: True if all workers are ready, False if the timeout expired first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self._ready) < len(self._workers):
+            if any(not worker.is_alive() for worker in self._workers):
+                raise RuntimeError("A detection worker exited before loading its model")
+
+            wait = 0.1 if deadline is None else min(0.1, deadline - time.monotonic())
+            if wait <= 0:
+                return False
+            self._receive(wait)
+        return True
+
+    @property
+    def pending(self) -> int:
+        """The number of submitted images that have not been returned by results() yet."""
+        return self._next_sequence - self._next_release
+
+    def submit(self, image: np.ndarray, tag=None) -> Optional[int]:
+        """
+        Queue an image for detection.
+
+        The image is copied, so the caller may reuse its buffer as soon as this returns.
+
+        :param image: The image to process.
+        :param tag: Any value to hand back with the result, such as the source of the image.
+        :return: The sequence number assigned to the image, or None if every slot was busy and it was dropped.
+        """
+        self._receive(0)
+        self._recover()
+        if len(self._free_slots) == 0:
+            self.dropped += 1
+            return None
+
+        slot = self._free_slots.pop()
+        shm = self._slots[slot]
+        if shm is None or shm.size < image.nbytes:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            shm = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+            self._slots[slot] = shm
+        np.copyto(np.ndarray(image.shape, image.dtype, buffer=shm.buf), image)
+
+        sequence = self._next_sequence
+        self._next_sequence += 1
+        self._tags[sequence] = tag
+        self._in_flight[sequence] = (slot, time.monotonic())
+        self._tasks.put((sequence, slot, shm.name, image.shape, image.dtype.str))
+        return sequence
+
+    def _receive(self, timeout: Optional[float]) -> bool:
+        # Take every message that is already waiting, blocking for the first one only if asked to
+        received = False
+        while True:
+            wait = 0 if received or (timeout is not None and timeout <= 0) else timeout
+            ready = connection.wait([receiver for receiver in self._connections if receiver is not None], wait)
+            if len(ready) == 0:
+                return received
+            received = True
+            for receiver in ready:
+                try:
+                    message = receiver.recv()
+                except (EOFError, OSError):
+                    # The worker has gone, and is replaced by _recover once it has exited
+                    self._connections[self._connections.index(receiver)] = None
+                    receiver.close()
+                    continue
+                self._handle(message)
+
+    def _handle(self, message):
+        if message[0] == "ready":
+            self.names = message[2]
+            self._ready.add(message[1])
+            return
+        if message[0] == "started":
+            if message[1] in self._in_flight:
+                self._running[message[1]] = message[2]
+            return
+
+        _, sequence, slot, boxes, confidences, class_ids, duration, error = message
+        if sequence not in self._in_flight:
+            # Already returned with an error after timing out
+            return
+        del self._in_flight[sequence]
+        self._running.pop(sequence, None)
+        self._free_slots.append(slot)
+        self._completed[sequence] = DetectionResult(sequence, self._tags.pop(sequence), boxes, confidences,
+                                                    class_ids, duration, error)
+
+    def _fail(self, sequence: int, error: str):
+        slot, _ = self._in_flight.pop(sequence)
+        self._running.pop(sequence, None)
+        self._free_slots.append(slot)
+        self._completed[sequence] = DetectionResult(sequence, self._tags.pop(sequence), np.empty((0, 4), np.float32),
+                                                    np.empty(0, np.float32), np.empty(0, np.int32), 0.0, error)
+
+    def _recover(self):
+        # Fail the images held by workers that have died, replacing the workers, and any image that has waited
+        # longer than the timeout, which also catches one taken by a worker that died before saying so
+        for i, worker in enumerate(self._workers):
+            if worker.is_alive():
+                continue
+            for sequence in [sequence for sequence, pid in self._running.items() if pid == worker.pid]:
+                self._fail(sequence, f"Detection worker exited with code {worker.exitcode}")
+            self._ready.discard(worker.pid)
+            if self._connections[i] is not None:
+                self._connections[i].close()
+            self._workers[i], self._connections[i] = self._spawn(i)
+
+        if self.task_timeout is not None:
+            now = time.monotonic()
+            for sequence in [sequence for sequence, (_, submitted) in self._in_flight.items()
+                             if now - submitted > self.task_timeout]:
+                self._fail(sequence, f"Detection timed out after {self.task_timeout}s")
+
+    def results(self, timeout: Optional[float] = 0) -> List[DetectionResult]:
+        """
+        Return the results that are ready, in the order their images were submitted.
+
+        A result that finishes early is held back until every earlier result has been returned.
+
+        :param timeout: Maximum time in seconds to wait for the next result, 0 to return immediately or None to
+            wait until it arrives or fails.
+        :return: The newly available results, which may be empty.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self._receive(0)
+            self._recover()
+            if self.pending == 0 or self._next_release in self._completed:
+                break
+            # Wait in short steps so a worker dying meanwhile is noticed
+            wait = 0.1 if deadline is None else min(0.1, deadline - time.monotonic())
+            if wait <= 0:
+                break
+            self._receive(wait)
+
+        ready = []
+        while self._next_release in self._completed:
+            ready.append(self._completed.pop(self._next_release))
+            self._next_release += 1
+        return ready
+
+
+class AdaptiveDetectionRate:
+    """
+    Decide how often to run object detection so that idle periods cost little CPU.
+
+    Detection runs at the active rate while the caller reports that it needs fresh detections (for example
+    while a search is running) or while the detected objects are moving, and drops to the idle rate
+    otherwise. The last detections should be reused between runs. An optional CPU budget caps the rate using
+    the measured time each detection takes.
+    """
+
+    def __init__(self, active_rate: float = 10.0, idle_rate: float = 1.0, cpu_budget: Optional[float] = None,
+                 motion_threshold: float = 0.02, motion_hold: float = 2.0, cpu_count: Optional[int] = None):
+        """
+        :param active_rate: Detections per second while active or while objects are moving.
+        :param idle_rate: Detections per second otherwise.
+        :param cpu_budget: The fraction of the machine's total CPU time detection may use, or None for no limit.
+        :param motion_threshold: The movement of a box centre, as a fraction of the image size, between two
+            detections that counts as motion.
+        :param motion_hold: Seconds to stay at the active rate after motion was last seen.
+        :param cpu_count: The number of cores the budget is shared across, defaulting to all of them.
+        """
+        self.active_rate = active_rate
+        self.idle_rate = idle_rate
+        self.cpu_budget = cpu_budget
+        self.motion_threshold = motion_threshold
+        self.motion_hold = motion_hold
+        self.cpu_count = cpu_count if cpu_count is not None else max(1, os.cpu_count() or 1)
+
+        self.mean_duration = 0.0
+        self._last_run = -math.inf
+        self._moving_until = -math.inf
+        self._previous: Optional[DetectionResult] = None
+        self._previous_size = None
+
+    @property
+    def moving(self) -> bool:
+        """Whether motion has been seen within the hold time."""
+        return time.monotonic() < self._moving_until
+
+    def current_rate(self, active: bool) -> float:
+        """
+        The detection rate that currently applies.
+
+        :param active: Whether the caller currently needs fresh detections.
+        :return: Detections per second.
+        """
+        rate = self.active_rate if active or self.moving else self.idle_rate
+        if self.cpu_budget is not None and self.mean_duration > 0:
+            rate = min(rate, self.cpu_budget * self.cpu_count / self.mean_duration)
+        return rate
+
+    def due(self, active: bool = False) -> bool:
+        """
+        Check whether detection should run now, recording the run if it should.
+
+        :param active: Whether the caller currently needs fresh detections.
+        :return: True if an image should be passed to the detector.
+        """
+        now = time.monotonic()
+        if now - self._last_run < 1.0 / self.current_rate(active):
+            return False
+        self._last_run = now
+        return True
+
+    def update(self, result: DetectionResult, width: float, height: float):
+        """
+        Record a finished detection, updating the cost estimate and checking the objects for motion.
+
+        :param result: The finished detection.
+        :param width: The width of the image the detection ran on.
+        :param height: The height of the image the detection ran on.
+        """
+        if result.error is not None:
+            return
+
+        if self.mean_duration == 0:
+            self.mean_duration = result.duration
+        else:
+            self.mean_duration += 0.1 * (result.duration - self.mean_duration)
+
+        size = np.array([width, height], np.float32)
+        previous = self._previous
+        if previous is not None and self._previous_size is not None and \
+                self._objects_moved(previous, result, self._previous_size, size):
+            self._moving_until = time.monotonic() + self.motion_hold
+        self._previous = result
+        self._previous_size = size
+
+    def _objects_moved(self, previous: DetectionResult, current: DetectionResult, previous_size: np.ndarray,
+                       size: np.ndarray) -> bool:
+        # Objects appearing or disappearing count as motion
+        if not np.array_equal(np.sort(previous.class_ids), np.sort(current.class_ids)):
+            return True
+        if len(current.class_ids) == 0:
+            return False
+
+        previous_centres = (previous.boxes[:, :2] + previous.boxes[:, 2:]) / (2 * previous_size)
+        centres = (current.boxes[:, :2] + current.boxes[:, 2:]) / (2 * size)
+
+        # Match each object to the nearest previous object of the same class
+        same_class = current.class_ids[:, None] == previous.class_ids[None, :]
+        distances = np.linalg.norm(centres[:, None, :] - previous_centres[None, :, :], axis=2)
+        distances = np.where(same_class, distances, np.inf)
+        return bool(np.any(distances.min(axis=1) > self.motion_threshold))
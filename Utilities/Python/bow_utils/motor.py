@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import NamedTuple, Optional, Tuple
+
+
+class MotorStats(NamedTuple):
+    """Counters reported by a MotorScheduler."""
+    sent: int
+    failed: int
+    missed_deadlines: int
+    target_rate: float
+    achieved_rate: float
+    suppressed: int = 0  # Ticks on which an unchanged command was not sent again
+    bytes_sent: int = 0  # Serialised size of the commands sent
+    bytes_saved: int = 0  # Serialised size of the commands suppressed
+
+
+class MotorScheduler:
+    """
+    Send motor commands to a robot at a fixed rate on a background thread.
+
+    The program publishes the command it wants with set() whenever it likes, and the scheduler sends
+    whichever command is most recent on every tick. Publishing compares the command with the last one and
+    only copies it when it has changed, so the control loop never waits on the scheduler or on the network
+    and can reuse one sample every frame. Ticks that start after their deadline are counted as missed and the
+    schedule skips ahead rather than trying to catch up with a burst of sends.
+
+    With a keepalive, a command identical to the last one sent is not sent again on every tick but only once
+    keepalive seconds have passed, as a heartbeat, which saves most of the traffic of an idle robot.
+    """
+
+    def __init__(self, robot, rate: float = 50.0, rate_window: int = 100, profiler=None, recorder=None,
+                 keepalive: Optional[float] = None):
+        """
+        :param robot: A connected bow_api robot with the motor channel open.
+        :param rate: The number of motor commands to send per second.
+        :param rate_window: The number of recent ticks used to measure the achieved rate.
+        :param profiler: A LoopProfiler to record the time spent in motor.set with, if any.
+        :param recorder: A started SessionRecorder to record every change of command with, if any.
+        :param keepalive: The longest in seconds between sends of an unchanged command, or None to send the
+            command on every tick.
+        """
+        self.robot = robot
+        self.profiler = profiler
+        self.recorder = recorder
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.keepalive = keepalive
+        self.last_error = None
+
+        # The command to send and its serialised size, replaced together in one assignment
+        self._desired: Optional[Tuple[object, int]] = None
+        self._desired_data = b""
+        self._suppressed = 0
+        self._bytes_sent = 0
+        self._bytes_saved = 0
+        self._sent = 0
+        self._failed = 0
+        self._missed = 0
+        self._tick_times = deque(maxlen=rate_window)
+        self._running = False
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def set(self, motor_sample, send_now: bool = False):
+        """
+        Publish the command to send on the next tick.
+
+        The sample is copied if it differs from the last one published, so the caller may go on modifying and
+        publishing the same sample every frame.
+
+        :param motor_sample: The bow_data.MotorSample to send, or None to stop sending.
+        :param send_now: If the command has changed, send it straight away and restart the schedule from then,
+            rather than waiting for the next tick. Meant for occasional changes such as key presses, since
+            changing the command faster than the rate with this set sends faster than the rate.
+        """
+        if motor_sample is None:
+            self._desired = None
+            self._desired_data = b""
+            return
+
+        data = motor_sample.SerializeToString()
+        if self._desired is not None and data == self._desired_data:
+            return
+        command = type(motor_sample).FromString(data)
+        self._desired_data = data
+        self._desired = (command, len(data))
+        if send_now:
+            self._wake.set()
+        if self.recorder is not None:
+            self.recorder.add_sample(self.robot.robot_details.name, "motor", command)
+
+    def start(self):
+        """Start the scheduler thread."""
+        if self._running:
+            return
+        self._running = True
+        self._wake.clear()
+        self._thread = threading.Thread(target=self._run, name="MotorScheduler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 1.0):
+        """
+        Stop the scheduler thread.
+
+        :param timeout: Maximum time in seconds to wait for the thread to exit.
+        """
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        set_timer = nullcontext()
+        if self.profiler is not None:
+            set_timer = self.profiler.stage("motor.set", self.robot.robot_details.name)
+
+        deadline = time.monotonic()
+        last_sent = None
+        last_send_time = 0.0
+        while self._running:
+            desired = self._desired
+            if desired is not None:
+                motor_sample, size = desired
+                now = time.monotonic()
+                if motor_sample is last_sent and self.keepalive is not None and now - last_send_time < self.keepalive:
+                    self._suppressed += 1
+                    self._bytes_saved += size
+                else:
+                    with set_timer:
+                        result = self.robot.motor.set(motor_sample)
+                    last_sent = motor_sample
+                    last_send_time = now
+                    self._bytes_sent += size
+                    if result.Success:
+                        self._sent += 1
+                    else:
+                        self._failed += 1
+                        self.last_error = result
+                        # Send it again on the next tick rather than waiting for the keepalive
+                        last_sent = None
+            self._tick_times.append(time.monotonic())
+
+            deadline += self.period
+            now = time.monotonic()
+            if now > deadline:
+                # Skip the ticks we have already overrun instead of sending them back to back
+                overrun = math.ceil((now - deadline) / self.period)
+                self._missed += overrun
+                deadline += overrun * self.period
+            if self._wake.wait(max(0.0, deadline - now)):
+                # A changed command was published with send_now, so send it and restart the schedule from here
+                self._wake.clear()
+                deadline = time.monotonic()
+
+    def stats(self) -> MotorStats:
+        """Return send counts, missed deadlines, the rate achieved over the recent ticks and the sends saved."""
+        tick_times = list(self._tick_times)
+        achieved_rate = 0.0
+        if len(tick_times) > 1 and tick_times[-1] > tick_times[0]:
+            achieved_rate = (len(tick_times) - 1) / (tick_times[-1] - tick_times[0])
+        return MotorStats(self._sent, self._failed, self._missed, self.rate, achieved_rate, self._suppressed,
+                          self._bytes_sent, self._bytes_saved)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+import atexit
+import math
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+
+class LatencyHistogram:
+    """
+    Record durations into logarithmically spaced buckets, in the style of an HDR histogram.
+
+    Every bucket is a fixed relative width, so percentiles are accurate to that precision across the whole
+    range from microseconds to minutes, while recording a value costs one logarithm and an increment.
+    """
+
+    def __init__(self, lowest: float = 1e-6, highest: float = 60.0, precision: float = 0.01):
+        """
+        :param lowest: The smallest duration in seconds that is distinguished from zero.
+        :param highest: The largest duration in seconds that is recorded exactly, longer ones are clamped.
+        :param precision: The relative width of each bucket.
+        """
+        self.lowest = lowest
+        self._log_base = math.log1p(precision)
+        self._counts = np.zeros(self._bucket(highest) + 1, np.int64)
+        self.reset()
+
+    def _bucket(self, value: float) -> int:
+        if value <= self.lowest:
+            return 0
+        return int(math.log(value / self.lowest) / self._log_base) + 1
+
+    def record(self, value: float):
+        """
+        :param value: A duration in seconds.
+        """
+        self._counts[min(self._bucket(value), len(self._counts) - 1)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, percentile: float) -> float:
+        """
+        :param percentile: The percentile to return, between 0 and 100.
+        :return: The duration in seconds below which the given percentage of recorded values fall.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = max(1, math.ceil(percentile / 100 * self.count))
+        bucket = int(np.searchsorted(np.cumsum(self._counts), rank))
+        if bucket == 0:
+            return self.min
+        # Report the middle of the bucket, clamped to what was actually seen
+        value = self.lowest * math.exp((bucket - 0.5) * self._log_base)
+        return min(max(value, self.min), self.max)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def reset(self):
+        """Forget every recorded value."""
+        self._counts[:] = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+
+class _StageTimer:
+    __slots__ = ("_histogram", "_lock", "_start")
+
+    def __init__(self, histogram: LatencyHistogram, lock: threading.Lock):
+        self._histogram = histogram
+        self._lock = lock
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self._start
+        with self._lock:
+            self._histogram.record(duration)
+        return False
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+class LoopProfiler:
+    """
+    Time each stage of a Sense-Decide-Act loop and report latency percentiles and rates per stage and robot.
+
+    Wrap each stage in a with block, for example `with profiler.stage("vision.get", robot_name):`, and call
+    tick() once per loop iteration. A report is printed every report_period seconds, and when the program exits
+    if report_on_exit is set. A disabled profiler hands out timers that do nothing, so it can be left in place.
+
+    Stages may be timed from several threads, such as a capture thread and a motor scheduler, so every histogram is
+    only changed or read while holding one lock.
+    """
+
+    def __init__(self, report_period: Optional[float] = None, report_on_exit: bool = True, enabled: bool = True,
+                 reset_on_report: bool = True, output: Callable[[str], None] = print):
+        """
+        :param report_period: Seconds between periodic reports, or None to only report on request or exit.
+        :param report_on_exit: Print a final report when the interpreter exits.
+        :param enabled: Whether to record anything at all.
+        :param reset_on_report: Start each periodic report's statistics afresh rather than accumulating them.
+        :param output: The function each report is passed to.
+        """
+        self.report_period = report_period
+        self.enabled = enabled
+        self.reset_on_report = reset_on_report
+        self.output = output
+
+        self._histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._timers: Dict[Tuple[str, str], _StageTimer] = {}
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._next_report = None if report_period is None else self._window_start + report_period
+
+        if enabled and report_on_exit:
+            atexit.register(self._report_on_exit)
+
+    def _histogram(self, key: Tuple[str, str]) -> LatencyHistogram:
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def stage(self, name: str, robot: str = ""):
+        """
+        Get a context manager that times one stage.
+
+        Timers are reused, so a stage must not be nested inside itself.
+
+        :param name: The name of the stage, e.g. "vision.get".
+        :param robot: The robot the stage ran for, if any.
+        """
+        if not self.enabled:
+            return _null_timer
+        key = (robot, name)
+        timer = self._timers.get(key)
+        if timer is None:
+            timer = _StageTimer(self._histogram(key), self._lock)
+            self._timers[key] = timer
+        return timer
+
+    def record(self, name: str, duration: float, robot: str = ""):
+        """
+        Record a duration measured elsewhere.
+
+        :param name: The name of the stage.
+        :param duration: The duration in seconds.
+        :param robot: The robot the stage ran for, if any.
+        """
+        if self.enabled:
+            histogram = self._histogram((robot, name))
+            with self._lock:
+                histogram.record(duration)
+
+    def tick(self):
+        """Mark the end of a loop iteration, printing a report if one is due."""
+        if self._next_report is not None and time.monotonic() >= self._next_report:
+            self.output(self.report())
+            if self.reset_on_report:
+                self.reset()
+            self._next_report = time.monotonic() + self.report_period
+
+    def summary(self) -> Dict[Tuple[str, str], Dict[str, float]]:
+        """Return the count, rate, mean and p50/p95/p99/max latency in seconds of every stage."""
+        elapsed = max(time.monotonic() - self._window_start, 1e-9)
+        with self._lock:
+            return {key: dict(count=h.count, rate=h.count / elapsed, mean=h.mean, p50=h.percentile(50),
+                              p95=h.percentile(95), p99=h.percentile(99), max=h.max)
+                    for key, h in self._histograms.items() if h.count > 0}
+
+    def report(self) -> str:
+        """Format the summary as a table with latencies in milliseconds."""
+        lines = [f"{'robot':<16} {'stage':<20} {'count':>8} {'rate/s':>8} {'mean':>8} {'p50':>8} {'p95':>8} "
+                 f"{'p99':>8} {'max':>8}"]
+        for (robot, name), stats in sorted(self.summary().items()):
+            lines.append(f"{robot:<16} {name:<20} {stats['count']:>8} {stats['rate']:>8.1f} "
+                         f"{stats['mean'] * 1000:>8.2f} {stats['p50'] * 1000:>8.2f} {stats['p95'] * 1000:>8.2f} "
+                         f"{stats['p99'] * 1000:>8.2f} {stats['max'] * 1000:>8.2f}")
+        return "\n".join(lines)
+
+    def reset(self):
+        """Clear every stage's statistics and restart the rate window."""
+        with self._lock:
+            for histogram in self._histograms.values():
+                histogram.reset()
+        self._window_start = time.monotonic()
+
+    def _report_on_exit(self):
+        if len(self.summary()) > 0:
+            self.output(self.report())
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Mapping, NamedTuple, Optional, Union
+
+import numpy as np
+
+import bow_data
+
+from .teleop import get_field, set_field
+
+
+class RampLimits(NamedTuple):
+    """How quickly one field of the motor command may change."""
+    acceleration: float  # The largest change of the value per second, e.g. m/s^2 for a linear velocity
+    jerk: Optional[float] = None  # The largest change of the acceleration per second, or None for no limit
+
+
+def _profile(linear: RampLimits, angular: RampLimits, gaze: RampLimits) -> Dict[str, RampLimits]:
+    profile = {}
+    for axis in "XYZ":
+        profile[f"Locomotion.TranslationalVelocity.{axis}"] = linear
+        profile[f"Locomotion.RotationalVelocity.{axis}"] = angular
+        profile[f"GazeTarget.GazeVector.{axis}"] = gaze
+    return profile
+
+
+# Limits for the locomotion velocities and gaze vector, by name. "smooth" takes about half a second to reach the
+# tutorials' forward speed and three quarters of a second to reach their turning speed, "responsive" only limits
+# the acceleration
+PROFILES: Dict[str, Dict[str, RampLimits]] = {
+    "gentle": _profile(linear=RampLimits(0.25, 1.0), angular=RampLimits(1.0, 4.0), gaze=RampLimits(0.5, 2.0)),
+    "smooth": _profile(linear=RampLimits(0.5, 2.0), angular=RampLimits(2.0, 8.0), gaze=RampLimits(1.0, 5.0)),
+    "responsive": _profile(linear=RampLimits(2.0), angular=RampLimits(8.0), gaze=RampLimits(4.0)),
+}
+
+
+class CommandRamp:
+    """
+    Move the motor commands of one or more robots smoothly towards their targets, at a fixed rate.
+
+    Targets jump, for instance when a key is pressed, but the commands sent follow them with a bounded acceleration and,
+    optionally, a bounded jerk, slowing down as they approach the target so they arrive without overshooting. Both
+    limits hold on every step, including the one landing on the target, so a target changed close to a command already
+    heading for it faster than it can stop is passed and then returned to. The values and their rates of change for
+    every robot and field are kept in two arrays, so each step updates the whole fleet at once. Only the fields in the
+    profile are ramped and sent, anything else in a target is ignored.
+
+    Each step builds a new MotorSample for every robot whose command moved and passes it to that robot's output,
+    typically the set method of its MotorScheduler, which sends it on its next tick. Once every command has reached
+    its target nothing more is published until a target changes.
+
+    Changing a target wakes the background thread, which steps straight away and publishes that step with
+    send_now=True, so a key press reaches the robot at once rather than after a step and a scheduler tick. A
+    scheduler restarts its schedule from a command sent with send_now, so the thread then steps half a period out of
+    phase with it, publishing each step midway between two of its ticks so every step is sent exactly once.
+    """
+
+    def __init__(self, outputs: Mapping[str, Callable[..., None]],
+                 profile: Union[str, Mapping[str, RampLimits]] = "smooth", rate: float = 50.0):
+        """
+        :param outputs: A function to publish each robot's command with, by robot name, called as
+            output(motor_sample, send_now=...) like MotorScheduler.set.
+        :param profile: The name of one of PROFILES, or the limits to use by dotted field path.
+        :param rate: The number of steps per second when started, usually the motor scheduler's rate.
+        """
+        if isinstance(profile, str):
+            profile = PROFILES[profile]
+        self.robots: List[str] = list(outputs)
+        self.fields: List[str] = list(profile)
+        self.rate = rate
+        self.period = 1.0 / rate
+        self._outputs = [outputs[robot] for robot in self.robots]
+        self._index = {robot: i for i, robot in enumerate(self.robots)}
+
+        self._acceleration = np.array([profile[field].acceleration for field in self.fields], dtype=np.float64)
+        self._jerk = np.array([math.inf if profile[field].jerk is None else profile[field].jerk
+                               for field in self.fields], dtype=np.float64)
+        shape = (len(self.robots), len(self.fields))
+        self.values = np.zeros(shape)
+        self.rates = np.zeros(shape)
+        self.targets = np.zeros(shape)
+
+        self._lock = threading.Lock()
+        self._settled = np.zeros(len(self.robots), dtype=bool)
+        # Robots whose target changed since the last step, whose next command is sent straight away
+        self._changed = np.zeros(len(self.robots), dtype=bool)
+        self._wake = threading.Event()
+        self.steps = 0
+        self.published = 0
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def settled(self) -> bool:
+        """Whether every command has reached its target."""
+        return bool(self._settled.all())
+
+    def set_target(self, motor_sample, robot: Optional[str] = None):
+        """
+        Set the command to ramp towards, from any thread.
+
+        :param motor_sample: A bow_data.MotorSample holding the target values. Fields that are not set count as zero.
+        :param robot: The robot to set it for, or None for every robot.
+        """
+        target = [float(get_field(motor_sample, field)) for field in self.fields]
+        rows = slice(None) if robot is None else self._index[robot]
+        with self._lock:
+            self.targets[rows] = target
+            self._settled[rows] = False
+            self._changed[rows] = True
+        self._wake.set()
+
+    def set_targets(self, targets: np.ndarray):
+        """
+        Set the targets of every robot at once, from any thread.
+
+        :param targets: An array of shape (robots, fields), or (fields,) to give every robot the same target, with
+            the robots and fields in the order of the robots and fields attributes.
+        """
+        with self._lock:
+            self.targets[:] = targets
+            self._settled[:] = False
+            self._changed[:] = True
+        self._wake.set()
+
+    def step(self, dt: Optional[float] = None) -> List[Optional[object]]:
+        """
+        Move every command one step towards its target and publish the ones that moved.
+
+        :param dt: The step length in seconds, by default the period.
+        :return: The new command of each robot, or None for robots whose command was already at its target.
+        """
+        dt = self.period if dt is None else dt
+        acceleration, jerk = self._acceleration, self._jerk
+        with self._lock:
+            values, rates, targets = self.values, self.rates, self.targets
+            moving = ~self._settled
+
+            error = targets - values
+            distance = np.abs(error)
+            # The fastest rate from which the value can still stop exactly at the target, losing jerk * dt of rate
+            # a step. Stopping from a rate r covers (r + (r - jerk * dt) + ... + the last rate above zero) * dt,
+            # one straight line in r between each multiple of jerk * dt, so find the line the distance falls on
+            # from the continuous estimate, which is never more than one line too far, and solve it
+            limited = np.isfinite(jerk)
+            slowing = np.where(limited, jerk, 0.0) * dt
+            estimate = np.sqrt(slowing * slowing / 4.0 + 2.0 * slowing / dt * distance) - slowing / 2.0
+            per_step = np.where(limited, slowing, 1.0)
+            steps = np.floor(estimate / per_step)
+            stopping = (distance / dt + per_step * steps * (steps + 1.0) / 2.0) / (steps + 1.0)
+            steps = np.where(stopping < steps * per_step, steps - 1.0, steps)
+            stopping = (distance / dt + per_step * steps * (steps + 1.0) / 2.0) / (steps + 1.0)
+            wanted = np.sign(error) * np.minimum(acceleration, np.where(limited, stopping, distance / dt))
+            change = np.clip(wanted - rates, -jerk * dt, jerk * dt)
+            new_rates = rates + change
+            new_values = values + new_rates * dt
+
+            # Land exactly on the target when this step reached or passed it, as long as the rate can change to the
+            # one landing there and then to zero within the jerk limit. The landing rate is kept, and brought to zero
+            # by the next step, so a target changing straight after never jumps the rate. A command moving towards a
+            # target too fast to stop in time, because the target changed close to it, passes it and comes back
+            remaining = targets - new_values
+            landing = error / dt
+            tolerance = jerk * dt * (1.0 + 1e-9) + 1e-12
+            arrived = (((np.sign(remaining) != np.sign(error)) | (np.abs(remaining) < 1e-9))
+                       & (np.abs(landing - rates) <= tolerance) & (np.abs(landing) <= tolerance))
+            new_values = np.where(arrived, targets, new_values)
+            new_rates = np.where(arrived, landing, new_rates)
+
+            values[moving] = new_values[moving]
+            rates[moving] = new_rates[moving]
+            self._settled |= (values == targets).all(axis=1) & (rates == 0.0).all(axis=1)
+            published = values[moving].tolist()
+            robots = np.flatnonzero(moving).tolist()
+            changed = self._changed.tolist()
+            self._changed[:] = False
+            self.steps += 1
+
+        commands: List[Optional[object]] = [None] * len(self.robots)
+        for i, row in zip(robots, published):
+            motor_sample = bow_data.MotorSample()
+            for field, value in zip(self.fields, row):
+                set_field(motor_sample, field, value)
+            commands[i] = motor_sample
+            self._outputs[i](motor_sample, send_now=changed[i])
+            self.published += 1
+        return commands
+
+    def start(self):
+        """Start stepping at the rate on a background thread."""
+        if self._running:
+            return
+        self._running = True
+        self._wake.clear()
+        self._thread = threading.Thread(target=self._run, name="CommandRamp")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout: float = 1.0):
+        """
+        Stop the background thread.
+
+        :param timeout: Maximum time in seconds to wait for the thread to exit.
+        """
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        deadline = time.monotonic()
+        last = deadline
+        while self._running:
+            now = time.monotonic()
+            # Step by the time that actually passed, so a late tick does not slow the ramp down
+            self.step(min(max(now - last, 1e-6), 4 * self.period))
+            last = now
+
+            deadline += self.period
+            now = time.monotonic()
+            if now > deadline:
+                deadline += math.ceil((now - deadline) / self.period) * self.period
+            if self._wake.wait(max(0.0, deadline - now)):
+                # A target changed, so step and publish it now, then step midway between the scheduler's ticks
+                self._wake.clear()
+                deadline = time.monotonic() - self.period / 2
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+import json
+import pickle
+import queue
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import bow_data
+import numpy as np
+
+# A session file is a header followed by 64 byte aligned chunks, each with a fixed size header, and ends with an
+# index chunk and a trailer pointing at it. A file whose recorder never closed has no trailer, and can still be
+# read by walking the chunks.
+SESSION_MAGIC = b"BOWSESS\x00"
+SESSION_VERSION = 1
+_FILE_HEADER = struct.Struct("<8sI52x")
+_CHUNK_MAGIC = b"BOWC"
+_CHUNK = struct.Struct("<4sBBHIIdQQIIi12x")
+_TRAILER = struct.Struct("<Q8s")
+_TRAILER_MAGIC = b"BOWINDEX"
+_ALIGNMENT = 64
+
+# Chunk kinds
+_STREAM = 1  # Declares a stream, the payload is its robot, channel and source as JSON
+_FRAME = 2  # One image's data
+_BLOCK = 3  # A columnar block of small samples from one stream
+_INDEX = 4  # The index of every frame and block, written when the recorder closes
+
+# Payload codecs
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+
+
+class _ChunkHeader(NamedTuple):
+    kind: int
+    codec: int
+    stream: int
+    count: int
+    timestamp: float
+    raw_length: int
+    stored_length: int
+    width: int
+    height: int
+    image_type: int
+
+
+class RecorderStats(NamedTuple):
+    """Counters reported by a SessionRecorder."""
+    frames: int  # Images written
+    samples: int  # Small samples written
+    dropped: int  # Items dropped because the writer had fallen too far behind
+    raw_bytes: int  # Payload bytes before compression
+    written_bytes: int  # Bytes written to the file
+    pending_bytes: int  # Bytes waiting for the writer thread
+
+
+def _padding(length: int) -> int:
+    return -length % _ALIGNMENT
+
+
+def pack_arrays(meta: dict, arrays: Dict[str, np.ndarray]) -> bytes:
+    """
+    Serialise named arrays and some JSON metadata into one buffer, with every array 8 byte aligned.
+
+    :param meta: JSON serialisable metadata, stored under "meta".
+    :param arrays: The arrays to store.
+    """
+    layout = []
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        layout.append([name, np.lib.format.dtype_to_descr(array.dtype), list(array.shape), offset])
+        offset += array.nbytes + (-array.nbytes % 8)
+    header = json.dumps({"meta": meta, "arrays": layout}).encode()
+    header += b" " * (-(len(header) + 4) % 8)
+
+    parts = [struct.pack("<I", len(header)), header]
+    for array in arrays.values():
+        array = np.ascontiguousarray(array)
+        parts.append(array.tobytes())
+        parts.append(b"\x00" * (-array.nbytes % 8))
+    return b"".join(parts)
+
+
+def unpack_arrays(buffer) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """
+    Read a buffer written by pack_arrays. The arrays are views onto the buffer, not copies.
+
+    :return: The metadata and the arrays by name.
+    """
+    header_length = struct.unpack_from("<I", buffer, 0)[0]
+    header = json.loads(bytes(buffer[4:4 + header_length]))
+    start = 4 + header_length
+    arrays = {}
+    for name, descr, shape, offset in header["arrays"]:
+        dtype = np.lib.format.descr_to_dtype(descr if isinstance(descr, str) else [tuple(field) for field in descr])
+        count = int(np.prod(shape, dtype=np.int64))
+        arrays[name] = np.frombuffer(buffer, dtype, count, start + offset).reshape(shape)
+    return header["meta"], arrays
+
+
+def serialise_message(sample) -> Tuple[str, bytes]:
+    """Serialise a bow_data message, or failing that pickle the object, returning the format used and the data."""
+    if hasattr(sample, "SerializeToString"):
+        return type(sample).__name__, sample.SerializeToString()
+    return "pickle", pickle.dumps(sample, pickle.HIGHEST_PROTOCOL)
+
+
+def parse_message(message: str, data: bytes):
+    """Rebuild a sample written by serialise_message."""
+    if message == "pickle":
+        return pickle.loads(data)
+    sample = getattr(bow_data, message)()
+    sample.ParseFromString(data)
+    return sample
+
+
+class _PendingBlock:
+    def __init__(self, message: str, joint_names: Optional[Tuple[str, ...]]):
+        self.message = message
+        self.joint_names = joint_names
+        self.timestamps: List[float] = []
+        self.data: List[bytes] = []
+        self.joint_positions: List[List[float]] = []
+        self.started = time.monotonic()
+
+
+def _joint_names(sample) -> Optional[Tuple[str, ...]]:
+    joints = getattr(sample, "RawJoints", None)
+    if joints is None or len(joints) == 0:
+        return None
+    return tuple(joint.Name for joint in joints)
+
+
+class SessionRecorder:
+    """
+    Record robot data to a compact, indexed session file without holding up the loop that produces it.
+
+    Adding data only puts a reference on a queue. A background thread writes each image's raw data in its own
+    aligned chunk, either as-is so it can later be read without copying or losslessly compressed, and gathers
+    small samples such as proprioception and motor commands into columnar blocks of timestamps and serialised
+    messages, with the joint positions of each sample also stored as a float array. If the writer falls more than
+    max_pending_bytes behind, new data is dropped and counted rather than letting the producer wait.
+    """
+
+    def __init__(self, path: str, compress_frames: bool = False, compression_level: int = 1,
+                 block_size: int = 256, block_interval: float = 1.0, max_pending_bytes: int = 256 * 1024 * 1024):
+        """
+        :param path: The file to write.
+        :param compress_frames: Compress image data with zlib. Uncompressed frames can be read without a copy.
+        :param compression_level: The zlib level, from 1 (fastest) to 9 (smallest).
+        :param block_size: The most samples gathered into one block.
+        :param block_interval: The longest time in seconds a sample waits in an unwritten block.
+        :param max_pending_bytes: How far the writer may fall behind before data is dropped.
+        """
+        self.path = path
+        self.compress_frames = compress_frames
+        self.compression_level = compression_level
+        self.block_size = block_size
+        self.block_interval = block_interval
+        self.max_pending_bytes = max_pending_bytes
+        self.last_error: Optional[Exception] = None
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._pending_bytes = 0
+        self._pending_lock = threading.Lock()
+        self._start = time.monotonic()
+        self._frames = 0
+        self._samples = 0
+        self._dropped = 0
+        self._raw_bytes = 0
+        self._written_bytes = 0
+        self._thread: Optional[threading.Thread] = None
+
+        # Only touched by the writer thread
+        self._file = None
+        self._streams: Dict[Tuple[str, str, str], int] = {}
+        self._blocks: Dict[int, _PendingBlock] = {}
+        self._frame_index: List[tuple] = []
+        self._block_index: List[tuple] = []
+
+    def start(self):
+        """Open the file and start the writer thread."""
+        if self._thread is not None:
+            return
+        self._file = open(self.path, "wb")
+        self._write(_FILE_HEADER.pack(SESSION_MAGIC, SESSION_VERSION))
+        self._start = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="SessionRecorder")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Write everything still queued, then the index, and close the file.
+
+        :param timeout: Maximum time in seconds to wait for the writer to finish.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def elapsed(self) -> float:
+        """Seconds since recording started, the time base used for samples added without a timestamp."""
+        return time.monotonic() - self._start
+
+    def _enqueue(self, item: tuple, size: int) -> bool:
+        with self._pending_lock:
+            if self._thread is None or self._pending_bytes + size > self.max_pending_bytes:
+                self._dropped += 1
+                return False
+            self._pending_bytes += size
+        self._queue.put_nowait(item + (size,))
+        return True
+
+    def add_images(self, robot: str, samples, timestamp: Optional[float] = None):
+        """
+        Record the images from one vision.get.
+
+        :param robot: The name of the robot the images came from.
+        :param samples: The ImageSamples returned by vision.get, or an iterable of ImageSample.
+        :param timestamp: Seconds since recording started, or None for now.
+        """
+        timestamp = self.elapsed() if timestamp is None else timestamp
+        for sample in getattr(samples, "Samples", samples):
+            if not sample.NewDataFlag or len(sample.Data) == 0:
+                continue
+            self._enqueue((_FRAME, robot, sample.Source, timestamp, sample), len(sample.Data))
+
+    def add_sample(self, robot: str, channel: str, sample, timestamp: Optional[float] = None):
+        """
+        Record a sample from, or command sent to, any channel other than vision.
+
+        :param robot: The name of the robot.
+        :param channel: The channel, e.g. "proprioception" or "motor".
+        :param sample: The bow_data message.
+        :param timestamp: Seconds since recording started, or None for now.
+        """
+        timestamp = self.elapsed() if timestamp is None else timestamp
+        self._enqueue((_BLOCK, robot, channel, timestamp, sample), 1024)
+
+    def append(self, robot: str, channel: str, timestamp: float, sample):
+        """Record whatever a channel's get returned, in the same form as Recording.append."""
+        if channel == "vision":
+            self.add_images(robot, sample, timestamp)
+        else:
+            self.add_sample(robot, channel, sample, timestamp)
+
+    def stats(self) -> RecorderStats:
+        with self._pending_lock:
+            return RecorderStats(self._frames, self._samples, self._dropped, self._raw_bytes,
+                                 self._written_bytes, self._pending_bytes)
+
+    # Writer thread
+
+    def _write(self, data) -> int:
+        offset = self._file.tell()
+        self._file.write(data)
+        return offset
+
+    def _write_chunk(self, kind: int, payload: bytes, codec: int = CODEC_NONE, raw_length: Optional[int] = None,
+                     stream: int = 0, count: int = 0, timestamp: float = 0.0, width: int = 0, height: int = 0,
+                     image_type: int = 0) -> int:
+        raw_length = len(payload) if raw_length is None else raw_length
+        offset = self._write(_CHUNK.pack(_CHUNK_MAGIC, kind, codec, 0, stream, count, timestamp, raw_length,
+                                         len(payload), width, height, image_type))
+        self._file.write(payload)
+        self._file.write(b"\x00" * _padding(len(payload)))
+        self._written_bytes += _CHUNK.size + len(payload) + _padding(len(payload))
+        return offset
+
+    def _stream(self, robot: str, channel: str, source: str) -> int:
+        key = (robot, channel, source)
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = len(self._streams)
+            self._streams[key] = stream
+            self._write_chunk(_STREAM, json.dumps({"robot": robot, "channel": channel, "source": source}).encode(),
+                              stream=stream)
+        return stream
+
+    def _write_frame(self, robot: str, timestamp: float, sample):
+        stream = self._stream(robot, "vision", sample.Source)
+        data = sample.Data
+        codec = CODEC_NONE
+        if self.compress_frames:
+            # zlib releases the GIL, so compression runs alongside the control loop
+            data = zlib.compress(data, self.compression_level)
+            codec = CODEC_ZLIB
+        offset = self._write_chunk(_FRAME, data, codec, len(sample.Data), stream, 1, timestamp,
+                                   int(sample.DataShape[0]), int(sample.DataShape[1]), int(sample.ImageType))
+        self._frame_index.append((timestamp, stream, offset, len(sample.Data), len(data), codec,
+                                  int(sample.DataShape[0]), int(sample.DataShape[1]), int(sample.ImageType)))
+        self._frames += 1
+        self._raw_bytes += len(sample.Data)
+
+    def _flush_block(self, stream: int):
+        block = self._blocks.pop(stream, None)
+        if block is None or len(block.timestamps) == 0:
+            return
+        offsets = np.zeros(len(block.data) + 1, np.uint64)
+        np.cumsum([len(data) for data in block.data], out=offsets[1:])
+        arrays = {"timestamps": np.array(block.timestamps, np.float64), "offsets": offsets,
+                  "data": np.frombuffer(b"".join(block.data), np.uint8)}
+        meta = {"message": block.message}
+        if block.joint_names is not None:
+            meta["joint_names"] = list(block.joint_names)
+            arrays["joint_positions"] = np.array(block.joint_positions, np.float32)
+        payload = pack_arrays(meta, arrays)
+        compressed = zlib.compress(payload, self.compression_level)
+        offset = self._write_chunk(_BLOCK, compressed, CODEC_ZLIB, len(payload), stream, len(block.timestamps),
+                                   block.timestamps[0])
+        self._block_index.append((stream, block.timestamps[0], block.timestamps[-1], offset, len(block.timestamps)))
+        self._samples += len(block.timestamps)
+        self._raw_bytes += len(payload)
+
+    def _add_to_block(self, robot: str, channel: str, timestamp: float, sample):
+        stream = self._stream(robot, channel, "")
+        message, data = serialise_message(sample)
+        joint_names = _joint_names(sample)
+
+        # Start a new block whenever the layout of the columns would change
+        block = self._blocks.get(stream)
+        if block is not None and (block.message != message or block.joint_names != joint_names):
+            self._flush_block(stream)
+            block = None
+        if block is None:
+            block = _PendingBlock(message, joint_names)
+            self._blocks[stream] = block
+
+        block.timestamps.append(timestamp)
+        block.data.append(data)
+        if joint_names is not None:
+            block.joint_positions.append([joint.Position for joint in sample.RawJoints])
+        if len(block.timestamps) >= self.block_size:
+            self._flush_block(stream)
+
+    def _flush_stale_blocks(self):
+        now = time.monotonic()
+        for stream, block in list(self._blocks.items()):
+            if now - block.started >= self.block_interval:
+                self._flush_block(stream)
+
+    def _write_index(self):
+        frames = np.array(self._frame_index, dtype=[
+            ("timestamp", "<f8"), ("stream", "<u4"), ("offset", "<u8"), ("raw_length", "<u8"),
+            ("stored_length", "<u8"), ("codec", "u1"), ("width", "<u4"), ("height", "<u4"), ("image_type", "<i4")])
+        blocks = np.array(self._block_index, dtype=[
+            ("stream", "<u4"), ("first", "<f8"), ("last", "<f8"), ("offset", "<u8"), ("count", "<u4")])
+        streams = [{"robot": robot, "channel": channel, "source": source}
+                   for (robot, channel, source), _ in sorted(self._streams.items(), key=lambda item: item[1])]
+        payload = pack_arrays({"streams": streams}, {"frames": frames, "blocks": blocks})
+        offset = self._write_chunk(_INDEX, zlib.compress(payload, self.compression_level), CODEC_ZLIB, len(payload))
+        self._write(_TRAILER.pack(offset, _TRAILER_MAGIC))
+
+    def _run(self):
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=self.block_interval)
+                except queue.Empty:
+                    self._flush_stale_blocks()
+                    continue
+                if item is None:
+                    break
+
+                kind, robot, name, timestamp, sample, size = item
+                try:
+                    if kind == _FRAME:
+                        self._write_frame(robot, timestamp, sample)
+                    else:
+                        self._add_to_block(robot, name, timestamp, sample)
+                finally:
+                    with self._pending_lock:
+                        self._pending_bytes -= size
+                self._flush_stale_blocks()
+
+            for stream in list(self._blocks.keys()):
+                self._flush_block(stream)
+            self._write_index()
+        except Exception as e:
+            self.last_error = e
+            with self._pending_lock:
+                self._thread = None
+        finally:
+            self._file.close()
+
+
+def _read_chunk_header(buffer, offset: int) -> _ChunkHeader:
+    fields = _CHUNK.unpack_from(buffer, offset)
+    if fields[0] != _CHUNK_MAGIC:
+        raise ValueError(f"No chunk at offset {offset}")
+    kind, codec, _, stream, count, timestamp, raw_length, stored_length, width, height, image_type = fields[1:]
+    return _ChunkHeader(kind, codec, stream, count, timestamp, raw_length, stored_length, width, height, image_type)
+
+
+def iter_session(path: str) -> Iterator[Tuple[str, str, float, object]]:
+    """
+    Read every sample in a session file in time order.
+
+    Images are returned one ImageSample at a time on the vision channel. A file whose recorder did not close
+    cleanly is read up to the last complete chunk.
+
+    :param path: The session file.
+    :return: (robot, channel, timestamp, sample) for each sample.
+    """
+    from .session import SessionReader
+
+    with SessionReader(path) as reader:
+        yield from reader.iter_all()
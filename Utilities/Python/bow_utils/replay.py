@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+"""
+Drive the tutorials from recorded data instead of a live robot.
+
+Run a tutorial against a recording with, from the repository root:
+
+    PYTHONPATH=Utilities/Python python -m bow_utils.replay session.bowrec GettingStarted/StreamingData/Python/main.py
+
+Options such as --speed go before the recording, anything after the script is passed to it. A recording of the
+robot selected in BOW Hub can be made with `--record SECONDS`.
+
+The tutorial's `import bow_api` picks up the stand-in in Utilities/Python/replay_api, which serves the recorded
+streams and records every command sent to the robot. When the recording runs out, or the tutorial reads a channel
+the recording has no data for, the main thread is interrupted as if Ctrl-C had been pressed, so the tutorial shuts
+down through its normal exit path.
+
+Only bow_api is replaced. bow_data holds the message classes, which the recorded samples are instances of and the
+tutorials build their commands from, and does not talk to a robot, so the installed package is used as it is.
+"""
+
+import argparse
+import copy
+import os
+import pickle
+import runpy
+import sys
+import threading
+import time
+import _thread
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from .recorder import SESSION_MAGIC, RecorderStats, SessionRecorder, iter_session
+
+# Channels the tutorials read from, and the ones they send commands on
+SENSE_CHANNELS = ("vision", "audition", "proprioception", "exteroception", "interoception", "tactile")
+ACT_CHANNELS = ("motor", "voice", "speech")
+
+_RECORDING_VERSION = 1
+
+
+class ReplayResult(NamedTuple):
+    """Stands in for the result objects returned by bow_api."""
+    Success: bool
+    Description: str = ""
+
+
+class _RobotState(NamedTuple):
+    available: bool
+
+
+class ReplayRobotDetails(NamedTuple):
+    """Stands in for the robot details returned by bow_api.get_robots."""
+    name: str
+    robot_id: str
+    robot_state: _RobotState
+
+
+class _GetRobotsResult(NamedTuple):
+    robots: List[ReplayRobotDetails]
+    localSearchError: ReplayResult
+    remoteSearchError: ReplayResult
+    bowhubSearchError: ReplayResult
+
+
+class ReplayImageSamples(NamedTuple):
+    """The images from one vision.get, for recordings that do not hold the original message."""
+    Samples: List
+
+
+class ChannelStats(NamedTuple):
+    """Counters for one channel of a replayed robot."""
+    served: int  # Samples returned by get
+    skipped: int  # Samples that became stale before get was called, in real time replay
+    sets: int  # Calls to set
+
+
+class Recording:
+    """
+    Timestamped samples from one or more robots, keyed by robot name and channel.
+
+    Each channel holds (timestamp, sample) pairs in time order, where the sample is exactly what the channel's get
+    returned, e.g. an ImageSamples message for vision. Timestamps are in seconds from the start of the recording.
+    Recordings are loaded from either a file written by save() or a session file written by a SessionRecorder.
+    """
+
+    def __init__(self):
+        self.streams: Dict[str, Dict[str, List[Tuple[float, object]]]] = {}
+
+    def append(self, robot: str, channel: str, timestamp: float, sample):
+        """
+        :param robot: The name of the robot the sample came from.
+        :param channel: The channel the sample was read from, e.g. "vision".
+        :param timestamp: Seconds since the start of the recording.
+        :param sample: The message returned by the channel's get.
+        """
+        self.streams.setdefault(robot, {}).setdefault(channel, []).append((timestamp, sample))
+
+    @property
+    def robots(self) -> List[str]:
+        return list(self.streams.keys())
+
+    @property
+    def duration(self) -> float:
+        """Seconds between the start of the recording and its last sample."""
+        return max((stream[-1][0] for channels in self.streams.values() for stream in channels.values()
+                    if len(stream) > 0), default=0.0)
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump({"version": _RECORDING_VERSION, "streams": self.streams}, f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: str) -> "Recording":
+        with open(path, "rb") as f:
+            if f.read(len(SESSION_MAGIC)) == SESSION_MAGIC:
+                return cls.from_session(path)
+            f.seek(0)
+            data = pickle.load(f)
+        if data.get("version") != _RECORDING_VERSION:
+            raise ValueError(f"{path} is not a version {_RECORDING_VERSION} recording")
+        recording = cls()
+        recording.streams = data["streams"]
+        for channels in recording.streams.values():
+            for stream in channels.values():
+                stream.sort(key=lambda record: record[0])
+        return recording
+
+    @classmethod
+    def from_session(cls, path: str) -> "Recording":
+        """Load a session file, regrouping the images that arrived together into one vision sample."""
+        recording = cls()
+        grouped: Dict[Tuple[str, float], ReplayImageSamples] = {}
+        for robot, channel, timestamp, sample in iter_session(path):
+            if channel != "vision":
+                recording.append(robot, channel, timestamp, sample)
+                continue
+            images = grouped.get((robot, timestamp))
+            if images is None:
+                images = ReplayImageSamples([])
+                grouped[(robot, timestamp)] = images
+                recording.append(robot, channel, timestamp, images)
+            images.Samples.append(sample)
+        return recording
+
+
+def record_streams(robots: Sequence, channels: Sequence[str], duration: float, recording=None):
+    """
+    Record what a set of live robots send on some channels.
+
+    One thread per robot and channel calls get(True) in a loop, so every stream is captured at the rate the robot
+    produces it.
+
+    :param robots: Connected bow_api robots with the channels open.
+    :param channels: The channels to record, e.g. ["vision", "proprioception"].
+    :param duration: Seconds to record for.
+    :param recording: A Recording or started SessionRecorder to add to, or None to create a new Recording.
+    :return: The recording the samples were added to.
+    """
+    recording = Recording() if recording is None else recording
+    lock = threading.Lock()
+    start = time.monotonic()
+    end = start + duration
+
+    def run(robot, channel):
+        name = robot.robot_details.name
+        while time.monotonic() < end:
+            sample, err = getattr(robot, channel).get(True)
+            if not err.Success or sample is None:
+                continue
+            with lock:
+                recording.append(name, channel, time.monotonic() - start, sample)
+
+    threads = [threading.Thread(target=run, args=(robot, channel), daemon=True)
+               for robot in robots for channel in channels]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recording
+
+
+class _ReplayChannel:
+    def __init__(self, robot: "ReplayRobot", name: str, stream: List[Tuple[float, object]]):
+        self.robot = robot
+        self.name = name
+        self.stream = stream
+        self.calls: List[Tuple[float, object]] = []
+        self.served = 0
+        self.skipped = 0
+        self._cursor = 0  # Counts on across laps when looping
+        self._lock = threading.Lock()
+
+        # A looped stream repeats one mean sample period after its last sample
+        self._lap = 0.0
+        if len(stream) > 1:
+            self._lap = stream[-1][0] * len(stream) / (len(stream) - 1)
+        self._lap = max(self._lap, 1e-3)
+
+    def _time_of(self, cursor: int) -> float:
+        lap, index = divmod(cursor, len(self.stream))
+        return lap * self._lap + self.stream[index][0]
+
+    def _has(self, cursor: int) -> bool:
+        return self.robot.backend.loop or cursor < len(self.stream)
+
+    def get(self, blocking: bool = True):
+        """Return the next recorded sample, in the same form as the live channel's get."""
+        backend = self.robot.backend
+        # Start the clock on the first read at any speed, so the rates reported at the end are right
+        backend.elapsed()
+        if len(self.stream) == 0:
+            # Nothing will ever arrive, so end the replay rather than leave the caller asking forever
+            description = f"No {self.name} data for {self.robot.robot_details.name} in the recording"
+            backend.finish(description)
+            return None, ReplayResult(False, description)
+
+        with self._lock:
+            if not self._has(self._cursor):
+                backend.finish("End of recording")
+                return None, ReplayResult(False, "End of recording")
+
+            newest = self._cursor
+            if backend.speed is not None:
+                # Real time, the newest sample whose time has come, as a live robot would give
+                wait = (self._time_of(newest) - backend.position()) / backend.speed
+                if wait > 0:
+                    if not blocking:
+                        return None, ReplayResult(False, "No new data")
+                    time.sleep(wait)
+                position = backend.position()
+                while self._has(newest + 1) and self._time_of(newest + 1) <= position:
+                    newest += 1
+                self.skipped += newest - self._cursor
+
+            self._cursor = newest + 1
+            self.served += 1
+            return self.stream[newest % len(self.stream)][1], ReplayResult(True)
+
+    def set(self, sample) -> ReplayResult:
+        """Record a command instead of sending it to a robot."""
+        self.calls.append((self.robot.backend.elapsed(), copy.deepcopy(sample)))
+        return ReplayResult(True)
+
+    def stats(self) -> ChannelStats:
+        return ChannelStats(self.served, self.skipped, len(self.calls))
+
+
+class ReplayRobot:
+    """
+    Stands in for a bow_api.Robot, serving one robot's recorded streams and recording the commands sent to it.
+    """
+
+    def __init__(self, backend: "ReplayBackend", details: ReplayRobotDetails):
+        self.backend = backend
+        self.robot_details = details
+        streams = backend.recording.streams.get(details.name, {})
+        for channel in SENSE_CHANNELS + ACT_CHANNELS:
+            setattr(self, channel, _ReplayChannel(self, channel, streams.get(channel, [])))
+
+    def connect(self) -> ReplayResult:
+        return ReplayResult(True)
+
+    def open_channel(self, channel: str) -> ReplayResult:
+        if channel not in SENSE_CHANNELS + ACT_CHANNELS:
+            return ReplayResult(False, f"Unknown channel {channel}")
+        return ReplayResult(True)
+
+    def disconnect(self) -> ReplayResult:
+        return ReplayResult(True)
+
+    def stats(self) -> Dict[str, ChannelStats]:
+        """Return the samples served and commands recorded on every channel that was used."""
+        stats = {channel: getattr(self, channel).stats() for channel in SENSE_CHANNELS + ACT_CHANNELS}
+        return {channel: s for channel, s in stats.items() if s.served > 0 or s.sets > 0}
+
+
+class ReplayBackend:
+    """
+    The functions of bow_api used by the tutorials, backed by a Recording.
+
+    With speed set, recorded time advances at that multiple of real time from the first call that reads data and
+    get returns the newest sample that is due, skipping any the caller was too slow for. With speed None every
+    sample is returned in order as fast as the caller asks for them, which makes a run deterministic.
+    """
+
+    def __init__(self, recording: Recording, speed: Optional[float] = 1.0, loop: bool = False,
+                 interrupt_at_end: bool = True):
+        """
+        :param recording: The data to serve.
+        :param speed: Playback speed as a multiple of real time, or None to serve samples as fast as they are read.
+        :param loop: Start again from the beginning when the recording runs out.
+        :param interrupt_at_end: Raise KeyboardInterrupt in the main thread when the recording runs out.
+        """
+        self.recording = recording
+        self.speed = speed
+        self.loop = loop
+        self.interrupt_at_end = interrupt_at_end
+        self.finished = False
+        self.reason: Optional[str] = None
+        self.robots: Dict[str, ReplayRobot] = {}
+        self._start: Optional[float] = None
+        self._start_lock = threading.Lock()
+
+        names = recording.robots or ["replay"]
+        self._details = [ReplayRobotDetails(name, name, _RobotState(True)) for name in names]
+
+    @classmethod
+    def from_environment(cls) -> "ReplayBackend":
+        """Create a backend from the BOW_REPLAY, BOW_REPLAY_SPEED and BOW_REPLAY_LOOP environment variables."""
+        path = os.environ.get("BOW_REPLAY")
+        if not path:
+            raise RuntimeError("Set BOW_REPLAY to the path of a recording to replay")
+        speed = float(os.environ.get("BOW_REPLAY_SPEED", "1"))
+        return cls(Recording.load(path), speed=speed if speed > 0 else None,
+                   loop=os.environ.get("BOW_REPLAY_LOOP", "0") == "1")
+
+    def elapsed(self) -> float:
+        """Seconds of real time since replay started."""
+        with self._start_lock:
+            if self._start is None:
+                self._start = time.monotonic()
+        return time.monotonic() - self._start
+
+    def position(self) -> float:
+        """Seconds of recorded time played so far in real time replay."""
+        return self.elapsed() * self.speed
+
+    def finish(self, reason: str = "End of recording"):
+        """
+        Mark the replay as over and, once, interrupt the main thread so the program exits.
+
+        :param reason: Why the replay is over, kept in the reason attribute.
+        """
+        if self.finished:
+            return
+        self.finished = True
+        self.reason = reason
+        if self.interrupt_at_end:
+            _thread.interrupt_main()
+
+    def robot(self, details: ReplayRobotDetails) -> ReplayRobot:
+        robot = self.robots.get(details.name)
+        if robot is None:
+            robot = ReplayRobot(self, details)
+            self.robots[details.name] = robot
+        return robot
+
+    def stats(self) -> Dict[str, Dict[str, ChannelStats]]:
+        """Return the channel stats of every robot that has been connected to."""
+        return {name: robot.stats() for name, robot in self.robots.items()}
+
+    # The bow_api functions used by the tutorials
+
+    def version(self) -> str:
+        return "replay"
+
+    def setup(self, *args, **kwargs) -> ReplayResult:
+        return ReplayResult(True)
+
+    def login_user(self, *args, **kwargs) -> ReplayResult:
+        return ReplayResult(True)
+
+    def get_robots(self, *args, **kwargs) -> _GetRobotsResult:
+        return _GetRobotsResult(list(self._details), ReplayResult(True), ReplayResult(True), ReplayResult(True))
+
+    def Robot(self, details: ReplayRobotDetails) -> ReplayRobot:
+        return self.robot(details)
+
+    def quick_connect(self, *args, channels: Sequence[str] = (), **kwargs):
+        robot = self.robot(self._details[0])
+        for channel in channels:
+            result = robot.open_channel(channel)
+            if not result.Success:
+                return None, result
+        return robot, ReplayResult(True)
+
+    def close_client_interface(self) -> ReplayResult:
+        return ReplayResult(True)
+
+    def stop_engine(self) -> ReplayResult:
+        return ReplayResult(True)
+
+
+# The backend the replay_api stand-in modules hand out, created on first use
+_backend: Optional[ReplayBackend] = None
+
+
+def get_backend() -> ReplayBackend:
+    """Return the backend shared by every import of the bow_api stand-in, creating it from the environment."""
+    global _backend
+    if _backend is None:
+        _backend = ReplayBackend.from_environment()
+    return _backend
+
+
+def install(backend: ReplayBackend):
+    """
+    Make the bow_api stand-in the one every later `import bow_api` gets, including in spawned worker processes.
+
+    :param backend: The backend for this process to use.
+    """
+    global _backend
+    _backend = backend
+    api_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "replay_api")
+    if api_path not in sys.path:
+        sys.path.insert(0, api_path)
+    os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [api_path, os.environ.get("PYTHONPATH")]))
+    sys.modules.pop("bow_api", None)
+
+
+def _record(args):
+    import bow_api
+
+    channels = args.channels.split(",")
+    robot, error = bow_api.quick_connect(app_name="BOW Session Recorder", channels=channels, verbose=False)
+    if not error.Success:
+        print("Failed to connect to robot", error)
+        sys.exit(-1)
+
+    print(f"Recording {', '.join(channels)} from {robot.robot_details.name} for {args.record}s")
+    with SessionRecorder(args.recording, compress_frames=args.compress) as recorder:
+        record_streams([robot], channels, args.record, recorder)
+    stats: RecorderStats = recorder.stats()
+    print(f"{stats.frames} images and {stats.samples} other samples, {stats.dropped} dropped, "
+          f"{stats.written_bytes / 1e6:.1f}MB written")
+
+    robot.disconnect()
+    bow_api.close_client_interface()
+
+
+def _replay(args):
+    # Workers started by the script create their own backend from these
+    os.environ["BOW_REPLAY"] = os.path.abspath(args.recording)
+    os.environ["BOW_REPLAY_SPEED"] = str(args.speed)
+    os.environ["BOW_REPLAY_LOOP"] = "1" if args.loop else "0"
+    backend = ReplayBackend(Recording.load(args.recording), speed=args.speed if args.speed > 0 else None,
+                            loop=args.loop)
+    install(backend)
+
+    sys.argv = [args.script] + args.args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    try:
+        runpy.run_path(args.script, run_name="__main__")
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    elapsed = max(backend.elapsed(), 1e-9)
+
+    if backend.reason is not None:
+        print(backend.reason)
+    print(f"Replayed for {elapsed:.2f}s")
+    for robot, channels in backend.stats().items():
+        for channel, stats in channels.items():
+            print(f"{robot} {channel}: {stats.served} served ({stats.served / elapsed:.1f}/s), "
+                  f"{stats.skipped} skipped, {stats.sets} sets ({stats.sets / elapsed:.1f}/s)")
+
+    if args.output:
+        calls = {name: {channel: getattr(robot, channel).calls for channel in ACT_CHANNELS}
+                 for name, robot in backend.robots.items()}
+        with open(args.output, "wb") as f:
+            pickle.dump(calls, f, pickle.HIGHEST_PROTOCOL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a tutorial against a recording instead of a robot, or "
+                                                 "record a session from the robot selected in BOW Hub.")
+    parser.add_argument("recording", help="Recording to replay or write")
+    parser.add_argument("script", nargs="?", help="Python script to run")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Arguments for the script")
+    parser.add_argument("--speed", type=float, default=1.0, help="Playback speed as a multiple of real time, or 0 "
+                                                                 "to serve samples as fast as they are read")
+    parser.add_argument("--loop", action="store_true", help="Repeat the recording until the script exits")
+    parser.add_argument("--output", help="Write the commands the script sent to this file")
+    parser.add_argument("--record", type=float, metavar="SECONDS", help="Record a session for this long instead")
+    parser.add_argument("--channels", default="vision,proprioception,exteroception",
+                        help="Comma separated channels to record")
+    parser.add_argument("--compress", action="store_true", help="Losslessly compress recorded images")
+    args = parser.parse_args()
+
+    if args.record is not None:
+        _record(args)
+    elif args.script is not None:
+        _replay(args)
+    else:
+        parser.error("a script to run is required unless recording")
+
+
+if __name__ == "__main__":
+    # Run from the imported module so the stand-in bow_api shares this backend rather than a copy of __main__'s
+    from bow_utils.replay import main as replay_main
+    replay_main()
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+import json
+import mmap
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import bow_data
+import numpy as np
+
+from .recorder import (CODEC_NONE, SESSION_MAGIC, _BLOCK, _CHUNK, _FILE_HEADER, _FRAME, _INDEX, _STREAM, _TRAILER,
+                       _TRAILER_MAGIC, _padding, _read_chunk_header, parse_message, unpack_arrays)
+
+_FRAME_INDEX = np.dtype([
+    ("timestamp", "<f8"), ("stream", "<u4"), ("offset", "<u8"), ("raw_length", "<u8"), ("stored_length", "<u8"),
+    ("codec", "u1"), ("width", "<u4"), ("height", "<u4"), ("image_type", "<i4")])
+_BLOCK_INDEX = np.dtype([("stream", "<u4"), ("first", "<f8"), ("last", "<f8"), ("offset", "<u8"), ("count", "<u4")])
+
+
+class SessionStream(NamedTuple):
+    """One source of data in a session, e.g. a robot's front camera or its proprioception."""
+    id: int
+    robot: str
+    channel: str
+    source: str
+
+
+class Frame(NamedTuple):
+    """One recorded image."""
+    timestamp: float
+    robot: str
+    source: str
+    image_type: int
+    width: int
+    height: int
+    data: np.ndarray  # (height * 3 / 2, width) uint8 I420 planes for RGB, (height, width) uint16 for DEPTH
+
+    def to_sample(self) -> "bow_data.ImageSample":
+        """Rebuild the ImageSample, e.g. to pass to an ImageDecoder."""
+        return bow_data.ImageSample(Source=self.source, Data=self.data.tobytes(), DataShape=[self.width, self.height],
+                                    ImageType=self.image_type, NewDataFlag=True)
+
+
+class JointPositions(NamedTuple):
+    """Joint positions over time, one row per proprioception sample."""
+    timestamps: np.ndarray  # (N,)
+    names: List[str]
+    positions: np.ndarray  # (N, J), NaN where a joint was missing from a sample
+
+
+class SessionReader:
+    """
+    Query a session file written by a SessionRecorder without reading all of it.
+
+    The file is memory mapped and only the index is loaded up front, so opening a recording of any size is
+    immediate and a query only touches the pages it returns. Frames stored uncompressed are returned as read-only
+    NumPy views onto the mapping rather than copies. Views must be released before close() can unmap the file.
+    """
+
+    def __init__(self, path: str, block_cache: int = 16):
+        """
+        :param path: The session file to read.
+        :param block_cache: The number of decompressed sample blocks to keep for repeated queries.
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = _FILE_HEADER.unpack_from(self._map, 0)
+        if magic != SESSION_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a session file")
+
+        self._block_cache: "OrderedDict[int, Tuple[dict, Dict[str, np.ndarray]]]" = OrderedDict()
+        self._block_cache_size = block_cache
+        if not self._load_index():
+            self._scan()
+
+        # Per stream positions in time order, so range queries are a binary search
+        self._frames_by_stream: Dict[int, np.ndarray] = {}
+        order = np.lexsort((self.frame_index["timestamp"], self.frame_index["stream"]))
+        streams, starts = np.unique(self.frame_index["stream"][order], return_index=True)
+        for stream, group in zip(streams.tolist(), np.split(order, starts[1:])):
+            self._frames_by_stream[stream] = group
+
+    def _load_index(self) -> bool:
+        if len(self._map) < _FILE_HEADER.size + _TRAILER.size:
+            return False
+        offset, magic = _TRAILER.unpack_from(self._map, len(self._map) - _TRAILER.size)
+        if magic != _TRAILER_MAGIC:
+            return False
+        header = _read_chunk_header(self._map, offset)
+        if header.kind != _INDEX:
+            return False
+        start = offset + _CHUNK.size
+        meta, arrays = unpack_arrays(zlib.decompress(self._map[start:start + header.stored_length]))
+        self.streams = [SessionStream(i, s["robot"], s["channel"], s["source"]) for i, s in enumerate(meta["streams"])]
+        self.frame_index = arrays["frames"].astype(_FRAME_INDEX)
+        self.block_index = arrays["blocks"].astype(_BLOCK_INDEX)
+        return True
+
+    def _scan(self):
+        # The recorder did not finish, so rebuild the index from the chunk headers
+        streams: Dict[int, SessionStream] = {}
+        frames = []
+        blocks = []
+        offset = _FILE_HEADER.size
+        while offset + _CHUNK.size <= len(self._map):
+            try:
+                header = _read_chunk_header(self._map, offset)
+            except ValueError:
+                break
+            start = offset + _CHUNK.size
+            if start + header.stored_length > len(self._map):
+                break
+
+            if header.kind == _STREAM:
+                s = json.loads(self._map[start:start + header.stored_length])
+                streams[header.stream] = SessionStream(header.stream, s["robot"], s["channel"], s["source"])
+            elif header.kind == _FRAME:
+                frames.append((header.timestamp, header.stream, offset, header.raw_length, header.stored_length,
+                               header.codec, header.width, header.height, header.image_type))
+            elif header.kind == _BLOCK:
+                blocks.append((header.stream, header.timestamp, np.inf, offset, header.count))
+            offset = start + header.stored_length + _padding(header.stored_length)
+
+        self.streams = [streams[i] for i in sorted(streams.keys())]
+        self.frame_index = np.array(frames, _FRAME_INDEX)
+        self.block_index = np.array(blocks, _BLOCK_INDEX)
+
+        # A block ends no later than the next block of the same stream starts
+        for stream in np.unique(self.block_index["stream"]):
+            positions = np.flatnonzero(self.block_index["stream"] == stream)
+            self.block_index["last"][positions[:-1]] = self.block_index["first"][positions[1:]]
+
+    def close(self):
+        """Unmap the file. Any frames still referenced keep the mapping open until they are released."""
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    # Streams
+
+    def _stream_ids(self, channel: str, robot: Optional[str] = None, source: Optional[str] = None) -> List[int]:
+        return [s.id for s in self.streams if s.channel == channel and (robot is None or s.robot == robot) and
+                (source is None or s.source == source)]
+
+    @property
+    def robots(self) -> List[str]:
+        return list(dict.fromkeys(s.robot for s in self.streams))
+
+    def sources(self, robot: Optional[str] = None) -> List[str]:
+        """The cameras recorded, optionally from only one robot."""
+        return list(dict.fromkeys(self.streams[i].source for i in self._stream_ids("vision", robot)))
+
+    @property
+    def duration(self) -> float:
+        """The time of the last frame or sample block, in seconds from the start of the recording."""
+        last = [self.frame_index["timestamp"].max()] if len(self.frame_index) > 0 else []
+        if len(self.block_index) > 0:
+            finite = self.block_index["last"][np.isfinite(self.block_index["last"])]
+            last.append(max(finite.max(initial=0), self.block_index["first"].max()))
+        return float(max(last, default=0.0))
+
+    # Frames
+
+    def frame_positions(self, source: Optional[str] = None, robot: Optional[str] = None,
+                        start: Optional[float] = None, end: Optional[float] = None) -> np.ndarray:
+        """
+        Find frames by camera and time without touching the frames themselves.
+
+        :param source: The camera, or None for every camera.
+        :param robot: The robot, or None for every robot.
+        :param start: The earliest timestamp to include, or None for the start of the recording.
+        :param end: The latest timestamp to include, or None for the end of the recording.
+        :return: Positions in frame_index, in time order.
+        """
+        timestamps = self.frame_index["timestamp"]
+        found = []
+        for stream in self._stream_ids("vision", robot, source):
+            group = self._frames_by_stream.get(stream)
+            if group is None:
+                continue
+            times = timestamps[group]
+            first = 0 if start is None else np.searchsorted(times, start, "left")
+            last = len(group) if end is None else np.searchsorted(times, end, "right")
+            found.append(group[first:last])
+        if len(found) == 0:
+            return np.empty(0, np.int64)
+        positions = np.concatenate(found)
+        return positions[np.argsort(timestamps[positions], kind="stable")]
+
+    def frame(self, position: int) -> Frame:
+        """
+        Read one frame by its position in frame_index.
+
+        Uncompressed frames are read-only views onto the file, compressed ones are decompressed into a new array.
+        """
+        entry = self.frame_index[position]
+        width = int(entry["width"])
+        height = int(entry["height"])
+        image_type = int(entry["image_type"])
+        start = int(entry["offset"]) + _CHUNK.size
+
+        if entry["codec"] == CODEC_NONE:
+            buffer, buffer_offset = self._map, start
+        else:
+            buffer, buffer_offset = zlib.decompress(self._map[start:start + int(entry["stored_length"])]), 0
+
+        if image_type == bow_data.ImageSample.ImageTypeEnum.RGB:
+            shape, dtype = (height * 3 // 2, width), np.uint8
+        else:
+            shape, dtype = (height, width), np.uint16
+        count = shape[0] * shape[1]
+        if count * np.dtype(dtype).itemsize > int(entry["raw_length"]):
+            # Not an image layout we know, hand back the raw bytes
+            shape, dtype, count = (int(entry["raw_length"]),), np.uint8, int(entry["raw_length"])
+        data = np.frombuffer(buffer, dtype, count, buffer_offset).reshape(shape)
+
+        stream = self.streams[int(entry["stream"])]
+        return Frame(float(entry["timestamp"]), stream.robot, stream.source, image_type, width, height, data)
+
+    def frames(self, source: Optional[str] = None, robot: Optional[str] = None, start: Optional[float] = None,
+               end: Optional[float] = None) -> Iterator[Frame]:
+        """
+        Read the frames from a camera between two times, in time order.
+
+        :param source: The camera, or None for every camera.
+        :param robot: The robot, or None for every robot.
+        :param start: The earliest timestamp to include, or None for the start of the recording.
+        :param end: The latest timestamp to include, or None for the end of the recording.
+        """
+        for position in self.frame_positions(source, robot, start, end):
+            yield self.frame(int(position))
+
+    def frame_at(self, source: str, timestamp: float, robot: Optional[str] = None) -> Optional[Frame]:
+        """Return the last frame from a camera at or before a time, or None if there is none."""
+        positions = self.frame_positions(source, robot, None, timestamp)
+        return self.frame(int(positions[-1])) if len(positions) > 0 else None
+
+    # Samples
+
+    def _block(self, position: int) -> Tuple[dict, Dict[str, np.ndarray]]:
+        cached = self._block_cache.get(position)
+        if cached is not None:
+            self._block_cache.move_to_end(position)
+            return cached
+
+        offset = int(self.block_index["offset"][position])
+        header = _read_chunk_header(self._map, offset)
+        start = offset + _CHUNK.size
+        payload = self._map[start:start + header.stored_length]
+        block = unpack_arrays(zlib.decompress(payload) if header.codec != CODEC_NONE else payload)
+
+        self._block_cache[position] = block
+        if len(self._block_cache) > self._block_cache_size:
+            self._block_cache.popitem(last=False)
+        return block
+
+    def _blocks(self, channel: str, robot: Optional[str], start: Optional[float], end: Optional[float]):
+        streams = self._stream_ids(channel, robot)
+        mask = np.isin(self.block_index["stream"], streams)
+        if start is not None:
+            mask &= self.block_index["last"] >= start
+        if end is not None:
+            mask &= self.block_index["first"] <= end
+        for position in np.flatnonzero(mask):
+            meta, arrays = self._block(int(position))
+            timestamps = arrays["timestamps"]
+            selected = np.ones(len(timestamps), bool)
+            if start is not None:
+                selected &= timestamps >= start
+            if end is not None:
+                selected &= timestamps <= end
+            if selected.any():
+                yield int(self.block_index["stream"][position]), meta, arrays, np.flatnonzero(selected)
+
+    def samples(self, channel: str, robot: Optional[str] = None, start: Optional[float] = None,
+                end: Optional[float] = None) -> List[Tuple[float, object]]:
+        """
+        Read the messages recorded on a channel other than vision between two times.
+
+        :param channel: The channel, e.g. "proprioception" or "motor".
+        :param robot: The robot, or None for every robot.
+        :param start: The earliest timestamp to include, or None for the start of the recording.
+        :param end: The latest timestamp to include, or None for the end of the recording.
+        :return: (timestamp, message) pairs in time order.
+        """
+        found = []
+        for _, meta, arrays, selected in self._blocks(channel, robot, start, end):
+            offsets = arrays["offsets"]
+            data = arrays["data"]
+            timestamps = arrays["timestamps"]
+            for i in selected.tolist():
+                found.append((float(timestamps[i]), parse_message(
+                    meta["message"], data[int(offsets[i]):int(offsets[i + 1])].tobytes())))
+        found.sort(key=lambda item: item[0])
+        return found
+
+    def joint_positions(self, robot: Optional[str] = None, start: Optional[float] = None,
+                        end: Optional[float] = None) -> JointPositions:
+        """
+        Read the RawJoints positions from proprioception as one array, without parsing any messages.
+
+        :param robot: The robot, or None for every robot.
+        :param start: The earliest timestamp to include, or None for the start of the recording.
+        :param end: The latest timestamp to include, or None for the end of the recording.
+        """
+        parts = []
+        names: Dict[str, int] = {}
+        for _, meta, arrays, selected in self._blocks("proprioception", robot, start, end):
+            if "joint_positions" not in arrays:
+                continue
+            for name in meta["joint_names"]:
+                names.setdefault(name, len(names))
+            parts.append((arrays["timestamps"][selected], meta["joint_names"], arrays["joint_positions"][selected]))
+
+        if len(parts) == 0:
+            return JointPositions(np.empty(0), [], np.empty((0, 0), np.float32))
+
+        timestamps = np.concatenate([part[0] for part in parts])
+        positions = np.full((len(timestamps), len(names)), np.nan, np.float32)
+        row = 0
+        for part_timestamps, part_names, part_positions in parts:
+            columns = [names[name] for name in part_names]
+            positions[row:row + len(part_timestamps), columns] = part_positions
+            row += len(part_timestamps)
+        order = np.argsort(timestamps, kind="stable")
+        return JointPositions(timestamps[order], list(names.keys()), positions[order])
+
+    def iter_all(self) -> Iterator[Tuple[str, str, float, object]]:
+        """
+        Read every frame and sample in time order.
+
+        :return: (robot, channel, timestamp, sample) for each, with frames as ImageSample messages on the vision
+            channel.
+        """
+        records = []
+        for position in range(len(self.frame_index)):
+            records.append((float(self.frame_index["timestamp"][position]), 0, position, None))
+        for stream in self.streams:
+            if stream.channel == "vision":
+                continue
+            for timestamp, sample in self.samples(stream.channel, stream.robot):
+                records.append((timestamp, 1, stream.robot, stream.channel, sample))
+        records.sort(key=lambda record: (record[0], record[1]))
+
+        for record in records:
+            if record[1] == 0:
+                frame = self.frame(record[2])
+                yield frame.robot, "vision", frame.timestamp, frame.to_sample()
+            else:
+                yield record[2], record[3], record[0], record[4]
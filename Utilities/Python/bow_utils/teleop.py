@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+import threading
+from typing import Callable, FrozenSet, List, NamedTuple, Optional, Sequence
+
+import bow_data
+
+
+class KeyBinding(NamedTuple):
+    """Set one field of the motor command while a key is held."""
+    key: str  # The character, or the name of a special key such as "space"
+    field: str  # The dotted path of the field in a MotorSample, e.g. "Locomotion.TranslationalVelocity.X"
+    value: float
+    label: str = ""  # What the binding does, printed when the key is pressed
+
+
+# Driving keys shared by the tutorials. Bindings later in a table win, so holding space stops the robot whatever
+# else is held.
+LOCOMOTION_BINDINGS = (
+    KeyBinding("w", "Locomotion.TranslationalVelocity.X", 0.2, "Moving forward"),
+    KeyBinding("s", "Locomotion.TranslationalVelocity.X", -0.2, "Moving backward"),
+    KeyBinding("d", "Locomotion.RotationalVelocity.Z", -1, "Rotate right"),
+    KeyBinding("a", "Locomotion.RotationalVelocity.Z", 1, "Rotate left"),
+    KeyBinding("e", "Locomotion.TranslationalVelocity.Y", -1, "Strafe right"),
+    KeyBinding("q", "Locomotion.TranslationalVelocity.Y", 1, "Strafe left"),
+    KeyBinding("space", "Locomotion.TranslationalVelocity.X", 0, "Stop moving"),
+    KeyBinding("space", "Locomotion.TranslationalVelocity.Y", 0),
+    KeyBinding("space", "Locomotion.RotationalVelocity.Z", 0),
+)
+
+# Looking around with the gaze vector, as in the SendingCommands tutorial
+GAZE_BINDINGS = (
+    KeyBinding("i", "GazeTarget.GazeVector.X", -0.2, "Look up"),
+    KeyBinding("k", "GazeTarget.GazeVector.X", 0.2, "Look down"),
+    KeyBinding("j", "GazeTarget.GazeVector.Y", 0.2, "Look left"),
+    KeyBinding("l", "GazeTarget.GazeVector.Y", -0.2, "Look right"),
+    KeyBinding("o", "GazeTarget.GazeVector.Z", -0.2, "Tilt left"),
+    KeyBinding("u", "GazeTarget.GazeVector.Z", 0.2, "Tilt right"),
+)
+
+DEFAULT_BINDINGS = LOCOMOTION_BINDINGS + GAZE_BINDINGS
+
+
+def key_name(key) -> Optional[str]:
+    """Name a pynput key the way KeyBinding does: its character, or the name of a special key."""
+    char = getattr(key, "char", None)
+    if char:
+        return char
+    return getattr(key, "name", None)
+
+
+def get_field(message, path: str):
+    """Read a field of a message by its dotted path, e.g. "Locomotion.TranslationalVelocity.X"."""
+    for name in path.split("."):
+        message = getattr(message, name)
+    return message
+
+
+def set_field(message, path: str, value):
+    """Set a field of a message by its dotted path, e.g. "Locomotion.TranslationalVelocity.X"."""
+    *parents, name = path.split(".")
+    for parent in parents:
+        message = getattr(message, parent)
+    setattr(message, name, value)
+
+
+class KeyboardTeleop:
+    """
+    Turn key presses into motor commands as they happen, from a table of key bindings.
+
+    Pass on_press and on_release to a pynput keyboard.Listener. The command is only rebuilt when a bound key is
+    pressed or released, and on_change is called with it straight away from the listener's thread, so a command
+    can reach the motor scheduler without waiting for the next frame of the control loop. Every bound field is
+    set in every command, to zero when its keys are released, so releasing every key sends an explicit stop.
+
+    Each command is a new MotorSample which is never modified afterwards, so sample can be read from any thread.
+    """
+
+    def __init__(self, bindings: Sequence[KeyBinding] = DEFAULT_BINDINGS,
+                 on_change: Optional[Callable[[object], None]] = None, verbose: bool = False,
+                 stop_key: Optional[str] = "esc"):
+        """
+        :param bindings: The key bindings. Where several held keys set the same field, the later binding wins.
+        :param on_change: Called with the new command whenever it changes, from the keyboard listener's thread.
+        :param verbose: Print a binding's label when its key is pressed.
+        :param stop_key: The key which stops the keyboard listener, or None.
+        """
+        self.bindings = tuple(bindings)
+        self.on_change = on_change
+        self.verbose = verbose
+        self.stop_key = stop_key
+        self.stopped = False
+        self.changes = 0
+
+        self._bound_keys = frozenset(binding.key for binding in self.bindings)
+        self._fields = list(dict.fromkeys(binding.field for binding in self.bindings))
+        self._labels = {}
+        for binding in self.bindings:
+            if binding.label and binding.key not in self._labels:
+                self._labels[binding.key] = binding.label
+
+        self._lock = threading.Lock()
+        self._pressed: FrozenSet[str] = frozenset()
+        self._sample = self._build(self._pressed)
+
+    @property
+    def pressed(self) -> FrozenSet[str]:
+        """The names of the keys held down, bound or not."""
+        return self._pressed
+
+    @property
+    def sample(self):
+        """The current motor command."""
+        return self._sample
+
+    def actions(self) -> List[str]:
+        """The labels of the bound keys held down, in the order of the bindings."""
+        pressed = self._pressed
+        return [label for key, label in self._labels.items() if key in pressed]
+
+    def _build(self, pressed: FrozenSet[str]):
+        values = dict.fromkeys(self._fields, 0.0)
+        for binding in self.bindings:
+            if binding.key in pressed:
+                values[binding.field] = binding.value
+
+        sample = bow_data.MotorSample()
+        for field, value in values.items():
+            set_field(sample, field, value)
+        return sample
+
+    def _update(self, name: str, down: bool):
+        with self._lock:
+            pressed = self._pressed | {name} if down else self._pressed - {name}
+            if pressed == self._pressed:
+                # Key repeat while held, nothing has changed
+                return
+            self._pressed = pressed
+            if name not in self._bound_keys:
+                return
+            sample = self._build(pressed)
+            self._sample = sample
+            self.changes += 1
+
+        if down and self.verbose and name in self._labels:
+            print(self._labels[name])
+        if self.on_change is not None:
+            self.on_change(sample)
+
+    def on_press(self, key):
+        name = key_name(key)
+        if name is not None:
+            self._update(name, True)
+
+    def on_release(self, key):
+        name = key_name(key)
+        if name is not None:
+            self._update(name, False)
+        if self.stop_key is not None and name == self.stop_key:
+            self.stopped = True
+            # Stop the listener
+            return False
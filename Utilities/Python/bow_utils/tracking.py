@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+from typing import List, NamedTuple
+
+import numpy as np
+
+
+class TrackedObject(NamedTuple):
+    """The estimated position of a tracked object at a point in time."""
+    track_id: int
+    class_id: int
+    confidence: float
+    box: np.ndarray  # x1, y1, x2, y2 in pixels
+    hits: int  # Number of detections the track has been matched to
+    predicted: bool  # True if the box was extrapolated rather than taken directly from a detection
+
+
+class _Track:
+    def __init__(self, track_id: int, class_id: int, confidence: float, box: np.ndarray, timestamp: float):
+        self.track_id = track_id
+        self.class_id = class_id
+        self.confidence = confidence
+        self.box = box.astype(np.float64)
+        self.velocity = np.zeros(4)
+        self.timestamp = timestamp
+        self.hits = 1
+        self.misses = 0
+
+    def box_at(self, timestamp: float) -> np.ndarray:
+        return self.box + self.velocity * (timestamp - self.timestamp)
+
+
+def _iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+
+class ObjectTracker:
+    """
+    Give detected objects persistent identities and estimate their boxes between detections.
+
+    Each call to update() matches new detections to existing tracks of the same class, first by the overlap
+    (IoU) of the detection with the track's predicted box and then, for anything left over, by the distance
+    between box centres relative to the box size. Tracks keep a constant velocity estimate, so predict() can
+    return a box for every tracked object on frames where detection was not run.
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, centroid_threshold: float = 0.5, max_misses: int = 3,
+                 max_age: float = 1.0, velocity_smoothing: float = 0.5):
+        """
+        :param iou_threshold: The minimum overlap for a detection to be matched to a track.
+        :param centroid_threshold: The maximum centre distance, as a fraction of the track's box diagonal, for a
+            detection that did not overlap enough to still be matched to a track.
+        :param max_misses: The number of consecutive detections a track may be missing from before it is removed.
+        :param max_age: Seconds a track is kept and extrapolated for without being matched.
+        :param velocity_smoothing: Weight given to the newest velocity measurement, between 0 and 1.
+        """
+        self.iou_threshold = iou_threshold
+        self.centroid_threshold = centroid_threshold
+        self.max_misses = max_misses
+        self.max_age = max_age
+        self.velocity_smoothing = velocity_smoothing
+
+        self._tracks: List[_Track] = []
+        self._next_id = 0
+
+    def _match(self, tracks: List[_Track], boxes: np.ndarray, class_ids: np.ndarray, timestamp: float):
+        if len(tracks) == 0 or len(boxes) == 0:
+            return []
+
+        predicted = np.array([track.box_at(timestamp) for track in tracks])
+        track_classes = np.array([track.class_id for track in tracks])
+        same_class = track_classes[:, None] == class_ids[None, :]
+
+        # Score by overlap first, then fall back to centre distance for boxes that moved too far to overlap
+        overlap = np.where(same_class, _iou(predicted, boxes), 0.0)
+        track_centres = (predicted[:, :2] + predicted[:, 2:]) / 2
+        centres = (boxes[:, :2] + boxes[:, 2:]) / 2
+        diagonals = np.maximum(np.linalg.norm(predicted[:, 2:] - predicted[:, :2], axis=1), 1e-9)
+        distance = np.linalg.norm(track_centres[:, None, :] - centres[None, :, :], axis=2) / diagonals[:, None]
+        distance = np.where(same_class, distance, np.inf)
+
+        matches = []
+        used_tracks = set()
+        used_detections = set()
+        for scores, threshold in ((overlap, self.iou_threshold), (-distance, -self.centroid_threshold)):
+            # Greedily take the best remaining pair until none pass the threshold
+            order = np.argsort(-scores, axis=None)
+            for t, d in zip(*np.unravel_index(order, scores.shape)):
+                if scores[t, d] < threshold:
+                    break
+                if t in used_tracks or d in used_detections:
+                    continue
+                matches.append((t, d))
+                used_tracks.add(t)
+                used_detections.add(d)
+        return matches
+
+    def update(self, boxes: np.ndarray, class_ids: np.ndarray, confidences: np.ndarray,
+               timestamp: float) -> List[TrackedObject]:
+        """
+        Incorporate a new set of detections.
+
+        :param boxes: (N, 4) box corners as x1, y1, x2, y2.
+        :param class_ids: (N,) class of each box.
+        :param confidences: (N,) confidence of each box.
+        :param timestamp: The time, in seconds, the detected image was captured.
+        :return: The tracked objects that were matched to or created from these detections.
+        """
+        boxes = np.asarray(boxes, np.float64).reshape(-1, 4)
+        class_ids = np.asarray(class_ids).reshape(-1)
+        confidences = np.asarray(confidences).reshape(-1)
+
+        matches = self._match(self._tracks, boxes, class_ids, timestamp)
+        matched_tracks = set()
+        matched_detections = set()
+        for t, d in matches:
+            track = self._tracks[t]
+            dt = timestamp - track.timestamp
+            if dt > 0:
+                measured = (boxes[d] - track.box) / dt
+                track.velocity += self.velocity_smoothing * (measured - track.velocity)
+            track.box = boxes[d].copy()
+            track.confidence = float(confidences[d])
+            track.timestamp = timestamp
+            track.hits += 1
+            track.misses = 0
+            matched_tracks.add(t)
+            matched_detections.add(d)
+
+        # Age out tracks that were not seen again
+        kept = []
+        for i, track in enumerate(self._tracks):
+            if i not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses or timestamp - track.timestamp > self.max_age:
+                    continue
+            kept.append(track)
+        self._tracks = kept
+
+        for d in range(len(boxes)):
+            if d not in matched_detections:
+                self._tracks.append(_Track(self._next_id, int(class_ids[d]), float(confidences[d]), boxes[d],
+                                           timestamp))
+                self._next_id += 1
+
+        return [TrackedObject(track.track_id, track.class_id, track.confidence, track.box.copy(), track.hits, False)
+                for track in self._tracks if track.misses == 0]
+
+    def predict(self, timestamp: float) -> List[TrackedObject]:
+        """
+        Estimate where every live track is at a given time.
+
+        :param timestamp: The time, in seconds, to extrapolate the tracks to.
+        :return: One tracked object per live track.
+        """
+        tracked = []
+        for track in self._tracks:
+            if timestamp - track.timestamp > self.max_age:
+                continue
+            tracked.append(TrackedObject(track.track_id, track.class_id, track.confidence, track.box_at(timestamp),
+                                         track.hits, timestamp != track.timestamp))
+        return tracked
+
+    def reset(self):
+        """Remove every track."""
+        self._tracks = []
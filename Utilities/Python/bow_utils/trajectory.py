@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+import math
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, List, Mapping, NamedTuple, Optional
+
+import numpy as np
+
+import bow_data
+
+
+class Trajectory(NamedTuple):
+    """Target positions for an effector, each due at a set time."""
+    times: np.ndarray  # Seconds from the start at which each point is due, increasing
+    positions: np.ndarray  # (points, 3) target positions in metres
+    duration: float  # Seconds from the start until the trajectory has finished and a repeat would start
+
+    @property
+    def points(self) -> int:
+        return len(self.times)
+
+
+def _sample_times(duration: float, rate: float) -> np.ndarray:
+    count = max(2, int(round(duration * rate)))
+    return np.arange(count, dtype=np.float64) / rate
+
+
+def parametric(function: Callable[[np.ndarray], np.ndarray], duration: float, rate: float) -> Trajectory:
+    """
+    Sample a parametric curve at a fixed rate.
+
+    :param function: Maps an array of times in seconds to an array of positions, of shape (points, 3). It is
+        called once with every time, so it should use NumPy operations rather than a Python loop.
+    :param duration: The length of the trajectory in seconds. The point at the duration itself is not included,
+        so a closed curve repeats without sending the same point twice.
+    :param rate: Points per second.
+    """
+    times = _sample_times(duration, rate)
+    positions = np.asarray(function(times), dtype=np.float64).reshape(len(times), 3)
+    return Trajectory(times, positions, float(duration))
+
+
+def spline(waypoints, duration: float, rate: float, closed: bool = False) -> Trajectory:
+    """
+    Pass a Catmull-Rom spline through waypoints, spending the same time between each pair.
+
+    :param waypoints: The positions to pass through, of shape (waypoints, 3).
+    :param duration: The length of the trajectory in seconds.
+    :param rate: Points per second.
+    :param closed: Join the last waypoint back to the first, so the trajectory can be repeated smoothly.
+        Otherwise the trajectory ends exactly on the last waypoint.
+    """
+    points = np.asarray(waypoints, dtype=np.float64).reshape(-1, 3)
+    if len(points) < 2:
+        raise ValueError("A spline needs at least two waypoints")
+    times = _sample_times(duration, rate)
+    segments = len(points) if closed else len(points) - 1
+    if closed:
+        progress = times / duration * segments
+    else:
+        progress = times / times[-1] * segments
+
+    index = np.minimum(np.floor(progress).astype(np.int64), segments - 1)
+    s = (progress - index)[:, None]
+    neighbours = index[:, None] + np.arange(-1, 3)
+    if closed:
+        neighbours %= len(points)
+    else:
+        np.clip(neighbours, 0, len(points) - 1, out=neighbours)
+    p0, p1, p2, p3 = (points[neighbours[:, k]] for k in range(4))
+
+    positions = 0.5 * (2.0 * p1 + (p2 - p0) * s + (2.0 * p0 - 5.0 * p1 + 4.0 * p2 - p3) * s ** 2 +
+                       (3.0 * p1 - p0 - 3.0 * p2 + p3) * s ** 3)
+    return Trajectory(times, positions, float(duration))
+
+
+def controllable_effectors(prop_msg) -> List:
+    """
+    List the effectors of a robot which can be moved, from a proprioception sample.
+
+    :param prop_msg: A bow_data.ProprioceptionSample.
+    :return: The effector messages from every part of the robot whose kinematic chain has moveable joints.
+    """
+    return [effector for part in prop_msg.Parts for effector in part.Effectors if effector.IsControllable]
+
+
+class TrajectoryStats(NamedTuple):
+    """Counters reported by a TrajectoryStreamer."""
+    points: int  # Ticks in one pass of the trajectories, each sent as one MotorSample
+    effectors: int  # Effectors moved by every tick
+    sent: int
+    failed: int
+    skipped: int  # Ticks not sent because the next one was already due
+    mean_lateness: float  # Mean seconds between a tick falling due and it being sent
+    max_lateness: float
+    tracking_samples: int  # Effector positions from proprioception compared with their targets
+    tracking_rms: float  # Root mean square distance between an effector and its current target, in metres
+    tracking_max: float
+
+
+class TrajectoryStreamer:
+    """
+    Stream precomputed trajectories to one or more effectors as inverse kinematics objectives, on a background
+    thread.
+
+    Every effector's objective goes in the same MotorSample, so moving several limbs together costs one motor.set
+    per tick rather than one per effector. Trajectories with different sample times are merged into one schedule,
+    and each tick carries every effector's most recent point, with an effector whose trajectory is shorter than the
+    others holding its last point until they finish.
+
+    Every tick is due at a fixed time from the start, so time spent sending one tick is taken out of the wait for
+    the next rather than added to it, and the trajectories keep their shape however long motor.set takes. When
+    sending falls so far behind that the next tick is already due, the late tick is skipped instead of being sent in
+    a burst. One MotorSample is built up front and only its target positions are changed for each tick.
+
+    With track set, a second thread compares the positions the robot reports for the effectors on its proprioception
+    channel with the targets being sent, giving the tracking error.
+    """
+
+    def __init__(self, robot, trajectories: Mapping[str, Trajectory], repeats: int = 1, preset=None,
+                 track: bool = True, profiler=None):
+        """
+        :param robot: A connected bow_api robot with the motor channel open.
+        :param trajectories: The positions to send and when, by the EffectorLinkName of the effector to move.
+        :param repeats: How many times to run through the trajectories.
+        :param preset: The IKSettings preset to solve with, by default bow_data.IKOptimiser.HIGH_ACCURACY.
+        :param track: Measure the tracking error, which needs the proprioception channel open.
+        :param profiler: A LoopProfiler to record the time spent in motor.set with, if any.
+        """
+        if len(trajectories) == 0:
+            raise ValueError("No trajectories to stream")
+        self.robot = robot
+        self.trajectories = dict(trajectories)
+        self.effectors: List[str] = list(self.trajectories)
+        self.repeats = repeats
+        self.track = track
+        self.profiler = profiler
+        self.last_error = None
+
+        self.motor_sample = bow_data.MotorSample()
+        self.motor_sample.IKSettings.Preset = bow_data.IKOptimiser.HIGH_ACCURACY if preset is None else preset
+        for effector in self.effectors:
+            objective_command = bow_data.ObjectiveCommand()
+            objective_command.TargetEffector = effector
+            objective_command.ControlMode = bow_data.ControllerEnum.POSITION_CONTROLLER
+            objective_command.PoseTarget.Action = bow_data.ActionEnum.GOTO
+            objective_command.PoseTarget.TargetType = bow_data.PoseTarget.TargetTypeEnum.TRANSFORM
+            objective_command.PoseTarget.TargetScheduleType = bow_data.PoseTarget.SchedulerEnum.INSTANTANEOUS
+            objective_command.PoseTarget.LocalObjectiveWeights.Position = 1
+            objective_command.PoseTarget.LocalObjectiveWeights.Orientation = 0
+            objective_command.Enabled = True
+            self.motor_sample.Objectives.append(objective_command)
+        # The sample holds its own copies of the objectives, so keep the positions inside it to change for each tick
+        self._targets = [objective.PoseTarget.Transform.Position for objective in self.motor_sample.Objectives]
+
+        # Merge every effector's sample times, taking each effector's latest point at every tick
+        ticks = np.unique(np.concatenate([trajectory.times for trajectory in self.trajectories.values()]))
+        positions = np.empty((len(ticks), len(self.effectors), 3))
+        for i, trajectory in enumerate(self.trajectories.values()):
+            latest = np.maximum(np.searchsorted(trajectory.times, ticks, side="right") - 1, 0)
+            positions[:, i] = trajectory.positions[latest]
+        self.duration = max(trajectory.duration for trajectory in self.trajectories.values())
+
+        # Python floats are quicker to assign to message fields and to do arithmetic with than NumPy scalars
+        self._times = ticks.tolist()
+        self._positions = positions.tolist()
+        self._index = {effector: i for i, effector in enumerate(self.effectors)}
+        self._current: Optional[List[List[float]]] = None
+        self._sent = 0
+        self._failed = 0
+        self._skipped = 0
+        self._lateness_total = 0.0
+        self._lateness_max = 0.0
+        self._tracking_samples = 0
+        self._tracking_squares = 0.0
+        self._tracking_max = 0.0
+
+        self._done = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._tracker: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._running and not self._done.is_set()
+
+    def start(self, delay: float = 0.0):
+        """
+        Start streaming.
+
+        :param delay: Seconds from now until the first tick is due.
+        """
+        if self._running:
+            return
+        self._running = True
+        self._done.clear()
+        start = time.monotonic() + delay
+        self._thread = threading.Thread(target=self._run, args=(start,), name="TrajectoryStreamer")
+        self._thread.daemon = True
+        self._thread.start()
+        if self.track:
+            self._tracker = threading.Thread(target=self._track, name="TrajectoryTracker")
+            self._tracker.daemon = True
+            self._tracker.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the trajectories to finish.
+
+        :param timeout: Maximum time in seconds to wait, or None to wait until they finish.
+        :return: Whether they have finished.
+        """
+        return self._done.wait(timeout)
+
+    def stop(self, timeout: float = 1.0):
+        """
+        Stop streaming, if it has not finished already, and the tracking thread.
+
+        :param timeout: Maximum time in seconds to wait for each thread to exit.
+        """
+        self._running = False
+        for thread in (self._thread, self._tracker):
+            if thread is not None:
+                thread.join(timeout)
+        self._thread = None
+        self._tracker = None
+
+    def _run(self, start: float):
+        set_timer = nullcontext()
+        if self.profiler is not None:
+            set_timer = self.profiler.stage("motor.set", self.robot.robot_details.name)
+
+        times = self._times
+        points = len(times)
+        total = points * self.repeats
+        i = 0
+        while self._running and i < total:
+            repeat, point = divmod(i, points)
+            due = start + repeat * self.duration + times[point]
+            now = time.monotonic()
+            if now < due:
+                time.sleep(due - now)
+                now = time.monotonic()
+            elif i + 1 < total:
+                # Skip ahead to the newest tick that is already due rather than sending a burst of old ones
+                repeat, point = divmod(i + 1, points)
+                if now >= start + repeat * self.duration + times[point]:
+                    self._skipped += 1
+                    i += 1
+                    continue
+
+            row = self._positions[point]
+            for target, (x, y, z) in zip(self._targets, row):
+                target.X = x
+                target.Y = y
+                target.Z = z
+            self._current = row
+            lateness = now - due
+            with set_timer:
+                result = self.robot.motor.set(self.motor_sample)
+            if result.Success:
+                self._sent += 1
+            else:
+                self._failed += 1
+                self.last_error = result
+            self._lateness_total += lateness
+            self._lateness_max = max(self._lateness_max, lateness)
+            i += 1
+        self._done.set()
+
+    def _track(self):
+        while self._running and not self._done.is_set():
+            prop_msg, error = self.robot.proprioception.get(True)
+            current = self._current
+            if not error.Success or prop_msg is None or current is None:
+                continue
+            for effector in prop_msg.Effectors:
+                index = self._index.get(effector.EffectorLinkName)
+                if index is None:
+                    continue
+                position = effector.EndTransform.Position
+                x, y, z = current[index]
+                distance = math.sqrt((position.X - x) ** 2 + (position.Y - y) ** 2 + (position.Z - z) ** 2)
+                self._tracking_samples += 1
+                self._tracking_squares += distance * distance
+                self._tracking_max = max(self._tracking_max, distance)
+
+    def stats(self) -> TrajectoryStats:
+        """Return send counts, how late ticks were sent and how closely the effectors followed their targets."""
+        handled = self._sent + self._failed
+        mean_lateness = self._lateness_total / handled if handled else 0.0
+        rms = math.sqrt(self._tracking_squares / self._tracking_samples) if self._tracking_samples else 0.0
+        return TrajectoryStats(len(self._times), len(self.effectors), self._sent, self._failed, self._skipped,
+                               mean_lateness, self._lateness_max, self._tracking_samples, rms, self._tracking_max)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+from typing import Dict, List, Optional, Tuple
+
+import bow_data
+import cv2
+import numpy as np
+
+
+class _FrameBuffer:
+    """Preallocated output storage for a single image source."""
+
+    def __init__(self, image_type, width: int, height: int, colourise_depth: bool):
+        self.image_type = image_type
+        self.width = width
+        self.height = height
+
+        if image_type == bow_data.ImageSample.ImageTypeEnum.RGB:
+            # I420 frames carry a full resolution Y plane followed by quarter resolution U and V planes
+            self.expected_size = width * height * 3 // 2
+            self.raw_shape = (height * 3 // 2, width)
+            self.raw_dtype = np.uint8
+            self.output = np.empty((height, width, 3), np.uint8)
+        else:
+            self.expected_size = width * height * 2
+            self.raw_shape = (height, width)
+            self.raw_dtype = np.uint16
+            if colourise_depth:
+                self.normalised = np.empty((height, width), np.uint8)
+                self.output = np.empty((height, width, 3), np.uint8)
+            else:
+                self.output = None
+
+    def matches(self, image_type, width: int, height: int) -> bool:
+        return self.image_type == image_type and self.width == width and self.height == height
+
+
+class ImageDecoder:
+    """
+    Convert bow_data.ImageSample messages into OpenCV images without allocating a new array per frame.
+
+    One output buffer is kept per image source and is only reallocated when the source changes type or
+    resolution. The array returned by decode() is therefore overwritten by the next decode of the same
+    source, so copy it if it needs to outlive the current loop iteration.
+    """
+
+    def __init__(self, colourise_depth: bool = False):
+        """
+        :param colourise_depth: Normalise depth images and apply a colour map instead of returning the raw
+            uint16 values.
+        """
+        self.colourise_depth = colourise_depth
+        self._buffers: Dict[str, _FrameBuffer] = {}
+
+    def _get_buffer(self, img_data) -> Optional[_FrameBuffer]:
+        image_type = img_data.ImageType
+        if image_type != bow_data.ImageSample.ImageTypeEnum.RGB and \
+                image_type != bow_data.ImageSample.ImageTypeEnum.DEPTH:
+            return None
+
+        width = int(img_data.DataShape[0])
+        height = int(img_data.DataShape[1])
+        buffer = self._buffers.get(img_data.Source)
+        if buffer is None or not buffer.matches(image_type, width, height):
+            buffer = _FrameBuffer(image_type, width, height, self.colourise_depth)
+            self._buffers[img_data.Source] = buffer
+        return buffer
+
+    def decode(self, img_data) -> Optional[np.ndarray]:
+        """
+        Decode a single image sample.
+
+        :param img_data: The bow_data.ImageSample to decode.
+        :return: An RGB image for RGB samples, a uint16 (or colour mapped) image for DEPTH samples, or None if
+            the sample is empty, truncated or of an unhandled type.
+        """
+        if len(img_data.DataShape) < 2:
+            return None
+
+        buffer = self._get_buffer(img_data)
+        if buffer is None:
+            return None
+
+        if len(img_data.Data) < buffer.expected_size:
+            return None
+
+        raw = np.frombuffer(img_data.Data, buffer.raw_dtype, count=buffer.expected_size // np.dtype(
+            buffer.raw_dtype).itemsize).reshape(buffer.raw_shape)
+
+        if buffer.image_type == bow_data.ImageSample.ImageTypeEnum.RGB:
+            cv2.cvtColor(raw, cv2.COLOR_YUV2RGB_I420, dst=buffer.output)
+            return buffer.output
+
+        if buffer.output is None:
+            # Raw depth is returned as a read-only view onto the sample data
+            return raw
+
+        cv2.normalize(raw, buffer.normalised, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8UC1)
+        cv2.applyColorMap(buffer.normalised, cv2.COLORMAP_JET, dst=buffer.output)
+        return buffer.output
+
+    def decode_all(self, samples, new_only: bool = True) -> List[Tuple[object, np.ndarray]]:
+        """
+        Decode every sample in a list, skipping any that cannot be decoded.
+
+        :param samples: An iterable of bow_data.ImageSample, e.g. the Samples field returned by vision.get.
+        :param new_only: Skip samples whose NewDataFlag is not set.
+        :return: A list of (sample, image) pairs.
+        """
+        decoded = []
+        for img_data in samples:
+            if new_only and not img_data.NewDataFlag:
+                continue
+            image = self.decode(img_data)
+            if image is not None:
+                decoded.append((img_data, image))
+        return decoded
+
+    def release(self, source: Optional[str] = None):
+        """
+        Free the buffers held for one source, or for all sources if none is given.
+
+        :param source: The ImageSample.Source whose buffer should be released.
+        """
+        if source is None:
+            self._buffers.clear()
+        else:
+            self._buffers.pop(source, None)
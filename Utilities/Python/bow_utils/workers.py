@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .inference import _attach
+from .motor import MotorScheduler
+from .recorder import parse_message, serialise_message
+from .vision import ImageDecoder
+
+# Channels which only receive commands, every other channel is read in its own thread by the worker
+_COMMAND_CHANNELS = ("motor", "speech", "voice")
+
+
+class WorkerFrame(NamedTuple):
+    """A decoded image received from a robot worker."""
+    robot: str
+    source: str
+    image: np.ndarray  # Owned by the supervisor and overwritten by the next frame from the same camera
+    timestamp: float  # time.time() when the worker received the image
+
+
+class WorkerStats(NamedTuple):
+    """The state of one robot worker process."""
+    robot: str
+    alive: bool
+    ready: bool
+    pid: int
+    restarts: int
+    cpu_percent: float  # CPU time used by the worker over the last stats period, as a percentage of one core
+    loop_rates: Dict[str, float]  # get calls per second on each channel over the last stats period
+    frames: int  # Frames received by the supervisor
+    dropped: int  # Frames the worker dropped because every slot was still waiting to be read
+    last_error: Optional[str]
+
+
+class _RobotWorker:
+    """The part of a robot worker which runs in the worker process."""
+
+    def __init__(self, details, channels: Sequence[str], motor_rate: float, motor_keepalive: Optional[float],
+                 app_name: str, frame_slots: int, stats_period: float, results, commands):
+        self.details = details
+        self.channels = list(channels)
+        self.motor_rate = motor_rate
+        self.motor_keepalive = motor_keepalive
+        self.app_name = app_name
+        self.stats_period = stats_period
+        self.results = results
+        self.commands = commands
+        self.running = True
+
+        self._send_lock = threading.Lock()
+        self._slots: List[Optional[shared_memory.SharedMemory]] = [None] * frame_slots
+        self._free = list(range(frame_slots))
+        self._free_lock = threading.Lock()
+        self._loops: Dict[str, int] = {}
+        self._dropped = 0
+
+    def send(self, *message):
+        with self._send_lock:
+            self.results.send(message)
+
+    def run(self):
+        import bow_api
+        import bow_data
+
+        result = bow_api.setup(app_name=self.app_name, verbose=False)
+        if result.Success:
+            result = bow_api.login_user("", "", True)
+        if result.Success:
+            robot = bow_api.Robot(self.details)
+            result = robot.connect()
+        if not result.Success:
+            self.send("error", f"Could not connect: {result.Description}")
+            return
+
+        for channel in self.channels:
+            result = robot.open_channel(channel)
+            if not result.Success:
+                self.send("error", f"Failed to open {channel} channel: {result.Description}")
+                robot.disconnect()
+                return
+
+        scheduler = None
+        if "motor" in self.channels:
+            scheduler = MotorScheduler(robot, rate=self.motor_rate, keepalive=self.motor_keepalive)
+            scheduler.start()
+
+        readers = [threading.Thread(target=self._read, args=(robot, channel), name=f"Worker-{channel}", daemon=True)
+                   for channel in self.channels if channel not in _COMMAND_CHANNELS]
+        for reader in readers:
+            reader.start()
+        threading.Thread(target=self._report, name="WorkerStats", daemon=True).start()
+        self.send("ready", os.getpid())
+
+        try:
+            while self.running:
+                try:
+                    command = self.commands.recv()
+                except EOFError:
+                    # The supervisor has gone away
+                    break
+                if command[0] == "release":
+                    with self._free_lock:
+                        self._free.append(command[1])
+                elif command[0] == "motor" and scheduler is not None:
+                    scheduler.set(bow_data.MotorSample.FromString(command[1]))
+                elif command[0] == "stop":
+                    break
+        finally:
+            self.running = False
+            if scheduler is not None:
+                scheduler.stop()
+            for reader in readers:
+                reader.join(1.0)
+            robot.disconnect()
+            bow_api.close_client_interface()
+            for shm in self._slots:
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+
+    def _read(self, robot, channel: str):
+        decoder = ImageDecoder()
+        get = getattr(robot, channel).get
+        self._loops[channel] = 0
+        while self.running:
+            sample, error = get(True)
+            self._loops[channel] += 1
+            if not error.Success or sample is None:
+                continue
+            if channel == "vision":
+                for img_data, image in decoder.decode_all(sample.Samples):
+                    self._publish_frame(img_data.Source, image)
+            else:
+                self.send("sample", channel, *serialise_message(sample))
+
+    def _publish_frame(self, source: str, image: np.ndarray):
+        with self._free_lock:
+            if len(self._free) == 0:
+                self._dropped += 1
+                return
+            slot = self._free.pop()
+
+        shm = self._slots[slot]
+        if shm is None or shm.size < image.nbytes:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            shm = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+            self._slots[slot] = shm
+        np.copyto(np.ndarray(image.shape, image.dtype, buffer=shm.buf), image)
+        self.send("frame", slot, shm.name, image.shape, image.dtype.str, source, time.time())
+
+    def _report(self):
+        while self.running:
+            time.sleep(self.stats_period)
+            self.send("stats", time.process_time(), time.monotonic(), dict(self._loops), self._dropped)
+
+
+def _worker_main(details, channels, motor_rate, motor_keepalive, app_name, frame_slots, stats_period, results,
+                 commands):
+    # Ctrl-C reaches every process in the terminal, leave it to the supervisor to stop the workers in order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _RobotWorker(details, channels, motor_rate, motor_keepalive, app_name, frame_slots, stats_period, results,
+                 commands).run()
+
+
+class _WorkerHandle:
+    """The supervisor's view of one robot worker process."""
+
+    def __init__(self, details):
+        self.details = details
+        self.name = details.name
+        self.process = None
+        self.results = None
+        self.commands = None
+        self.ready = False
+        self.pid = 0
+        self.restarts = 0
+        self.restart_at = 0.0
+        self.started_at = 0.0
+        self.last_message = 0.0
+        self.last_error: Optional[str] = None
+        self.reported_error = False
+        self.last_motor: Optional[bytes] = None
+        self.attached: Dict[int, shared_memory.SharedMemory] = {}
+        self.created = set()
+        self.frames = 0
+        self.dropped = 0
+        self.cpu_percent = 0.0
+        self.loop_rates: Dict[str, float] = {}
+        self.previous_stats: Optional[Tuple[float, float, Dict[str, int]]] = None
+
+
+class FleetSupervisor:
+    """
+    Run every robot in its own worker process, so the GIL and one slow robot never hold up the others.
+
+    Each worker connects to its robot, opens its channels, reads every sensing channel on its own thread and sends
+    motor commands through a MotorScheduler. Decoded images come back through a few shared memory slots per worker,
+    with only a short message over a pipe, and are dropped by the worker rather than queued when the supervisor
+    falls behind. Other samples and motor commands are sent serialised over the pipes. Workers that exit, or stop
+    reporting for heartbeat_timeout seconds, are restarted and sent the last motor command again.
+
+    The workers are started with the "spawn" method, so scripts using this must guard their entry point with
+    if __name__ == "__main__".
+    """
+
+    def __init__(self, robots: Sequence, channels: Sequence[str] = ("vision", "motor"), motor_rate: float = 50.0,
+                 motor_keepalive: Optional[float] = None, app_name: str = "Fleet Worker", frame_slots: int = 2,
+                 stats_period: float = 1.0, heartbeat_timeout: float = 5.0, startup_timeout: float = 30.0,
+                 restart_delay: float = 1.0, max_restarts: Optional[int] = None):
+        """
+        :param robots: The details of each robot to run, as returned in get_robots().robots.
+        :param channels: The channels each worker opens.
+        :param motor_rate: The number of motor commands each worker sends per second.
+        :param motor_keepalive: The longest in seconds between sends of an unchanged motor command, or None to
+            send it at the motor rate regardless.
+        :param app_name: The name each worker gives bow_api.setup.
+        :param frame_slots: The number of images per worker that may be waiting to be read by poll().
+        :param stats_period: Seconds between the statistics, and heartbeats, sent by each worker.
+        :param heartbeat_timeout: Seconds without a message from a running worker before it is restarted.
+        :param startup_timeout: Seconds a worker may take to connect before it is restarted.
+        :param restart_delay: Seconds to wait before restarting a worker that has stopped.
+        :param max_restarts: The most times to restart each worker, or None to keep restarting it.
+        """
+        self.channels = list(channels)
+        self.motor_rate = motor_rate
+        self.motor_keepalive = motor_keepalive
+        self.app_name = app_name
+        self.frame_slots = frame_slots
+        self.stats_period = stats_period
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.restart_delay = restart_delay
+        self.max_restarts = max_restarts
+
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = [_WorkerHandle(details) for details in robots]
+        self._images: Dict[Tuple[str, str], np.ndarray] = {}
+        self._latest: Dict[Tuple[str, str], Any] = {}
+        self._running = False
+
+    @property
+    def robots(self) -> List[str]:
+        return [worker.name for worker in self._workers]
+
+    def start(self):
+        """Start a worker for every robot."""
+        if self._running:
+            return
+        self._running = True
+        for worker in self._workers:
+            self._start_worker(worker)
+
+    def stop(self, timeout: float = 2.0):
+        """
+        Stop every worker, disconnecting its robot.
+
+        :param timeout: Maximum time in seconds to wait for each worker to exit.
+        """
+        self._running = False
+        for worker in self._workers:
+            if worker.process is not None:
+                try:
+                    worker.commands.send(("stop",))
+                except (BrokenPipeError, OSError):
+                    pass
+        for worker in self._workers:
+            if worker.process is not None:
+                self._stop_worker(worker, timeout)
+
+    def _start_worker(self, worker: _WorkerHandle):
+        results_reader, results_writer = self._context.Pipe(duplex=False)
+        commands_reader, commands_writer = self._context.Pipe(duplex=False)
+        worker.process = self._context.Process(
+            target=_worker_main, name=f"RobotWorker-{worker.name}", daemon=True,
+            args=(worker.details, self.channels, self.motor_rate, self.motor_keepalive, self.app_name,
+                  self.frame_slots, self.stats_period, results_writer, commands_reader))
+        worker.process.start()
+        # Close our copies of the worker's ends, so a dead worker shows up as the end of its pipe
+        results_writer.close()
+        commands_reader.close()
+        worker.results = results_reader
+        worker.commands = commands_writer
+        worker.ready = False
+        worker.reported_error = False
+        worker.pid = worker.process.pid
+        worker.started_at = worker.last_message = time.monotonic()
+        worker.previous_stats = None
+
+    def _stop_worker(self, worker: _WorkerHandle, timeout: float):
+        worker.process.join(timeout)
+        if worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join(timeout)
+        worker.process = None
+        worker.ready = False
+        worker.results.close()
+        worker.commands.close()
+
+        for shm in worker.attached.values():
+            shm.close()
+        worker.attached = {}
+        # Remove any slots a crashed worker could not, which are already gone if it exited cleanly
+        for name in worker.created:
+            try:
+                shared_memory.SharedMemory(name=name).unlink()
+            except FileNotFoundError:
+                pass
+        worker.created = set()
+
+    def _restart(self, worker: _WorkerHandle, reason: str):
+        print(f"Robot worker {worker.name} {reason}")
+        if not worker.reported_error:
+            worker.last_error = reason
+        self._stop_worker(worker, 0.5)
+        if self.max_restarts is None or worker.restarts < self.max_restarts:
+            worker.restarts += 1
+            worker.restart_at = time.monotonic() + self.restart_delay
+
+    def set_motor(self, motor_sample, robot: Optional[str] = None):
+        """
+        Publish the motor command each worker sends until it is replaced.
+
+        Workers are only sent the command when it differs from the last one they were sent.
+
+        :param motor_sample: The bow_data.MotorSample, which is serialised once for every worker.
+        :param robot: The name of the robot to command, or None for every robot.
+        """
+        data = motor_sample.SerializeToString()
+        for worker in self._workers:
+            if (robot is not None and worker.name != robot) or data == worker.last_motor:
+                continue
+            worker.last_motor = data
+            if worker.ready:
+                self._send(worker, ("motor", data))
+
+    def _send(self, worker: _WorkerHandle, command):
+        try:
+            worker.commands.send(command)
+        except (BrokenPipeError, OSError):
+            # Picked up by the next poll
+            pass
+
+    def latest(self, robot: str, channel: str):
+        """
+        :return: The most recent sample received on a channel from a robot, or None.
+        """
+        return self._latest.get((robot, channel))
+
+    def poll(self, timeout: Optional[float] = 0) -> List[WorkerFrame]:
+        """
+        Receive everything the workers have sent and restart any that have stopped.
+
+        :param timeout: Maximum time in seconds to wait for the first message, 0 to return immediately or None to
+            wait indefinitely.
+        :return: The newest frame from each camera that sent one. Each image is only valid until the next poll.
+        """
+        now = time.monotonic()
+        for worker in self._workers:
+            if worker.process is None:
+                if self._running and worker.restart_at > 0 and now >= worker.restart_at:
+                    worker.restart_at = 0.0
+                    self._start_worker(worker)
+                continue
+            limit = self.heartbeat_timeout if worker.ready else self.startup_timeout
+            if not worker.process.is_alive():
+                self._restart(worker, f"exited with code {worker.process.exitcode}")
+            elif now - worker.last_message > limit:
+                self._restart(worker, f"sent nothing for {limit:.0f}s")
+
+        readers = {worker.results: worker for worker in self._workers if worker.process is not None}
+        frames: Dict[Tuple[str, str], WorkerFrame] = {}
+        for connection in wait(list(readers), timeout):
+            worker = readers[connection]
+            try:
+                # Drain everything already waiting on this worker's pipe
+                while connection.poll():
+                    self._receive(worker, connection.recv(), frames)
+            except (EOFError, OSError):
+                # The worker has exited, the next poll restarts it
+                pass
+        return list(frames.values())
+
+    def _receive(self, worker: _WorkerHandle, message, frames: Dict[Tuple[str, str], WorkerFrame]):
+        worker.last_message = time.monotonic()
+        kind = message[0]
+        if kind == "frame":
+            _, slot, name, shape, dtype, source, timestamp = message
+            shm = worker.attached.get(slot)
+            if shm is None or shm.name != name:
+                if shm is not None:
+                    shm.close()
+                shm = _attach(name)
+                worker.attached[slot] = shm
+                worker.created.add(name)
+
+            key = (worker.name, source)
+            image = self._images.get(key)
+            if image is None or image.shape != shape or image.dtype != np.dtype(dtype):
+                image = np.empty(shape, dtype)
+                self._images[key] = image
+            np.copyto(image, np.ndarray(shape, dtype, buffer=shm.buf))
+            self._send(worker, ("release", slot))
+            worker.frames += 1
+            frames[key] = WorkerFrame(worker.name, source, image, timestamp)
+        elif kind == "sample":
+            _, channel, message_type, data = message
+            self._latest[(worker.name, channel)] = parse_message(message_type, data)
+        elif kind == "stats":
+            _, cpu_time, wall_time, loops, dropped = message
+            worker.dropped = dropped
+            if worker.previous_stats is not None:
+                previous_cpu, previous_wall, previous_loops = worker.previous_stats
+                elapsed = max(wall_time - previous_wall, 1e-9)
+                worker.cpu_percent = 100.0 * (cpu_time - previous_cpu) / elapsed
+                worker.loop_rates = {channel: (count - previous_loops.get(channel, 0)) / elapsed
+                                     for channel, count in loops.items()}
+            worker.previous_stats = (cpu_time, wall_time, loops)
+        elif kind == "ready":
+            worker.ready = True
+            worker.pid = message[1]
+            if worker.last_motor is not None:
+                self._send(worker, ("motor", worker.last_motor))
+        elif kind == "error":
+            print(f"Robot worker {worker.name}: {message[1]}")
+            worker.last_error = message[1]
+            worker.reported_error = True
+
+    def stats(self) -> Dict[str, WorkerStats]:
+        """Return the state, CPU use and loop rates of every worker, by robot name."""
+        return {worker.name: WorkerStats(worker.name, worker.process is not None and worker.process.is_alive(),
+                                         worker.ready, worker.pid, worker.restarts, worker.cpu_percent,
+                                         dict(worker.loop_rates), worker.frames, worker.dropped, worker.last_error)
+                for worker in self._workers}
+
+    def report(self) -> str:
+        """Format the stats of every worker as a table."""
+        lines = [f"{'robot':<24} {'alive':>5} {'pid':>7} {'restarts':>8} {'cpu':>6} {'frames':>7} {'dropped':>7}  "
+                 "loop rates"]
+        for s in self.stats().values():
+            rates = ", ".join(f"{channel} {rate:.1f}/s" for channel, rate in s.loop_rates.items())
+            lines.append(f"{s.robot:<24} {str(s.alive):>5} {s.pid:>7} {s.restarts:>8} {s.cpu_percent:>5.1f}% "
+                         f"{s.frames:>7} {s.dropped:>7}  {rates}")
+        return "\n".join(lines)
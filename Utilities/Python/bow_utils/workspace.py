@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+from typing import Dict, List, Mapping, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from .trajectory import Trajectory, controllable_effectors
+
+# What to do with targets an effector cannot reach
+CLAMP = "clamp"  # Move them to the nearest reachable position
+REJECT = "reject"  # Leave them out of the trajectory
+RAISE = "raise"  # Raise a ValueError before anything is sent
+
+
+class EffectorModel(NamedTuple):
+    """The dimensions of an effector's kinematic chain."""
+    effector: str  # The effector's EffectorLinkName
+    root: Tuple[float, float, float]  # The position of the root of the chain, in metres
+    reach: float  # The length of the chain at full stretch, in metres
+
+
+class EffectorWorkspace(NamedTuple):
+    """The region an effector can reach, as a shell around the root of its kinematic chain."""
+    effector: str  # The effector's EffectorLinkName
+    root: Tuple[float, float, float]  # The position of the root of the chain, in metres
+    reach: float  # The furthest from the root a target may be, in metres
+    inner: float  # The closest to the root a target may be, in metres
+
+
+class ReachabilityReport(NamedTuple):
+    """How much of one effector's trajectory was out of reach."""
+    effector: str
+    points: int
+    unreachable: int
+    max_excess: float  # The furthest a target lay outside the workspace, in metres
+
+    @property
+    def reachable(self) -> bool:
+        return self.unreachable == 0
+
+
+def effector_models(prop_msg) -> List[EffectorModel]:
+    """
+    :param prop_msg: A bow_data.ProprioceptionSample.
+    :return: The dimensions of every controllable effector.
+    """
+    return [EffectorModel(effector.EffectorLinkName, (float(effector.RootTransform.Position.X),
+                                                      float(effector.RootTransform.Position.Y),
+                                                      float(effector.RootTransform.Position.Z)),
+                          float(effector.Reach))
+            for effector in controllable_effectors(prop_msg)]
+
+
+class Workspace:
+    """
+    Check inverse kinematics targets against where each effector can reach before sending them.
+
+    Each effector is modelled as able to reach targets between an inner and an outer distance from the root of its
+    kinematic chain, taken from the RootTransform, EndTransform and Reach its proprioception reports. This is coarser
+    than the solver on the robot, but it catches targets that cannot possibly be reached before they are sent, rather
+    than after the solver has spent time on them, and whole trajectories are checked in one set of NumPy operations.
+    """
+
+    def __init__(self, effectors: Sequence[EffectorWorkspace]):
+        self.effectors: Dict[str, EffectorWorkspace] = {workspace.effector: workspace for workspace in effectors}
+        self._index = {effector: i for i, effector in enumerate(self.effectors)}
+        self._roots = np.array([workspace.root for workspace in self.effectors.values()],
+                               dtype=np.float64).reshape(-1, 3)
+        self._reach = np.array([workspace.reach for workspace in self.effectors.values()], dtype=np.float64)
+        self._inner = np.array([workspace.inner for workspace in self.effectors.values()], dtype=np.float64)
+
+    @classmethod
+    def from_models(cls, models: Sequence[EffectorModel], prop_msg=None, margin: float = 0.95,
+                    inner: float = 0.1) -> "Workspace":
+        """
+        Build the workspace of every effector from its dimensions.
+
+        :param models: The dimensions of the effectors, e.g. from effector_models().
+        :param prop_msg: A bow_data.ProprioceptionSample giving where the effectors are now, which is always
+            treated as reachable, or None.
+        :param margin: The fraction of each effector's reach to allow, since targets at full stretch are hard for
+            the solver.
+        :param inner: The fraction of each effector's reach closest to the root that is out of bounds.
+        """
+        ends = {} if prop_msg is None else {effector.EffectorLinkName: effector.EndTransform.Position
+                                            for effector in controllable_effectors(prop_msg)}
+        workspaces = []
+        for model in models:
+            reach = model.reach * margin
+            closest = model.reach * inner
+            end = ends.get(model.effector)
+            if end is not None:
+                # Where the effector is now is reachable, whatever the margin says
+                current = float(np.linalg.norm(np.array([end.X, end.Y, end.Z]) - model.root))
+                reach = max(reach, current)
+                closest = min(closest, current)
+            workspaces.append(EffectorWorkspace(model.effector, model.root, reach, closest))
+        return cls(workspaces)
+
+    @classmethod
+    def from_proprioception(cls, prop_msg, margin: float = 0.95, inner: float = 0.1) -> "Workspace":
+        """
+        Build the workspace of every controllable effector.
+
+        :param prop_msg: A bow_data.ProprioceptionSample.
+        :param margin: The fraction of each effector's reach to allow, since targets at full stretch are hard for
+            the solver.
+        :param inner: The fraction of each effector's reach closest to the root that is out of bounds.
+        """
+        return cls.from_models(effector_models(prop_msg), prop_msg, margin, inner)
+
+    def _excess(self, index: np.ndarray, positions: np.ndarray):
+        offsets = positions - self._roots[index]
+        distances = np.linalg.norm(offsets, axis=1)
+        excess = np.maximum(distances - self._reach[index], self._inner[index] - distances)
+        return offsets, distances, excess
+
+    def reachable(self, effector: str, positions) -> np.ndarray:
+        """
+        :param effector: The EffectorLinkName of the effector.
+        :param positions: Target positions, of shape (points, 3).
+        :return: Whether each target is within the effector's workspace.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        index = np.full(len(positions), self._index[effector])
+        return self._excess(index, positions)[2] <= 0.0
+
+    def clamp(self, effector: str, positions) -> np.ndarray:
+        """
+        :param effector: The EffectorLinkName of the effector.
+        :param positions: Target positions, of shape (points, 3).
+        :return: The targets moved, along the line from the root, to the nearest position within the workspace.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        index = np.full(len(positions), self._index[effector])
+        return self._clamp(index, positions, *self._excess(index, positions)[:2])
+
+    def _clamp(self, index: np.ndarray, positions: np.ndarray, offsets: np.ndarray, distances: np.ndarray):
+        limited = np.clip(distances, self._inner[index], self._reach[index])
+        # A target exactly on the root has no direction to move it in, so move it straight up
+        directions = np.where(distances[:, None] > 0.0, offsets / np.maximum(distances, 1e-12)[:, None],
+                              np.array([0.0, 0.0, 1.0]))
+        clamped = self._roots[index] + directions * limited[:, None]
+        return np.where((limited == distances)[:, None], positions, clamped)
+
+    def check(self, trajectories: Mapping[str, Trajectory], unreachable: str = CLAMP
+              ) -> Tuple[Dict[str, Trajectory], Dict[str, ReachabilityReport]]:
+        """
+        Check every target of every effector's trajectory at once.
+
+        :param trajectories: The trajectories to check, by EffectorLinkName.
+        :param unreachable: What to do with targets out of reach: CLAMP them to the nearest reachable position,
+            REJECT them by leaving them out, or RAISE a ValueError.
+        :return: The trajectories to send, without any effector that has no reachable targets left, and a report
+            for each effector.
+        """
+        if unreachable not in (CLAMP, REJECT, RAISE):
+            raise ValueError(f"Unknown way to handle unreachable targets: {unreachable}")
+        unknown = [effector for effector in trajectories if effector not in self._index]
+        if unknown:
+            raise ValueError(f"No workspace for effector {', '.join(unknown)}")
+
+        effectors = list(trajectories)
+        counts = [trajectories[effector].points for effector in effectors]
+        index = np.repeat([self._index[effector] for effector in effectors], counts)
+        positions = np.concatenate([trajectories[effector].positions for effector in effectors]).reshape(-1, 3)
+        offsets, distances, excess = self._excess(index, positions)
+        outside = excess > 0.0
+        if unreachable == CLAMP:
+            positions = self._clamp(index, positions, offsets, distances)
+
+        checked = {}
+        reports = {}
+        starts = np.cumsum([0] + counts)
+        for effector, begin, end in zip(effectors, starts[:-1], starts[1:]):
+            trajectory = trajectories[effector]
+            rejected = outside[begin:end]
+            reports[effector] = ReachabilityReport(effector, int(end - begin), int(rejected.sum()),
+                                                   float(max(excess[begin:end].max(initial=0.0), 0.0)))
+            if unreachable == CLAMP:
+                checked[effector] = trajectory._replace(positions=positions[begin:end])
+            elif unreachable == REJECT:
+                if not rejected.all():
+                    checked[effector] = trajectory._replace(times=trajectory.times[~rejected],
+                                                            positions=trajectory.positions[~rejected])
+            else:
+                checked[effector] = trajectory
+
+        if unreachable == RAISE and outside.any():
+            failed = [report for report in reports.values() if not report.reachable]
+            raise ValueError("Unreachable targets: " + ", ".join(
+                f"{report.unreachable} of {report.points} for {report.effector}, up to {report.max_excess:.3f}m "
+                f"out of reach" for report in failed))
+        return checked, reports
+
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+"""
+Stand-in for bow_api which serves a recorded session instead of connecting to a robot.
+
+Put this directory first on the module search path, or use `python -m bow_utils.replay`, and set BOW_REPLAY to
+the recording to play. See bow_utils.replay for details.
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bow_utils.replay import get_backend
+
+
+def __getattr__(name):
+    # The recording is only loaded once the program actually uses the API
+    return getattr(get_backend(), name)
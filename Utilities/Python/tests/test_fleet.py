@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2024, Bettering Our Worlds (BOW) Ltd.
+# All Rights Reserved
+
+"""
+Run from the repository root with:
+
+    PYTHONPATH=Utilities/Python python -m unittest discover Utilities/Python/tests
+"""
+
+import asyncio
+import time
+import unittest
+from typing import NamedTuple
+
+from bow_utils.fleet import Fleet
+
+
+class _Result(NamedTuple):
+    Success: bool
+    Description: str = ""
+
+
+class _Details(NamedTuple):
+    name: str
+
+
+class _SlowChannel:
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def get(self, blocking: bool = True):
+        time.sleep(self.delay)
+        return object(), _Result(True)
+
+
+class _StalledRobot:
+    """A robot whose every vision.get takes longer than the fleet waits for it."""
+
+    def __init__(self, name: str, delay: float):
+        self.robot_details = _Details(name)
+        self.vision = _SlowChannel(delay)
+
+    def connect(self):
+        return _Result(True)
+
+    def open_channel(self, channel: str):
+        return _Result(True)
+
+    def disconnect(self):
+        return _Result(True)
+
+
+class FleetGetAllTest(unittest.TestCase):
+    def test_stalled_robots_are_still_collected(self):
+        async def run():
+            fleet = Fleet(channels=["vision"])
+            await fleet.connect([_StalledRobot("alpha", 0.15), _StalledRobot("beta", 0.15)])
+            iterations = 0
+            samples = 0
+            end = time.monotonic() + 1.0
+            # A loop with no await other than get_all, as in the MultipleRobots tutorial
+            while time.monotonic() < end:
+                samples += len(await fleet.get_all("vision", timeout=0.1))
+                iterations += 1
+            health = fleet.health()
+            await fleet.disconnect()
+            return iterations, samples, health
+
+        iterations, samples, health = asyncio.run(run())
+        # Every call either waits for a robot or yields, so the loop cannot spin, and every get finishes
+        self.assertLess(iterations, 100)
+        self.assertGreater(samples, 0)
+        for robot in health.values():
+            self.assertGreaterEqual(robot.gets, 5)
+            self.assertEqual(robot.get_errors, 0)
+
+    def test_every_call_yields_to_the_event_loop(self):
+        async def run():
+            fleet = Fleet(channels=["vision"])
+            ticks = 0
+
+            async def other_task():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0)
+
+            task = asyncio.ensure_future(other_task())
+            for _ in range(10):
+                # No robots at all, so there is nothing to wait on
+                await fleet.get_all("vision", timeout=0.1)
+            task.cancel()
+            return ticks
+
+        self.assertGreater(asyncio.run(run()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()